@@ -13,10 +13,13 @@ from canoe_voyaging_utils import datetime_range
 from asv_utils import asv_uncertain
 from sail_route.performance.bbn import gen_env_model
 from sail_route.weather.load_weather import process_era5_weather, change_area_values
+from sail_route.weather.weather_field import gen_weather_field
+from sail_route.ensemble import run_ensemble, iter_ensemble
 from sail_route.sail_routing import Location, Route, \
                                    min_time_calculate, timestamp_to_delta_time
 from sail_route.performance.cost_function import haversine
 from sail_route.route.grid_locations import return_co_ords
+from sail_route.route.geometry import gen_geometry
 from grid_error import calc_h
 
 # pp = "/Users/thomasdickson/Documents/python_routing/"
@@ -96,16 +99,18 @@ def run_simulation_over_days():
     lat2_area1 = 33.0+a1
     wd = change_area_values(wd, 240.0, lon1_area1, lat1_area1,
                             lon2_area1, lat2_area1)
-    for t in dt:
-        jt, et, x_r, y_r = min_time_calculate(r, t, craft,
-                                              x, y, land,
-                                              tws, twd, wd, wh, wp)
+    weather = gen_weather_field(x, y, tws, twd, wd, wh, wp)
+    results = iter_ensemble(r, (x, y, land), weather, [craft], dt,
+                            geometry=gen_geometry(r, x, y),
+                            return_times=True)
+    for res in sorted(results, key=lambda res: res['departure']):
+        t, jt = res['time'], res['journey_time']
         vt = datetime.fromtimestamp(jt) - t
         print("Journey time is: ", vt)
         fill = 10
         string = str(t)+"_"+str(craft.apf)+"_"+str(craft.unc)+"_"+str(n_nodes)
-        plot_failure_route(t, r, x, y, x_r, y_r,
-                           et, jt, fill,
+        plot_failure_route(t, r, x, y, res['x_route'], res['y_route'],
+                           res['earl_time'], jt, fill,
                            dia_path+string+"_")
 
 
@@ -156,7 +161,6 @@ def reliability_uncertainty_routing():
     unc_levels = np.array([0.95, 1.0, 1.05])
     test_matrix = np.array(np.meshgrid(rel_levels,
                                        unc_levels)).T.reshape(-1, 2)
-    fts = []
     start = Location(-2.3700, 50.256)
     finish = Location(-61.777, 17.038)
     fm = gen_env_model()
@@ -174,15 +178,12 @@ def reliability_uncertainty_routing():
                                 r.start.lat, r.finish.lat,
                                 r.n_ranks, r.n_width, r.d_node)
     tws, twd, wd, wh, wp = process_era5_weather(weather_path, x, y)
-    for i in range(test_matrix.shape[0]):
-        craft = asv_uncertain(test_matrix[i, 1], test_matrix[i, 0], fm)
-
-        jt, et, x_r, y_r = min_time_calculate(r, sd, craft,
-                                              x, y, land,
-                                              tws, twd, wd, wh, wp)
-        vt = datetime.fromtimestamp(jt) - sd
-        fts.append(vt.total_seconds())
-    results = np.array(fts)
+    weather = gen_weather_field(x, y, tws, twd, wd, wh, wp)
+    crafts = [asv_uncertain(test_matrix[i, 1], test_matrix[i, 0], fm)
+              for i in range(test_matrix.shape[0])]
+    table = run_ensemble(r, (x, y, land), weather, crafts, [sd],
+                         geometry=gen_geometry(r, x, y))
+    results = table[:, 4]
     print(results)
     save_array = np.hstack((test_matrix, results[..., None]))
     print(save_array)
@@ -225,8 +226,8 @@ def plot_failure_route(start, route, x, y, x_r, y_r, et, jt, fill, fname):
         x, y = map(x, y)
         ctf = map.contourf(x, y, et, cmap='bwr')
         y_tick_labs = [timestamp_to_delta_time(start, x) for x in
-                       np.linspace(et[et < 1e307].min(),
-                                   et[et < 1e307].max(), 9)]
+                       np.linspace(et[np.isfinite(et)].min(),
+                                   et[np.isfinite(et)].max(), 9)]
         cbar = plt.colorbar(ctf, orientation='horizontal')
         cbar.ax.set_xticklabels(y_tick_labs, rotation=25)
         tit = "\n".join(textwrap.wrap("Journey time: " + str(vt), 80))
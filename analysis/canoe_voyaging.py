@@ -10,8 +10,8 @@ from datetime import datetime
 from canoe_voyaging_utils import datetime_range, tong_uncertain
 from sail_route.performance.bbn import gen_env_model
 from sail_route.weather.load_weather import process_wind, process_waves
-from sail_route.sail_routing import Location, Route, \
-                                   min_time_calculate, plot_mt_route
+from sail_route.sail_routing import Location, Route, min_time_calculate
+from sail_route.plotting.plot_route import plot_mt_route
 from sail_route.performance.cost_function import haversine
 from sail_route.route.grid_locations import return_co_ords
 
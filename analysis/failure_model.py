@@ -17,11 +17,13 @@ from canoe_voyaging_utils import datetime_range
 from asv_utils import asv_uncertain
 from sail_route.performance.bbn import gen_env_model
 from sail_route.weather.load_weather import process_era5_weather, change_area_values
-from sail_route.sail_routing import Location, Route, \
-                                   min_time_calculate, plot_mt_route, \
-                                   plot_isochrones
+from sail_route.weather.weather_field import gen_weather_field
+from sail_route.ensemble import run_ensemble
+from sail_route.sail_routing import Location, Route, min_time_calculate
+from sail_route.plotting.plot_route import plot_mt_route, plot_isochrones
 from sail_route.performance.cost_function import haversine
 from sail_route.route.grid_locations import return_co_ords
+from sail_route.route.geometry import gen_geometry
 
 
 pp = "/home/td7g11/pyroute/"
@@ -33,7 +35,6 @@ def failure_controlled_weather():
     unc_levels = np.array([1.0])
     test_matrix = np.array(np.meshgrid(rel_levels,
                                        unc_levels)).T.reshape(-1, 2)
-    fts = []
     start = Location(-2.3700, 50.256)
     finish = Location(-61.777, 17.038)
     fm = gen_env_model()
@@ -78,15 +79,12 @@ def failure_controlled_weather():
     wh = change_area_values(wh, 4.0, lon1_area2, lat1_area2, lon2_area2,
                             lat2_area2)
 
-    for i in range(test_matrix.shape[0]):
-        craft = asv_uncertain(test_matrix[i, 1], test_matrix[i, 0], fm)
-
-        jt, et, x_r, y_r = min_time_calculate(r, sd, craft,
-                                              x, y, land,
-                                              tws, twd, wd, wh, wp)
-        vt = datetime.fromtimestamp(jt) - sd
-        fts.append(vt.total_seconds())
-    results = np.array(fts)
+    weather = gen_weather_field(x, y, tws, twd, wd, wh, wp)
+    crafts = [asv_uncertain(test_matrix[i, 1], test_matrix[i, 0], fm)
+              for i in range(test_matrix.shape[0])]
+    table = run_ensemble(r, (x, y, land), weather, crafts, [sd],
+                         geometry=gen_geometry(r, x, y))
+    results = table[:, 4]
     print(results)
     save_array = np.hstack((test_matrix, results[..., None]))
     print(save_array)
@@ -0,0 +1,60 @@
+"""Benchmarking limited connectivity between ranks.
+
+Routes across the Atlantic over smoothly varying weather are solved with
+full connectivity and with the lateral offset of each leg limited,
+reporting the solve time and the error in voyage time of each. Legs
+are limited either by their lateral offset in nodes or by their
+heading relative to the course. A fixed offset of 5 nodes at every
+width keeps the edges of each node constant, so its solve time grows
+linearly with the width, while offsets of a fixed fraction of the
+width grow quadratically as full connectivity does.
+
+Thomas Dickson
+thomas.dickson@soton.ac.uk
+"""
+
+from context import sail_route, maribot, smooth_weather
+import time
+import numpy as np
+from datetime import datetime
+from sail_route.route.grid_locations import gen_grid
+from sail_route.sail_routing import Location, Route, min_time_calculate
+
+
+def run(n_ranks, n_width, max_offset=None, max_heading=None):
+    """Return the solve time and journey time of one configuration."""
+    start = Location(-2.37, 50.256)
+    finish = Location(-61.777, 17.038)
+    craft = maribot()
+    route = Route(start, finish, n_ranks, n_width, 2e6/n_width, craft,
+                  max_offset=max_offset, max_heading=max_heading)
+    grid = gen_grid(start.long, finish.long, start.lat, finish.lat,
+                    n_ranks, n_width, route.d_node)
+    x, y = grid[..., 0], grid[..., 1]
+    land = np.zeros(x.shape, dtype=bool)
+    t0 = datetime(2016, 1, 1)
+    weather = smooth_weather(x, y, t0)
+    args = (route, t0, craft, x, y, land, None, None, None, None, None)
+    min_time_calculate(*args, weather=weather)
+    start_time = time.perf_counter()
+    jt = min_time_calculate(*args, weather=weather)[0]
+    return time.perf_counter() - start_time, jt - t0.timestamp()
+
+
+if __name__ == '__main__':
+    n_ranks = 50
+    print('{0:>6} {1:>12} {2:>10} {3:>9} {4:>10}'.format(
+        'width', 'connectivity', 'time (s)', 'speedup', 'error (%)'))
+    for n_width in [50, 100, 200, 400]:
+        t_full, v_full = run(n_ranks, n_width)
+        print('{0:6d} {1:>12} {2:10.3f} {3:9.1f} {4:10.3f}'.format(
+            n_width, 'full', t_full, 1.0, 0.0))
+        limits = [('offset 5', {'max_offset': 5})]
+        limits += [('offset {0}'.format(n_width//d),
+                    {'max_offset': n_width//d}) for d in [10, 5, 3]]
+        limits += [('heading {0}'.format(h), {'max_heading': h})
+                   for h in [30, 45, 60]]
+        for name, limit in limits:
+            t, v = run(n_ranks, n_width, **limit)
+            print('{0:6d} {1:>12} {2:10.3f} {3:9.1f} {4:10.3f}'.format(
+                n_width, name, t, t_full/t, 100.0*(v - v_full)/v_full))
@@ -0,0 +1,70 @@
+"""Benchmarking the throughput of the geodesy kernels.
+
+The distance and bearing of every edge between two sets of points, as
+between consecutive ranks of a grid, are computed by calling the scalar
+haversine edge by edge from compiled code, by the array haversine over
+broadcast arrays and by the broadcasting kernels of geodesy in each of
+their modes. Throughput is reported in edges per second.
+
+Thomas Dickson
+thomas.dickson@soton.ac.uk
+"""
+
+from context import sail_route
+import time
+import numpy as np
+from numba import njit
+from sail_route.route.geodesy import haversine, distance_bearing, pairwise
+
+
+@njit
+def scalar_loop(lon1, lat1, lon2, lat2, dist, bearing):
+    """Fill dist and bearing calling haversine once per edge."""
+    for j in range(lon1.shape[0]):
+        for k in range(lon2.shape[0]):
+            dist[j, k], bearing[j, k] = haversine(lon1[j], lat1[j],
+                                                  lon2[k], lat2[k])
+
+
+def broadcast_arrays(lon1, lat1, lon2, lat2):
+    """Call the array haversine over broadcast contiguous arrays."""
+    return haversine(*[np.ascontiguousarray(a) for a in np.broadcast_arrays(
+        lon1[:, None], lat1[:, None], lon2[None, :], lat2[None, :])])
+
+
+def best_time(f, *args, repeat=5):
+    """Return the fastest of repeat calls of f after a warm up call."""
+    f(*args)
+    times = []
+    for r in range(repeat):
+        start_time = time.perf_counter()
+        f(*args)
+        times.append(time.perf_counter() - start_time)
+    return min(times)
+
+
+if __name__ == '__main__':
+    n = 2000
+    rng = np.random.RandomState(0)
+    lon1, lon2 = rng.uniform(-70.0, 0.0, (2, n))
+    lat1, lat2 = rng.uniform(10.0, 60.0, (2, n))
+    out = np.empty((n, n)), np.empty((n, n))
+    cases = [('scalar loop', lambda: scalar_loop(lon1, lat1, lon2, lat2,
+                                                 *out)),
+             ('array haversine', lambda: broadcast_arrays(lon1, lat1, lon2,
+                                                          lat2)),
+             ('broadcast float64', lambda: distance_bearing(
+                 lon1[:, None], lat1[:, None], lon2[None, :],
+                 lat2[None, :])),
+             ('pairwise float64', lambda: pairwise(lon1, lat1, lon2, lat2)),
+             ('pairwise float32', lambda: pairwise(lon1, lat1, lon2, lat2,
+                                                   np.float32)),
+             ('ellipsoid', lambda: distance_bearing(
+                 lon1[:200, None], lat1[:200, None], lon2[None, :],
+                 lat2[None, :], method='ellipsoid'))]
+    print('{0:>18} {1:>10} {2:>14}'.format('kernel', 'time (s)',
+                                           'edges/s'))
+    for name, f in cases:
+        edges = 200*n if name == 'ellipsoid' else n*n
+        t = best_time(f)
+        print('{0:>18} {1:10.4f} {2:14.3e}'.format(name, t, edges/t))
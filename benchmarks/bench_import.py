@@ -0,0 +1,70 @@
+"""Benchmarking the import time of the routing core.
+
+Each module is imported in fresh interpreters, as each job of an array
+does, reporting the median wall time of the import and any plotting or
+GIS packages it loaded. The exit status is non-zero if an import takes
+longer than the budget or loads one of those packages, so the benchmark
+can guard start up in continuous integration.
+
+    python bench_import.py --budget 1.0
+
+Thomas Dickson
+thomas.dickson@soton.ac.uk
+"""
+
+import os
+import sys
+import json
+import argparse
+import subprocess
+import numpy as np
+
+root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+core = ['sail_route.sail_routing', 'sail_route.ensemble',
+        'sail_route.route.reroute', 'sail_route.weather.weather_store']
+heavy = ['matplotlib', 'mpl_toolkits', 'iris', 'cartopy', 'shapely',
+         'pyproj', 'pgmpy', 'xarray', 'xesmf']
+
+probe = """
+import sys, time, json
+before = set(sys.modules)
+start = time.perf_counter()
+import {0}
+elapsed = time.perf_counter() - start
+loaded = {{m.split('.')[0] for m in set(sys.modules) - before}}
+print(json.dumps([elapsed, sorted(loaded)]))
+"""
+
+
+def time_import(module, repeat):
+    """Return the import times of module and the packages it loaded."""
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(
+        [root] + [p for p in [os.environ.get('PYTHONPATH')] if p]))
+    times = []
+    for r in range(repeat):
+        out = subprocess.run([sys.executable, '-c', probe.format(module)],
+                             env=env, capture_output=True, check=True,
+                             text=True).stdout
+        elapsed, loaded = json.loads(out.strip().splitlines()[-1])
+        times.append(elapsed)
+    return times, loaded
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('modules', nargs='*', default=core)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--budget', type=float, default=1.0,
+                        help='seconds allowed for each import')
+    opts = parser.parse_args()
+    failed = False
+    print('{0:>34} {1:>10} {2:>10}  {3}'.format('module', 'median (s)',
+                                                'max (s)', 'heavy'))
+    for module in opts.modules:
+        times, loaded = time_import(module, opts.repeat)
+        found = [m for m in heavy if m in loaded]
+        median = float(np.median(times))
+        print('{0:>34} {1:10.3f} {2:10.3f}  {3}'.format(
+            module, median, max(times), ' '.join(found) or '-'))
+        failed = failed or found or median > opts.budget
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,78 @@
+"""Benchmarking the convergence of routes with interpolated weather.
+
+Transatlantic routes through a synthetic cold front are solved over
+grids of increasing size with the weather sampled at the nearest point
+and time and interpolated trilinearly, reporting the solve time and the
+voyage time of each against that of the finest interpolated grid.
+Sampling the nearest weather makes the voyage time jump as arrival
+times cross the midpoints between weather times, so the largest change
+in voyage time between departures 20 minutes apart over 12 hours is
+also reported.
+
+    python bench_interp.py --sizes 10 20 40 80
+
+Thomas Dickson
+thomas.dickson@soton.ac.uk
+"""
+
+from context import sail_route, maribot
+import time
+import argparse
+import numpy as np
+from datetime import datetime, timedelta
+from sail_route.route.grid_locations import gen_grid
+from sail_route.sail_routing import Location, Route, min_time_calculate
+from sail_route.weather.synthetic import synthetic_weather, grid_axes, \
+    time_axis
+
+start = Location(-2.37, 50.256)
+finish = Location(-61.777, 17.038)
+t0 = datetime(2016, 1, 1)
+
+
+def voyage(n, interp, departures=(0,)):
+    """Return the voyage hours and solve seconds over an n by n grid.
+
+    The route is solved from each of departures minutes after t0, the
+    seconds being those of the first solve.
+    """
+    craft = maribot()
+    route = Route(start, finish, n, n, 2e6/n, craft)
+    grid = gen_grid(start.long, finish.long, start.lat, finish.lat, n, n,
+                    route.d_node)
+    x, y = grid[..., 0], grid[..., 1]
+    land = np.zeros(x.shape, dtype=bool)
+    lon, lat = grid_axes(x, y, resolution=1.0)
+    weather = synthetic_weather('frontal', lon, lat, time_axis(t0, 120, 6),
+                                lon0=-40.0, speed=-0.3, width=5.0)
+    hours = []
+    for m in departures:
+        t = t0 + timedelta(minutes=m)
+        start_time = time.perf_counter()
+        jt = min_time_calculate(route, t, craft, x, y, land, *weather,
+                                interp=interp)[0]
+        if not hours:
+            seconds = time.perf_counter() - start_time
+        hours.append((jt - t.timestamp())/3600.0)
+    return np.array(hours), seconds
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--sizes', type=int, nargs='+',
+                        default=[10, 20, 40, 80])
+    opts = parser.parse_args()
+    voyage(4, 'linear')
+    sizes = sorted(opts.sizes)
+    reference = voyage(sizes[-1], 'linear')[0][0]
+    print('reference voyage {0:.3f} h'.format(reference))
+    print('{0:>6} {1:>9} {2:>11} {3:>11} {4:>10} {5:>9}'.format(
+        'width', 'interp', 'voyage (h)', 'solve (s)', 'error (h)',
+        'step (h)'))
+    for n in sizes:
+        for interp in ['nearest', 'linear']:
+            hours, seconds = voyage(n, interp, range(0, 720, 20))
+            print('{0:6d} {1:>9} {2:11.3f} {3:11.3f} {4:+10.3f} '
+                  '{5:9.3f}'.format(n, interp, hours[0], seconds,
+                                    hours[0] - reference,
+                                    np.abs(np.diff(hours)).max()))
@@ -0,0 +1,77 @@
+"""Benchmarking windowed loading of NetCDF weather.
+
+A global, three hourly ERA5 style file of three months is written and
+one variable is read from it whole, within a voyage's time window and
+within that window and the box around a transatlantic grid. Each load
+runs in its own process, reporting its peak resident set size and how
+far the load raised it above the peak after importing sail_route.
+
+Thomas Dickson
+thomas.dickson@soton.ac.uk
+"""
+
+from context import sail_route
+import os
+import sys
+import time
+import subprocess
+import tempfile
+import numpy as np
+import xarray as xr
+from datetime import datetime
+from sail_route.time_func import peak_rss
+from sail_route.weather.load_weather import load_dataset
+
+window = (datetime(2016, 2, 1), datetime(2016, 2, 21))
+bbox = (-61.777, 17.038, -2.37, 50.256)
+
+
+def write_era5(path, n_times=720):
+    """Write a global 1 degree file of wind speed to path."""
+    times = np.datetime64('2016-01-01T00') + \
+        np.arange(n_times)*np.timedelta64(3, 'h')
+    lat = np.arange(90.0, -91.0, -1.0)
+    lon = np.arange(0.0, 360.0, 1.0)
+    rng = np.random.RandomState(0)
+    wind = rng.uniform(0.0, 20.0, (n_times, lat.size, lon.size)).astype(
+        np.float32)
+    ds = xr.Dataset({'wind': (('time', 'latitude', 'longitude'), wind)},
+                    coords={'time': times, 'latitude': lat,
+                            'longitude': lon})
+    ds.to_netcdf(path)
+
+
+def load(path, mode):
+    """Read the wind in one of the modes, returning seconds and shape."""
+    start_time = time.perf_counter()
+    if mode == 'full':
+        da = load_dataset(path, 'wind')
+    elif mode == 'window':
+        da = load_dataset(path, 'wind', window)
+    else:
+        da = load_dataset(path, 'wind', window, bbox)
+    values = da.values
+    return time.perf_counter() - start_time, values.shape
+
+
+if __name__ == '__main__':
+    if len(sys.argv) == 2:
+        write_era5(sys.argv[1])
+    elif len(sys.argv) == 3:
+        baseline = peak_rss()
+        elapsed, shape = load(*sys.argv[1:])
+        print('{0:>8} {1:>18} {2:9.3f} {3:14.1f} {4:10.1f}'.format(
+            sys.argv[2], 'x'.join(str(n) for n in shape), elapsed,
+            peak_rss(), peak_rss() - baseline))
+    else:
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'era5.nc')
+            # The peak resident set size is kept across fork and exec, so
+            # the file is written by a child rather than this process.
+            subprocess.run([sys.executable, __file__, path], check=True)
+            print('file {0:.1f} MB'.format(os.path.getsize(path)/2.0**20))
+            print('{0:>8} {1:>18} {2:>9} {3:>14} {4:>10}'.format(
+                'mode', 'shape', 'time (s)', 'peak RSS (MB)', 'load (MB)'))
+            for mode in ['full', 'window', 'bbox']:
+                subprocess.run([sys.executable, __file__, path, mode],
+                               check=True)
@@ -0,0 +1,91 @@
+"""Benchmarking incremental re-routing against a full resolve.
+
+A transatlantic route is solved and the craft is then advanced along it,
+a new forecast changing the weather from some lead time onwards at each
+reroute. The incremental update of the previous solution is timed
+against solving again from the craft's position without it, reporting
+the fraction of the grid's nodes recomputed and of the full resolve's
+edges costed, and checking the journey times agree.
+
+Thomas Dickson
+thomas.dickson@soton.ac.uk
+"""
+
+from context import sail_route, maribot, smooth_weather
+import time
+import numpy as np
+from datetime import datetime
+from sail_route.route.grid_locations import gen_grid
+from sail_route.route.reroute import reroute
+from sail_route.sail_routing import Location, Route
+from sail_route.weather.weather_field import WeatherField
+
+
+def timed(*args, **kwargs):
+    """Return the solve time and result of a reroute."""
+    start_time = time.perf_counter()
+    result = reroute(*args, **kwargs)
+    return time.perf_counter() - start_time, result
+
+
+def run(n_ranks, n_width, hours, lead, max_heading=None):
+    """Compare rerouting hours into the passage with a full resolve.
+
+    The craft is at the node of its route it reaches nearest hours after
+    departure, or at the start when hours is zero, and the forecast
+    changes the wind speed from lead hours after the reroute onwards.
+    """
+    start = Location(-2.37, 50.256)
+    finish = Location(-61.777, 17.038)
+    craft = maribot()
+    route = Route(start, finish, n_ranks, n_width, 2e6/n_width, craft,
+                  max_heading=max_heading)
+    grid = gen_grid(start.long, finish.long, start.lat, finish.lat,
+                    n_ranks, n_width, route.d_node)
+    x, y = grid[..., 0], grid[..., 1]
+    land = np.zeros(x.shape, dtype=bool)
+    t0 = datetime(2016, 1, 1)
+    weather = smooth_weather(x, y, t0)
+    jt, earl_time, pindxs, x_r, y_r = reroute(route, t0, craft, x, y, land,
+                                              weather)
+    now, position = t0, None
+    if hours > 0:
+        ranks = np.arange(n_ranks)
+        nodes = np.array([np.flatnonzero((x[i] == x_r[-2-i]) &
+                                         (y[i] == y_r[-2-i]))[0]
+                          for i in ranks])
+        i = np.argmin(np.abs(earl_time[ranks, nodes] - t0.timestamp() -
+                             hours*3600.0))
+        now = datetime.fromtimestamp(earl_time[i, nodes[i]])
+        position = Location(x[i, nodes[i]], y[i, nodes[i]])
+    window = (now.timestamp() + lead*3600.0, weather.times[-1])
+    data = weather.data.copy()
+    changed = weather.times >= window[0]
+    data[0, changed] *= 1.0 + 0.2*np.sin(np.radians(y))[None]
+    forecast = WeatherField(data, weather.times)
+    args = (route, now, craft, x, y, land, forecast)
+    reroute(*args, position=position)
+    full_stats = {}
+    t_full, full = timed(*args, position=position, stats=full_stats)
+    stats = {}
+    t_inc, inc = timed(*args, earl_time, pindxs, window, position,
+                       stats=stats, times=weather.times)
+    assert inc[0] == full[0]
+    return (t_full, t_inc, stats['nodes_recomputed']/x.size,
+            stats['edges_costed']/full_stats['edges_costed'])
+
+
+if __name__ == '__main__':
+    n_ranks, n_width = 50, 200
+    print('{0:>12} {1:>6} {2:>6} {3:>9} {4:>9} {5:>8} {6:>8} {7:>8}'.format(
+        'connectivity', 'hours', 'lead', 'full (s)', 'incr (s)', 'speedup',
+        'nodes', 'edges'))
+    for name, max_heading in [('full', None), ('heading 45', 45.0)]:
+        for hours, lead in [(0, 24), (0, 96), (0, 240), (6, 0), (6, 72),
+                            (48, 0), (48, 72), (120, 72)]:
+            t_full, t_inc, nodes, edges = run(n_ranks, n_width, hours, lead,
+                                              max_heading)
+            print('{0:>12} {1:6d} {2:6d} {3:9.3f} {4:9.3f} {5:8.1f} '
+                  '{6:7.1f}% {7:7.1f}%'.format(
+                      name, hours, lead, t_full, t_inc, t_full/t_inc,
+                      100.0*nodes, 100.0*edges))
@@ -0,0 +1,175 @@
+"""Benchmarking the stages of a routing run over synthetic weather.
+
+Transatlantic grids from 10 to 1000 nodes across are routed through
+synthetic uniform, frontal and rotating low weather, timing separately
+the generation of the grid, its land mask, loading the weather from
+NetCDF and sampling it on the grid, the solve and the extraction of the
+route. Each stage is timed as the fastest of repeated runs after the
+solver has been compiled, and the results are written as JSON so runs
+from different revisions can be compared. The latency of the first
+solve of a fresh process is also measured, with the compile cache empty
+and once it has been filled.
+
+    python bench_suite.py --sizes 10 100 --output results.json
+
+Thomas Dickson
+thomas.dickson@soton.ac.uk
+"""
+
+from context import sail_route, maribot
+import os
+import sys
+import json
+import time
+import platform
+import argparse
+import subprocess
+import tempfile
+import numpy as np
+import numba
+import xarray as xr
+from datetime import datetime, timedelta
+from sail_route.route.grid_locations import gen_grid
+from sail_route.route.land_mask import land_mask
+from sail_route.route.node_state import to_solution
+from sail_route.route.solve_route import extract_route
+from sail_route.sail_routing import Location, Route, min_time_calculate
+from sail_route.weather.synthetic import synthetic_weather, grid_axes, \
+    time_axis, systems
+from sail_route.weather.weather_field import gen_weather_field
+
+start = Location(-2.37, 50.256)
+finish = Location(-61.777, 17.038)
+t0 = datetime(2016, 1, 1)
+fields = ['tws', 'twd', 'wd', 'wh', 'wp']
+
+
+def best_time(f, repeat):
+    """Return the fastest of repeat calls of f and its last result."""
+    times = []
+    for r in range(repeat):
+        start_time = time.perf_counter()
+        result = f()
+        times.append(time.perf_counter() - start_time)
+    return min(times), result
+
+
+def write_weather(path, kind, x, y):
+    """Write the synthetic weather of kind over the grid x, y to path."""
+    lon, lat = grid_axes(x, y)
+    arrays = synthetic_weather(kind, lon, lat, time_axis(t0))
+    xr.Dataset(dict(zip(fields, arrays))).to_netcdf(path)
+
+
+def load_weather(path, x, y):
+    """Return the WeatherField of the voyage's window of path."""
+    window = slice(t0, t0 + timedelta(days=15))
+    with xr.open_dataset(path) as ds:
+        ds = ds.sel(time=window).load()
+    return gen_weather_field(x, y, *[ds[f] for f in fields])
+
+
+def run(kind, n_ranks, n_width, repeat, tmp):
+    """Return the seconds taken by each stage of one routing run."""
+    craft = maribot()
+    route = Route(start, finish, n_ranks, n_width, 2e6/n_width, craft)
+    seconds = {}
+    seconds['grid'], grid = best_time(lambda: gen_grid(
+        start.long, finish.long, start.lat, finish.lat, n_ranks, n_width,
+        route.d_node), repeat)
+    x, y = grid[..., 0], grid[..., 1]
+    seconds['land'], land = best_time(
+        lambda: land_mask(x, y, use_cache=False), repeat)
+    path = os.path.join(tmp, '{0}_{1}.nc'.format(kind, n_width))
+    write_weather(path, kind, x, y)
+    seconds['weather'], weather = best_time(
+        lambda: load_weather(path, x, y), repeat)
+    args = (route, t0, craft, x, y, land, None, None, None, None, None)
+    seconds['solve'], (jt, state, x_r, y_r) = best_time(
+        lambda: min_time_calculate(*args, weather=weather, state=True),
+        repeat)
+    et, pindxs = to_solution(state)
+    end_node = (n_ranks - 1)*n_width + int(np.argmin(et[-1]))
+    seconds['path'], route_nodes = best_time(
+        lambda: extract_route(pindxs, end_node, x, y, et, weather), repeat)
+    if jt >= 1e10:
+        return seconds, None
+    return seconds, (jt - t0.timestamp())/3600.0
+
+
+def first_call(cache):
+    """Return the seconds of the first solves of fresh processes.
+
+    Each process solves a 10 by 10 grid with cache as the numba cache
+    directory, the first compiling the kernels into it.
+    """
+    env = dict(os.environ, NUMBA_CACHE_DIR=cache)
+    latency = {}
+    for name in ['cold', 'cached']:
+        out = subprocess.run([sys.executable, __file__, '--first-call'],
+                             env=env, capture_output=True, check=True,
+                             text=True).stdout
+        latency[name] = float(out.split()[-1])
+    return latency
+
+
+def revision():
+    """Return the git commit of the working tree, if there is one."""
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'],
+                              cwd=os.path.dirname(os.path.abspath(__file__)),
+                              capture_output=True, check=True,
+                              text=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--sizes', type=int, nargs='+',
+                        default=[10, 30, 100, 300, 1000],
+                        help='nodes across each rank')
+    parser.add_argument('--ranks', type=int, default=50)
+    parser.add_argument('--kinds', nargs='+', default=sorted(systems),
+                        choices=sorted(systems))
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--output', default='bench_suite.json')
+    parser.add_argument('--first-call', action='store_true',
+                        help=argparse.SUPPRESS)
+    opts = parser.parse_args()
+    if opts.first_call:
+        with tempfile.TemporaryDirectory() as tmp:
+            start_time = time.perf_counter()
+            run('uniform', 10, 10, 1, tmp)
+            print(time.perf_counter() - start_time)
+        sys.exit(0)
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        latency = first_call(os.path.join(tmp, 'numba'))
+        print('first call {cold:.2f} s cold, {cached:.2f} s cached'.format(
+            **latency))
+        # Compile the solver before anything is timed.
+        run('uniform', 4, 4, 1, tmp)
+        print('{0:>13} {1:>6} {2:>9} {3:>9} {4:>9} {5:>9} {6:>9}'.format(
+            'weather', 'width', 'grid', 'land', 'weather', 'solve', 'path'))
+        for kind in opts.kinds:
+            for n_width in opts.sizes:
+                seconds, voyage = run(kind, opts.ranks, n_width,
+                                      opts.repeat, tmp)
+                print('{0:>13} {1:6d} {grid:9.4f} {land:9.4f} '
+                      '{weather:9.4f} {solve:9.4f} {path:9.4f}'.format(
+                          kind, n_width, **seconds))
+                results.append({'weather': kind, 'n_ranks': opts.ranks,
+                                'n_width': n_width,
+                                'nodes': opts.ranks*n_width,
+                                'voyage_hours': voyage,
+                                'seconds': seconds})
+    meta = {'date': datetime.now().isoformat(timespec='seconds'),
+            'revision': revision(), 'python': sys.version.split()[0],
+            'numpy': np.__version__, 'numba': numba.__version__,
+            'platform': platform.platform(),
+            'processor': platform.processor(), 'repeat': opts.repeat}
+    with open(opts.output, 'w') as f:
+        json.dump({'meta': meta, 'first_call': latency,
+                   'results': results}, f, indent=2)
+    print('written to {0}'.format(opts.output))
@@ -0,0 +1,94 @@
+"""Benchmarking start up from a weather store against NetCDF.
+
+Three months of regridded three hourly weather are written as a NetCDF
+file of DataArrays and as a weather store of the same weather sampled
+on a 50 by 200 node grid. Each is then opened in a fresh process, as a
+routing job would, reporting the time until the WeatherField is ready
+and the growth in the peak resident set size.
+
+Thomas Dickson
+thomas.dickson@soton.ac.uk
+"""
+
+from context import sail_route
+import os
+import sys
+import time
+import subprocess
+import tempfile
+import numpy as np
+import xarray as xr
+from datetime import datetime
+from sail_route.route.grid_locations import gen_grid
+from sail_route.time_func import peak_rss
+
+n_ranks, n_width = 50, 200
+
+
+def grid():
+    """Return the transatlantic grid."""
+    g = gen_grid(-2.37, -61.777, 50.256, 17.038, n_ranks, n_width,
+                 10000.0)
+    return g[..., 0], g[..., 1]
+
+
+def write(tmp, n_times=720):
+    """Write the NetCDF file and weather store into the directory tmp."""
+    from sail_route.weather.weather_field import gen_weather_field
+    from sail_route.weather.weather_store import write_weather_store
+    x, y = grid()
+    times = np.datetime64('2016-01-01T00') + \
+        np.arange(n_times)*np.timedelta64(3, 'h')
+    lon = np.arange(-70.0, 5.0, 0.5)
+    lat = np.arange(10.0, 60.0, 0.5)
+    rng = np.random.RandomState(0)
+    names = ['tws', 'twd', 'wd', 'wh', 'wp']
+    ds = xr.Dataset({n: (('time', 'lat_b', 'lon_b'), rng.uniform(
+        0.0, 20.0, (n_times, lat.size, lon.size)).astype(np.float32))
+        for n in names}, coords={'time': times, 'lat_b': lat, 'lon_b': lon})
+    ds.to_netcdf(os.path.join(tmp, 'weather.nc'))
+    weather = gen_weather_field(x, y, *[ds[n] for n in names])
+    write_weather_store(os.path.join(tmp, 'weather.bin'), weather, x, y)
+
+
+def open_netcdf(tmp):
+    """Return the WeatherField of the NetCDF file."""
+    from sail_route.weather.weather_field import gen_weather_field
+    x, y = grid()
+    with xr.open_dataset(os.path.join(tmp, 'weather.nc')) as ds:
+        return gen_weather_field(x, y, ds['tws'], ds['twd'], ds['wd'],
+                                 ds['wh'], ds['wp'])
+
+
+def open_store(tmp):
+    """Return the WeatherField of the weather store."""
+    from sail_route.weather.weather_store import open_weather_store
+    x, y = grid()
+    return open_weather_store(os.path.join(tmp, 'weather.bin'), x, y)
+
+
+if __name__ == '__main__':
+    if len(sys.argv) == 2:
+        write(sys.argv[1])
+    elif len(sys.argv) == 3:
+        baseline = peak_rss()
+        start_time = time.perf_counter()
+        weather = {'netcdf': open_netcdf, 'store': open_store}[sys.argv[2]](
+            sys.argv[1])
+        elapsed = time.perf_counter() - start_time
+        print('{0:>8} {1:>10} {2:10.4f} {3:10.1f}'.format(
+            sys.argv[2], str(weather.data.dtype), elapsed,
+            peak_rss() - baseline))
+    else:
+        with tempfile.TemporaryDirectory() as tmp:
+            # The peak resident set size is kept across fork and exec, so
+            # the files are written by a child rather than this process.
+            subprocess.run([sys.executable, __file__, tmp], check=True)
+            for name in ['weather.nc', 'weather.bin']:
+                print('{0} {1:.1f} MB'.format(name, os.path.getsize(
+                    os.path.join(tmp, name))/2.0**20))
+            print('{0:>8} {1:>10} {2:>10} {3:>10}'.format(
+                'format', 'dtype', 'open (s)', 'load (MB)'))
+            for mode in ['netcdf', 'store']:
+                subprocess.run([sys.executable, __file__, tmp, mode],
+                               check=True)
@@ -0,0 +1,32 @@
+"""Importing the package and the craft and weather shared by benchmarks."""
+
+import os
+import sys
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__),
+                '..')))
+import sail_route
+import numpy as np
+from sail_route.performance.craft_performance import polar
+from sail_route.weather.weather_field import WeatherField
+
+polar_path = os.path.join(os.path.dirname(__file__), '..', 'analysis',
+                          'asv_transat', 'maribot_vane.csv')
+
+
+def maribot():
+    """Return the polar of the Maribot Vane ASV."""
+    perf = np.genfromtxt(polar_path, delimiter=',')
+    twa = np.array([0, 25, 40, 55, 70, 85, 100, 115, 130, 145, 160.0])
+    tws = np.array([0, 4, 8, 12, 16, 20.0])
+    return polar(twa, tws, np.transpose(perf).astype(float))
+
+
+def smooth_weather(x, y, t0, n_times=120):
+    """Return a WeatherField of wind veering slowly over the grid."""
+    times = t0.timestamp() + 3600.0*3*np.arange(n_times)
+    phase = (np.arange(n_times)/20.0)[:, None, None]
+    tws = 12.0 + 4.0*np.sin(phase + np.radians(x)*4.0)
+    twd = (270.0 + 40.0*np.cos(phase + np.radians(y)*6.0)) % 360.0
+    data = np.stack([tws, twd, np.full(tws.shape, 300.0),
+                     np.ones(tws.shape), np.full(tws.shape, 8.0)])
+    return WeatherField(data, times)
@@ -0,0 +1,54 @@
+"""On-disk cache shared by the routing modules.
+
+Results which are expensive to compute but only depend on their inputs,
+such as land masks and regridded weather, are stored under a cache
+directory keyed by a hash of those inputs. The directory is set by the
+SAIL_ROUTE_CACHE environment variable and defaults to
+~/.cache/sail_route. jit_cache.startup can also have numba cache the
+compiled kernels within it.
+
+Thomas Dickson
+thomas.dickson@soton.ac.uk
+"""
+
+import os
+import hashlib
+import numpy as np
+
+
+def cache_root():
+    """Return the directory of the cache, which may not exist yet."""
+    return os.environ.get('SAIL_ROUTE_CACHE',
+                          os.path.join(os.path.expanduser('~'), '.cache',
+                                       'sail_route'))
+
+
+def cache_dir(*parts):
+    """Return, creating if necessary, a directory within the cache."""
+    path = os.path.join(cache_root(), *parts)
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def hash_key(*items):
+    """Return a hex digest identifying the given arrays and values."""
+    h = hashlib.sha1()
+    for item in items:
+        if isinstance(item, np.ndarray):
+            a = np.ascontiguousarray(item)
+            h.update(str((a.dtype.str, a.shape)).encode())
+            h.update(a.tobytes())
+        else:
+            h.update(repr(item).encode())
+        h.update(b'\0')
+    return h.hexdigest()
+
+
+def numba_cache_dir():
+    """Return the directory jit_cache has numba cache kernels in.
+
+    This is NUMBA_CACHE_DIR if it is set, otherwise numba within the
+    cache, which is not created here.
+    """
+    return os.environ.get('NUMBA_CACHE_DIR') or \
+        os.path.join(cache_root(), 'numba')
@@ -0,0 +1,213 @@
+"""Ensembles of routing simulations.
+
+Sweeps over departure times and craft variants solve many routes on the
+same grid and weather. The grid and weather arrays are placed in shared
+memory once and attached by every worker process, rather than being
+pickled with each simulation, and results are returned as each
+simulation finishes. Weather opened from a weather store is mapped from
+its file by each worker instead.
+
+Thomas Dickson
+thomas.dickson@soton.ac.uk
+"""
+
+import os
+import json
+import mmap
+import numpy as np
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from multiprocessing import shared_memory
+from sail_route.route.kernel import min_time_kernel, craft_args, \
+    full_edges, no_counts, new_counts, count_totals
+from sail_route.route.solve_route import shortest_path, get_locs
+from sail_route.route.geometry import no_geometry
+from sail_route.time_func import Profile, phase
+
+
+_shared = {}
+
+
+def share_arrays(arrays):
+    """Copy named arrays into shared memory.
+
+    Memory-mapped arrays are not copied but mapped again by each worker.
+    Returns the shared memory blocks, which the caller must close and
+    unlink, and the (name, shape, dtype, offset) needed to attach each
+    array, offset being None for shared memory and the file offset of a
+    mapped array whose name is its file.
+    """
+    blocks = []
+    specs = {}
+    for key, a in arrays.items():
+        if isinstance(a, np.memmap) and isinstance(a.base, mmap.mmap):
+            specs[key] = (a.filename, a.shape, a.dtype.str, a.offset)
+            continue
+        a = np.ascontiguousarray(a)
+        shm = shared_memory.SharedMemory(create=True, size=max(a.nbytes, 1))
+        np.ndarray(a.shape, dtype=a.dtype, buffer=shm.buf)[...] = a
+        blocks.append(shm)
+        specs[key] = (shm.name, a.shape, a.dtype.str, None)
+    return blocks, specs
+
+
+def attach_arrays(specs):
+    """Attach the arrays described by share_arrays in a worker."""
+    for key, (name, shape, dtype, offset) in specs.items():
+        if offset is not None:
+            _shared[key] = np.memmap(name, dtype=np.dtype(dtype), mode='r',
+                                     offset=offset, shape=shape)
+            continue
+        shm = shared_memory.SharedMemory(name=name)
+        _shared[key] = np.ndarray(shape, dtype=np.dtype(dtype),
+                                  buffer=shm.buf)
+        _shared[key + '_shm'] = shm
+
+
+def solve(route_args, craft, t0, key, profile=False, linear=False,
+          return_times=False):
+    """Solve a single simulation over the attached grid and weather.
+
+    The weather is interpolated in time if linear. With profile the
+    record of a Profile of the simulation is returned, otherwise None,
+    and with return_times the earliest times of the grid, otherwise None.
+    """
+    start_long, start_lat, finish_long, finish_lat = route_args
+    x, y = _shared['x'], _shared['y']
+    if profile:
+        profile = Profile('ensemble', craft=key[0], departure=key[1])
+        counts = new_counts(x)
+    else:
+        profile = None
+        counts = no_counts()
+    with phase(profile, 'solve'):
+        jt, et, pindxs, end_node, pruned = min_time_kernel(
+            start_long, start_lat, finish_long, finish_lat,
+            x, y, _shared['land'], _shared['weather'], _shared['times'], t0,
+            linear, *craft, np.zeros(x.shape), np.inf, _shared['indptr'],
+            _shared['indices'], _shared['legs'], _shared['start_legs'],
+            _shared['finish_legs'], counts)
+    with phase(profile, 'path'):
+        indxs = np.arange(x.size).reshape(x.shape)
+        x_r, y_r = get_locs(indxs, shortest_path(indxs, pindxs,
+                                                 [end_node]), x, y)
+        x_r = np.hstack(([finish_long], x_r, [start_long]))
+        y_r = np.hstack(([finish_lat], y_r, [start_lat]))
+    if not return_times:
+        et = None
+    if profile is None:
+        return key, jt, x_r, y_r, None, et
+    profile.update(count_totals(counts, craft[4]))
+    return key, jt, x_r, y_r, profile.record(), et
+
+
+def iter_ensemble(route, grid, weather, craft_variants, departure_times,
+                  n_workers=None, geometry=None, profile=False,
+                  interp='nearest', return_times=False):
+    """Yield the result of each simulation as it finishes.
+
+    grid is the (x, y, land) returned by return_co_ords, weather a
+    WeatherField on that grid and geometry an optional GridGeometry of
+    the route over it, shared by every simulation. Every craft in
+    craft_variants is routed from every datetime in departure_times.
+    Each result is a dict of the craft and departure time indices, the
+    departure time, the craft's unc and apf, the journey timestamp, the
+    voyage time in seconds and the route co-ordinates. With profile each
+    also holds the Profile record of its simulation as 'profile', and
+    with return_times the earliest times of every node as 'earl_time',
+    which are copied back from each worker. interp samples the weather
+    in time as for min_time_calculate.
+    """
+    x, y, land = grid
+    departure_times = list(departure_times)
+    route_args = (route.start.long, route.start.lat,
+                  route.finish.long, route.finish.lat)
+    crafts = [craft_args(c) for c in craft_variants]
+    arrays = {'x': np.asarray(x, dtype=np.float64),
+              'y': np.asarray(y, dtype=np.float64),
+              'land': np.asarray(land, dtype=np.bool_),
+              'weather': weather.data, 'times': weather.times}
+    edges = route.edges(x, y)
+    if edges is None:
+        arrays['indptr'], arrays['indices'] = full_edges()
+    else:
+        arrays['indptr'], arrays['indices'] = edges.indptr, edges.indices
+    if geometry is None:
+        legs = no_geometry()
+    else:
+        geometry.check(route, x, y)
+        legs = geometry.kernel_args()
+    arrays['legs'], arrays['start_legs'], arrays['finish_legs'] = legs
+    tasks = [(route_args, crafts[c], t.timestamp(), (c, d), profile,
+              interp == 'linear', return_times)
+             for d, t in enumerate(departure_times)
+             for c in range(len(crafts))]
+
+    def result(key, jt, x_r, y_r, record, et):
+        c, d = key
+        t = departure_times[d]
+        r = {'craft': c, 'departure': d, 'time': t,
+             'unc': craft_variants[c].unc, 'apf': craft_variants[c].apf,
+             'journey_time': jt, 'voyage_time': jt - t.timestamp(),
+             'x_route': x_r, 'y_route': y_r}
+        if record is not None:
+            r['profile'] = dict(record, time=t.isoformat())
+        if et is not None:
+            r['earl_time'] = et
+        return r
+
+    if n_workers is None:
+        n_workers = os.cpu_count()
+    if n_workers <= 1:
+        _shared.update(arrays)
+        try:
+            for task in tasks:
+                yield result(*solve(*task))
+        finally:
+            _shared.clear()
+        return
+    blocks, specs = share_arrays(arrays)
+    try:
+        # Workers are spawned rather than forked as the parent may already
+        # be running numba or BLAS threads, which do not survive a fork.
+        with ProcessPoolExecutor(max_workers=n_workers,
+                                 mp_context=multiprocessing.get_context(
+                                     'spawn'),
+                                 initializer=attach_arrays,
+                                 initargs=(specs,)) as pool:
+            futures = [pool.submit(solve, *task) for task in tasks]
+            for f in as_completed(futures):
+                yield result(*f.result())
+    finally:
+        for shm in blocks:
+            shm.close()
+            shm.unlink()
+
+
+def run_ensemble(route, grid, weather, craft_variants, departure_times,
+                 n_workers=None, fname=None, geometry=None,
+                 profile_fname=None, interp='nearest'):
+    """Run every simulation of an ensemble, returning a results table.
+
+    The table has one row per simulation of the departure timestamp,
+    craft unc, craft apf, journey timestamp and voyage time in seconds,
+    ordered by departure time then craft. If fname is given the table is
+    also saved there as tab delimited text. If profile_fname is given
+    the profile of each simulation is appended to it as a line of JSON.
+    interp samples the weather in time as for min_time_calculate.
+    """
+    results = sorted(iter_ensemble(route, grid, weather, craft_variants,
+                                   departure_times, n_workers, geometry,
+                                   profile_fname is not None, interp),
+                     key=lambda r: (r['departure'], r['craft']))
+    if profile_fname is not None:
+        with open(profile_fname, 'a') as f:
+            for r in results:
+                f.write(json.dumps(r['profile']) + '\n')
+    table = np.array([[r['time'].timestamp(), r['unc'], r['apf'],
+                       r['journey_time'], r['voyage_time']]
+                      for r in results]).reshape(-1, 5)
+    if fname is not None:
+        np.savetxt(fname, table, delimiter='\t', fmt='%1.3f',
+                   header='departure\tunc\tapf\tjourney_time\tvoyage_time')
+    return table
@@ -0,0 +1,256 @@
+"""Management of the compile cache of the numba kernels.
+
+The kernels are compiled with cache=True, which numba places beside
+the sources or in its own cache directory. A job which starts up in
+'verify' or 'build' mode instead caches them in a directory shared by
+every such process, numba within the sail_route cache unless
+NUMBA_CACHE_DIR is set, so only the first process on a machine, or on a
+cluster sharing the directory, pays for compilation. Importing the
+package leaves numba's settings untouched.
+
+A build step compiles the kernels for the argument types the routing
+paths dispatch, by routing a small synthetic problem through each of
+them, and records a stamp of the package sources, numba and the CPU.
+numba only invalidates an entry when the file of the function itself
+changes, not when a kernel it calls does, so at start up a job can
+verify the stamp, rebuilding the cache if it is stale, instead of
+forcing every kernel to recompile:
+
+    python -m sail_route.jit_cache build
+    python -m sail_route.jit_cache verify
+
+Thomas Dickson
+thomas.dickson@soton.ac.uk
+"""
+
+import os
+import sys
+import json
+import time
+import hashlib
+import tempfile
+import numpy as np
+from datetime import datetime
+from sail_route.cache import numba_cache_dir
+
+modules = ['sail_route.route.kernel', 'sail_route.route.reroute',
+           'sail_route.route.geometry', 'sail_route.route.node_state',
+           'sail_route.route.grid_locations', 'sail_route.route.geodesy',
+           'sail_route.route.connectivity', 'sail_route.performance.bbn',
+           'sail_route.performance.compiled_bbn',
+           'sail_route.performance.craft_performance',
+           'sail_route.performance.cost_function',
+           'sail_route.weather.weather_field']
+
+
+def source_stamp():
+    """Return a digest of the package sources, numba and the host CPU."""
+    import numba
+    import llvmlite.binding as llvm
+    root = os.path.dirname(os.path.abspath(__file__))
+    h = hashlib.sha1()
+    for directory, subdirs, files in sorted(os.walk(root)):
+        subdirs.sort()
+        for name in sorted(files):
+            if name.endswith('.py'):
+                path = os.path.join(directory, name)
+                h.update(os.path.relpath(path, root).encode())
+                with open(path, 'rb') as f:
+                    h.update(f.read())
+    h.update(' '.join([numba.__version__, sys.version,
+                       llvm.get_host_cpu_name()]).encode())
+    return h.hexdigest()
+
+
+def stamp_path():
+    """Return the path of the stamp of the cache."""
+    return os.path.join(numba_cache_dir(), 'sail_route.stamp')
+
+
+def dispatchers():
+    """Return the cached kernels of the package by qualified name."""
+    import importlib
+    from numba.core.dispatcher import Dispatcher
+    from numba.core.caching import NullCache
+    kernels = {}
+    for name in modules:
+        module = importlib.import_module(name)
+        for attr, obj in vars(module).items():
+            if (isinstance(obj, Dispatcher) and
+                    obj.py_func.__module__ == name and
+                    not isinstance(obj._cache, NullCache)):
+                kernels['{0}.{1}'.format(name, attr)] = obj
+    return kernels
+
+
+def use_cache_dir():
+    """Have numba cache the kernels in numba_cache_dir, returning it.
+
+    NUMBA_CACHE_DIR is left for numba to use if it is set. Otherwise
+    numba's cache directory is set for the rest of the process, and the
+    package's kernels, which found their cache when they were defined,
+    look for it again. Returns None, changing nothing, if the directory
+    cannot be created or written to.
+    """
+    import numba
+    path = numba_cache_dir()
+    if os.environ.get('NUMBA_CACHE_DIR'):
+        return path
+    try:
+        os.makedirs(path, exist_ok=True)
+    except OSError:
+        return None
+    if not os.access(path, os.W_OK):
+        return None
+    numba.config.CACHE_DIR = path
+    for kernel in dispatchers().values():
+        kernel.enable_caching()
+    return path
+
+
+def flush():
+    """Drop the cache entries of every kernel."""
+    for kernel in dispatchers().values():
+        kernel._cache.flush()
+
+
+def warm():
+    """Compile or load the kernels for the types routing dispatches.
+
+    A small problem is solved over float64 weather with full and limited
+    connectivity, with pruning, a grid geometry, counts and node state,
+    over float32 weather from a weather store and rerouted, and both
+    weathers are interpolated in time.
+    """
+    from sail_route.performance.craft_performance import polar
+    from sail_route.route.geodesy import distance_bearing, pairwise
+    from sail_route.route.geometry import gen_geometry
+    from sail_route.route.reroute import reroute
+    from sail_route.sail_routing import Location, Route, min_time_calculate
+    from sail_route.time_func import Profile
+    from sail_route.weather.synthetic import synthetic_weather, grid_axes, \
+        time_axis
+    from sail_route.weather.weather_field import gen_weather_field
+    from sail_route.weather.weather_store import write_weather_store, \
+        open_weather_store
+    n = 6
+    x = np.linspace(-10.0, -20.0, n)[:, None] + np.zeros((n, n))
+    y = np.linspace(45.0, 40.0, n)[:, None] + np.linspace(-2.0, 2.0, n)
+    land = np.zeros((n, n), dtype=bool)
+    t0 = datetime(2016, 1, 1)
+    lon, lat = grid_axes(x, y)
+    weather = gen_weather_field(x, y, *synthetic_weather(
+        'frontal', lon, lat, time_axis(t0, 40), lon0=-20.0))
+    twa = np.array([0.0, 45.0, 90.0, 135.0, 180.0])
+    tws = np.array([0.0, 10.0, 20.0, 30.0])
+    craft = polar(twa, tws, np.outer([0.0, 0.6, 0.8, 0.7, 0.5],
+                                     [0.0, 5.0, 8.0, 9.0]))
+    start, finish = Location(-9.5, 43.0), Location(-20.5, 42.5)
+    dense = Route(start, finish, n, n, 1000.0, craft)
+    sparse = Route(start, finish, n, n, 1000.0, craft, max_heading=60.0)
+    args = (t0, craft, x, y, land, None, None, None, None, None)
+    min_time_calculate(dense, *args, weather=weather, prune=True,
+                       profile=Profile())
+    min_time_calculate(sparse, *args, weather=weather, state=True,
+                       geometry=gen_geometry(sparse, x, y))
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'weather.bin')
+        write_weather_store(path, weather, x, y)
+        store = open_weather_store(path, x, y)
+        min_time_calculate(dense, *args, weather=store)
+        store.sample(store.times[:2], 0, 0, 'linear')
+        del store
+    weather.sample(weather.times[:2], 0, 0, 'linear')
+    jt, et, pindxs, x_r, y_r = reroute(dense, t0, craft, x, y, land, weather)
+    reroute(dense, t0, craft, x, y, land, weather, et, pindxs,
+            (weather.times[4], weather.times[-1]), times=weather.times)
+    for dtype in (np.float64, np.float32):
+        distance_bearing(x, y, x[::-1], y[::-1], dtype)
+        pairwise(x[0], y[0], x[1], y[1], dtype)
+
+
+def cache_stats():
+    """Return the kernels loaded from and compiled into the cache."""
+    loaded, compiled = [], []
+    for name, kernel in sorted(dispatchers().items()):
+        if sum(kernel.stats.cache_misses.values()):
+            compiled.append(name)
+        elif sum(kernel.stats.cache_hits.values()):
+            loaded.append(name)
+    return {'loaded': loaded, 'compiled': compiled}
+
+
+def write_stamp():
+    """Record the stamp of the sources the cache was built from."""
+    path = stamp_path()
+    tmp = path + '.{0}.tmp'.format(os.getpid())
+    with open(tmp, 'w') as f:
+        f.write(source_stamp())
+    os.replace(tmp, path)
+
+
+def is_stale():
+    """Return whether the cache was built from other sources."""
+    try:
+        with open(stamp_path()) as f:
+            return f.read() != source_stamp()
+    except FileNotFoundError:
+        return True
+
+
+def build():
+    """Compile every kernel afresh into the cache.
+
+    The kernels are expected to use the cache of use_cache_dir, as
+    startup arranges.
+    """
+    start_time = time.perf_counter()
+    flush()
+    warm()
+    write_stamp()
+    return dict(cache_stats(), mode='build', cache_dir=numba_cache_dir(),
+                seconds=time.perf_counter() - start_time)
+
+
+def verify():
+    """Load the kernels from the cache, rebuilding it if it is stale.
+
+    Returns the kernels loaded from and compiled into the cache, a
+    verified cache compiling none of them. As for build, the kernels are
+    expected to use the cache of use_cache_dir.
+    """
+    start_time = time.perf_counter()
+    stale = is_stale()
+    if stale:
+        flush()
+    warm()
+    if stale:
+        write_stamp()
+    return dict(cache_stats(), mode='verify', stale=stale,
+                cache_dir=numba_cache_dir(),
+                seconds=time.perf_counter() - start_time)
+
+
+def startup(mode=None):
+    """Prepare the kernels as a job starts.
+
+    mode is 'lazy', compiling or loading each kernel when first called,
+    'verify' or 'build', defaulting to the SAIL_ROUTE_JIT environment
+    variable or 'lazy'. Verifying or building moves the kernels to the
+    shared cache of use_cache_dir, or falls back to 'lazy' if it cannot
+    be written. Returns the record of verify or build, or None.
+    """
+    if mode is None:
+        mode = os.environ.get('SAIL_ROUTE_JIT', 'lazy')
+    if mode not in ('lazy', 'verify', 'build'):
+        raise ValueError("Unknown start up mode: {0}".format(mode))
+    if mode == 'lazy' or use_cache_dir() is None:
+        return None
+    elif mode == 'verify':
+        return verify()
+    return build()
+
+
+if __name__ == '__main__':
+    mode = sys.argv[1] if len(sys.argv) > 1 else 'verify'
+    print(json.dumps(startup(mode)))
@@ -5,9 +5,7 @@ thomas.dickson@soton.ac.uk
 22/05/2018
 """
 
-from pgmpy.models import BayesianModel
-from pgmpy.factors.discrete import TabularCPD
-from pgmpy.inference import BeliefPropagation
+import numpy as np
 from numba import jit
 
 
@@ -47,9 +45,11 @@ def wave_dir(theta):
         return 0
 
 
-@jit(nogil=True, fastmath=True)
 def gen_env_model():
     """Specify BBN."""
+    from pgmpy.models import BayesianModel
+    from pgmpy.factors.discrete import TabularCPD
+    from pgmpy.inference import BeliefPropagation
     cpd_tws = TabularCPD('TWS', 2, values=[[0.8, 0.2]])
     cpd_twa = TabularCPD('TWA', 2, values=[[0.8, 0.2]])
     cpd_wind = TabularCPD('Wind', 2,
@@ -83,21 +83,68 @@ def gen_env_model():
     return belief_propagation
 
 
-@jit(cache=True, nogil=True, fastmath=True)
 def env_bbn_interrogate(bp, tws, twa, h, theta):
     """
     Interrogate BBN for failure probability.
 
     Modelling failure as a function of environmental conditions.
     """
+    return env_bbn_query(bp, wind_speed(tws), wind_dir(twa),
+                         wave_height(h), wave_dir(theta))
+
+
+def env_bbn_query(bp, tws_state, twa_state, wh_state, wd_state):
+    """Query BBN for failure probability given discretised evidence."""
     q = bp.query(variables=['Craft failure'],
-                 evidence={'TWS': wind_speed(tws),
-                           'TWA': wind_dir(twa),
-                           'WH': wave_height(h),
-                           'WD': wave_dir(theta)})
+                 evidence={'TWS': tws_state,
+                           'TWA': twa_state,
+                           'WH': wh_state,
+                           'WD': wd_state})
     return q['Craft failure'].values[-1]
 
 
+@jit(fastmath=True, nopython=True, cache=True)
+def env_bbn_state(tws, twa, h, theta):
+    """Return the index of the discretised evidence in env_bbn_table."""
+    return (8*wind_speed(tws) + 4*wind_dir(twa) + 2*wave_height(h) +
+            wave_dir(theta))
+
+
+def env_bbn_table(bp):
+    """Return the failure probability for every state of the evidence.
+
+    The evidence has only 16 states, so the network is queried once for
+    each and the probabilities indexed by env_bbn_state, letting
+    compiled code look them up rather than querying per edge.
+    """
+    return np.array([env_bbn_query(bp, (s >> 3) & 1, (s >> 2) & 1,
+                                   (s >> 1) & 1, s & 1)
+                     for s in range(16)])
+
+
+@jit(nopython=True, nogil=True, cache=True)
+def env_bbn_lookup(fail_table, tws, twa, h, theta):
+    """Return the failure probability of 1-D arrays of conditions."""
+    fc = np.empty(tws.shape[0])
+    for k in range(tws.shape[0]):
+        fc[k] = fail_table[env_bbn_state(tws[k], twa[k], h[k], theta[k])]
+    return fc
+
+
+def env_bbn_failure(fail_table, tws, twa, h, theta):
+    """Return the failure probability over arrays of conditions."""
+    tws, twa, h, theta = np.broadcast_arrays(
+        *[np.asarray(a, dtype=np.float64) for a in (tws, twa, h, theta)])
+    fc = env_bbn_lookup(fail_table, tws.ravel(), twa.ravel(), h.ravel(),
+                        theta.ravel())
+    return fc.reshape(tws.shape)
+
+
+def env_bbn_interrogate_array(bp, tws, twa, h, theta):
+    """Interrogate BBN for failure probability over arrays of conditions."""
+    return env_bbn_failure(env_bbn_table(bp), tws, twa, h, theta)
+
+
 if __name__ == '__main__':
     model = gen_env_model()
     print("No failure: ", env_bbn_interrogate(model, 10, 60, 0, 40))
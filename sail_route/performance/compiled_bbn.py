@@ -0,0 +1,208 @@
+"""Compiled Bayesian networks modelling craft failure.
+
+Any pgmpy BayesianModel is reduced ahead of time, by variable
+elimination over its CPDs, to a dense table of the probability of a
+target state for every combination of discretised evidence. Each piece
+of evidence is discretised from one of the conditions available when
+costing an edge, so whole arrays of edges are evaluated with a single
+indexing operation. Tables are saved to the cache keyed by the network,
+so each model is only eliminated once.
+
+Evidence discretised by steps, the states of the intervals between
+sorted edges, is also evaluated by the compiled routing kernel, which
+takes the table, its strides and the steps packed into one array by
+pack_failure_model. The discretisers of bbn are known as steps.
+
+Thomas Dickson
+thomas.dickson@soton.ac.uk
+"""
+
+import os
+import numpy as np
+import numba
+from sail_route.cache import cache_dir, hash_key
+from sail_route.performance.bbn import wind_speed, wind_dir, wave_height, \
+    wave_dir
+
+conditions = ('tws', 'twa', 'wh', 'wd')
+env_evidence = [('TWS', 'tws', wind_speed), ('TWA', 'twa', wind_dir),
+                ('WH', 'wh', wave_height), ('WD', 'wd', wave_dir)]
+# The discretisers of bbn as the (edges, states) of their steps, a value
+# v taking the state of the interval searchsorted(edges, v, 'right').
+known_steps = {wind_speed: ([np.nextafter(25.0, np.inf)], [0, 1]),
+               wind_dir: ([0.0], [1, 0]),
+               wave_height: ([np.nextafter(3.0, np.inf)], [0, 1]),
+               wave_dir: ([60.0], [1, 0])}
+
+
+def eliminate(model, target, nodes, state=-1):
+    """Return the probability of state of target given the nodes.
+
+    The result has an axis for each of nodes over its states. Evidence
+    which the network gives zero probability is returned as np.nan.
+    """
+    index = {v: k for k, v in enumerate(model.nodes())}
+    operands = []
+    for cpd in model.get_cpds():
+        operands += [np.asarray(cpd.values, dtype=np.float64),
+                     [index[v] for v in cpd.variables]]
+    out = [index[target]] + [index[n] for n in nodes]
+    joint = np.einsum(*operands, out, optimize='greedy')
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return joint[state] / joint.sum(axis=0)
+
+
+def model_key(model, target, nodes, state):
+    """Return the cache key of a compiled network."""
+    cpds = sorted(model.get_cpds(), key=lambda c: c.variable)
+    items = [target, list(nodes), state]
+    for cpd in cpds:
+        items += [list(cpd.variables), np.asarray(cpd.values,
+                                                   dtype=np.float64)]
+    return hash_key(*items)
+
+
+def discretiser(f):
+    """Return f applied elementwise over arrays of conditions.
+
+    f is a function or the (edges, states) of steps.
+    """
+    if isinstance(f, tuple):
+        edges = np.asarray(f[0], dtype=np.float64)
+        states = np.asarray(f[1], dtype=np.int64)
+        return lambda v: states[np.searchsorted(edges, v, side='right')]
+    if hasattr(f, 'py_func'):
+        return numba.vectorize(['int64(float64)'])(f.py_func)
+    return np.vectorize(f, otypes=[np.int64])
+
+
+class CompiledBBN(object):
+    """Probability of a network's target state over discretised evidence."""
+
+    def __init__(self, model, target, evidence, state=-1, use_cache=True):
+        """Eliminate, or load from the cache, the network's table.
+
+        model, pgmpy BayesianModel
+        target, node whose probability is returned
+        evidence, list of (node, condition, function) where condition is
+        one of conditions and function maps a value of the condition to
+        the state of node, or is the (edges, states) of its steps
+        state, state of target whose probability is returned
+        """
+        self.target = target
+        self.nodes = [e[0] for e in evidence]
+        unknown = set(e[1] for e in evidence) - set(conditions)
+        if unknown:
+            raise ValueError("Unknown conditions: {0}".format(
+                sorted(unknown)))
+        self.evidence = [(c, discretiser(f)) for n, c, f in evidence]
+        self.steps = [f if isinstance(f, tuple) else known_steps.get(f)
+                      for n, c, f in evidence]
+        path = None
+        if use_cache:
+            path = os.path.join(cache_dir('bbn'), model_key(
+                model, target, self.nodes, state) + '.npy')
+        if path is not None and os.path.exists(path):
+            self.table = np.load(path)
+        else:
+            self.table = eliminate(model, target, self.nodes, state)
+            if path is not None:
+                tmp = path + '.{0}.tmp'.format(os.getpid())
+                with open(tmp, 'wb') as f:
+                    np.save(f, self.table)
+                os.replace(tmp, path)
+
+    @property
+    def nbytes(self):
+        """Return the memory taken by the table in bytes."""
+        return self.table.nbytes
+
+    def __repr__(self):
+        """Describe the table and its memory footprint."""
+        return "CompiledBBN({0!r}, shape={1}, nbytes={2})".format(
+            self.target, self.table.shape, self.nbytes)
+
+    def evaluate(self, tws, twa, wh, wd):
+        """Return the probability over arrays of conditions."""
+        values = dict(zip(conditions, (tws, twa, wh, wd)))
+        states = [f(np.asarray(values[c], dtype=np.float64))
+                  for c, f in self.evidence]
+        return self.table[tuple(np.broadcast_arrays(*states))]
+
+    def kernel_model(self):
+        """Return the network packed for the compiled kernel.
+
+        Every piece of evidence must be discretised by steps.
+        """
+        missing = [n for n, s in zip(self.nodes, self.steps) if s is None]
+        if missing:
+            raise ValueError("Evidence {0} is discretised by a function, "
+                             "give its (edges, states) to route with the "
+                             "compiled kernel".format(missing))
+        return pack_failure_model(
+            self.table, [conditions.index(c) for c, f in self.evidence],
+            self.steps)
+
+
+def pack_failure_model(table, evidence, steps):
+    """Pack a table of failure probabilities into one float array.
+
+    table has an axis for each piece of evidence, whose condition is
+    the index in conditions in evidence and whose steps are the
+    (edges, states) in steps. The array holds the number of pieces of
+    evidence and the offset of the flattened table, then the condition,
+    stride and offset of the steps of each piece, then the number of
+    edges, edges and states of each of the steps and last the table.
+    """
+    table = np.asarray(table, dtype=np.float64)
+    if table.ndim != len(evidence):
+        raise ValueError("Table has {0} axes for {1} pieces of "
+                         "evidence".format(table.ndim, len(evidence)))
+    rows, blocks = [], []
+    offset = 2 + 3*len(evidence)
+    for axis, (c, (edges, states)) in enumerate(zip(evidence, steps)):
+        edges = np.asarray(edges, dtype=np.float64)
+        states = np.asarray(states, dtype=np.float64)
+        if states.shape[0] != edges.shape[0] + 1:
+            raise ValueError("Steps need one more state than edges")
+        rows += [c, int(np.prod(table.shape[axis+1:])), offset]
+        blocks.append(np.concatenate(([edges.shape[0]], edges, states)))
+        offset += blocks[-1].shape[0]
+    return np.concatenate([[len(evidence), offset], rows] + blocks +
+                          [table.ravel()])
+
+
+def env_failure_model(fail_table):
+    """Pack the fail_table of env_bbn_table for the compiled kernel."""
+    evidence = [conditions.index(c) for n, c, f in env_evidence]
+    steps = [known_steps[f] for n, c, f in env_evidence]
+    return pack_failure_model(np.reshape(fail_table, (2, 2, 2, 2)),
+                              evidence, steps)
+
+
+@numba.njit(nogil=True, cache=True)
+def fail_lookup(model, tws, twa, wh, wd):
+    """Return the failure probability of a model of pack_failure_model."""
+    n = int(model[0])
+    idx = int(model[1])
+    for e in range(n):
+        c = int(model[2 + 3*e])
+        o = int(model[4 + 3*e])
+        if c == 0:
+            v = tws
+        elif c == 1:
+            v = twa
+        elif c == 2:
+            v = wh
+        else:
+            v = wd
+        n_edges = int(model[o])
+        b = np.searchsorted(model[o+1:o+1+n_edges], v, side='right')
+        idx += int(model[3 + 3*e])*int(model[o+1+n_edges+b])
+    return model[idx]
+
+
+def env_bbn_compile(bp, use_cache=True):
+    """Compile the network of gen_env_model for the failure of the craft."""
+    return CompiledBBN(bp.model, 'Craft failure', env_evidence,
+                       use_cache=use_cache)
@@ -9,43 +9,20 @@ thomas.dickson@soton.ac.uk
 """
 
 import numpy as np
-from numpy import radians, sin, cos, sqrt, arcsin, arctan2
 import datetime
-from numba import jit, njit
-from sail_route.performance.bbn import env_bbn_interrogate
+from numba import njit
+from sail_route.performance.bbn import env_bbn_failure, env_bbn_state
+from sail_route.performance.compiled_bbn import fail_lookup
+from sail_route.performance.craft_performance import polar_lookup
+from sail_route.route.geodesy import haversine, distance_bearing
 
 
-@njit(fastmath=True, nogil=True)
-def haversine(lon1, lat1, lon2, lat2):
-    """
-    Calculate the great circle distance between two points.
-
-    Return the value in nm.
-    """
-    R = 6372.8  # Earth radius in kilometers
-
-    dLat = radians(lat2 - lat1)
-    dLon = radians(lon2 - lon1)
-    lat1 = radians(lat1)
-    lat2 = radians(lat2)
-    lon1 = radians(lon1)
-    lon2 = radians(lon2)
-
-    a = sin(dLat/2)**2 + cos(lat1)*cos(lat2)*sin(dLon/2)**2
-    c = 2*arcsin(sqrt(a))
-    theta = arctan2(sin(dLon)*cos(lat2),
-                    cos(lat1)*sin(lat2)-sin(lat1)*cos(lat2)*cos(dLon))
-    theta = (np.rad2deg(theta) + 360) % 360
-    return R*c*0.5399565, theta
-
-
-@njit(fastmath=True, nogil=True)
+@njit(fastmath=True, nogil=True, cache=True)
 def dir_to_relative(x, y):
     """Calculate relative angle to bearing."""
     return np.absolute((x - y + 180) % 360 - 180)
 
 
-@jit(cache=True, nogil=True)
 def cost_function(x1, y1, x2, y2, tws, twd, i_wd, i_wh, i_wp,
                   craft, lifetime=None):
     """Calculate the time taken to transit between two locations."""
@@ -56,7 +33,10 @@ def cost_function(x1, y1, x2, y2, tws, twd, i_wd, i_wh, i_wp,
     speed = craft.return_perf(twa, tws)
     if craft.apf < 1.0:
         wave_dir = dir_to_relative(bearing, i_wd)
-        fc = env_bbn_interrogate(craft.failure, tws, twd, i_wh, wave_dir)
+        if craft.fail_table is None:
+            fc = craft.failure.evaluate(tws, twd, i_wh, wave_dir)
+        else:
+            fc = craft.fail_table[env_bbn_state(tws, twd, i_wh, wave_dir)]
     else:
         fc = 0.0
     if fc > craft.apf:
@@ -67,5 +47,74 @@ def cost_function(x1, y1, x2, y2, tws, twd, i_wd, i_wh, i_wp,
         return datetime.timedelta(hours=np.float64(dist/speed))
 
 
+@njit(nogil=True, cache=True)
+def edge_time(x1, y1, x2, y2, tws, twd, i_wd, i_wh, i_wp,
+              table, table_params, unc, fail_table, apf):
+    """Calculate the transit time in hours between two locations.
+
+    Compiled counterpart of cost_function, taking the craft as its
+    performance table and its failure model packed by
+    pack_failure_model. Returns np.inf for edges which cannot be sailed.
+    """
+    dist, bearing = haversine(x1, y1, x2, y2)
+    return leg_time(dist, bearing, tws, twd, i_wd, i_wh, i_wp,
+                    table, table_params, unc, fail_table, apf)
+
+
+@njit(nogil=True, cache=True)
+def leg_time(dist, bearing, tws, twd, i_wd, i_wh, i_wp,
+             table, table_params, unc, fail_table, apf):
+    """Calculate the transit time in hours of a leg of known geometry.
+
+    As edge_time, given the distance in nm and bearing of the leg.
+    """
+    if np.isnan(tws) or np.isnan(twd) or np.isnan(i_wd) or \
+            np.isnan(i_wh) or np.isnan(i_wp):
+        return np.inf
+    twa = dir_to_relative(bearing, twd)
+    speed = polar_lookup(table, table_params[0], table_params[1],
+                         table_params[2], table_params[3], twa, tws)*unc
+    if apf < 1.0:
+        wave_dir = dir_to_relative(bearing, i_wd)
+        fc = fail_lookup(fail_table, tws, twd, i_wh, wave_dir)
+    else:
+        fc = 0.0
+    if fc > apf:
+        return np.inf
+    elif speed < 0.3:
+        return np.inf
+    else:
+        return dist/speed
+
+
+def cost_matrix(x1, y1, x2, y2, tws, twd, i_wd, i_wh, i_wp, craft):
+    """Calculate the transit time in hours between arrays of locations.
+
+    All arguments broadcast against each other, so a (n, 1) column of
+    departure nodes with their weather against a (1, m) row of arrival
+    nodes returns the (n, m) matrix of edge costs. Edges which
+    cost_function would reject are returned as np.inf.
+    """
+    x1, y1, x2, y2, tws, twd, i_wd, i_wh, i_wp = np.broadcast_arrays(
+        x1, y1, x2, y2, tws, twd, i_wd, i_wh, i_wp)
+    dist, bearing = distance_bearing(x1, y1, x2, y2)
+    twa = dir_to_relative(bearing, twd)
+    speed = craft.return_perf_array(twa, tws)
+    if craft.apf < 1.0:
+        wave_dir = dir_to_relative(bearing, i_wd)
+        if craft.fail_table is None:
+            fc = craft.failure.evaluate(tws, twd, i_wh, wave_dir)
+        else:
+            fc = env_bbn_failure(craft.fail_table, tws, twd, i_wh,
+                                 wave_dir)
+    else:
+        fc = np.zeros_like(dist)
+    nan = np.isnan(tws) | np.isnan(twd) | np.isnan(i_wd) | \
+        np.isnan(i_wh) | np.isnan(i_wp)
+    hours = np.where(nan | (fc > craft.apf) | (speed < 0.3), np.inf,
+                     dist/speed)
+    return hours
+
+
 if __name__ == '__main__':
     print(haversine(-88.67, 36.12, -118.40, 33.94))
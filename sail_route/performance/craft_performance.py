@@ -5,15 +5,16 @@ thomas.dickson@soton.ac.uk
 24/04/2018
 """
 import numpy as np
-from scipy.interpolate import interp2d
-from numba import jit
+from numba import njit
+from sail_route.performance.bbn import env_bbn_table
+from sail_route.performance.compiled_bbn import CompiledBBN
 
 
 class polar(object):
     """Store and return information on sailing craft polars."""
 
     def __init__(self, tws_range, twa_range, perf, unc=1.0, apf=1.0,
-                 failure=None):
+                 failure=None, table_step=1.0, table_dtype=np.float64):
         """Initialise sailing craft performance data.
 
         twa_range, numpy array containing true wind angle values
@@ -22,6 +23,13 @@ class polar(object):
         unc, scalar associating uncertainty with craft
         apf, scalar between 0.0 and 1.0 returning the acceptable
         probability of failure of the craft.
+        failure, BBN modelling the failure of the craft, evaluated once
+        into fail_table, the failure probability of each state of its
+        evidence, or a CompiledBBN, for which fail_table is None.
+        table_step, spacing of the regular lookup table built from the
+        polar. When the polar's own values are whole multiples of the
+        step the table reproduces linear interpolation of the polar.
+        table_dtype, precision the lookup table is stored at.
         """
         self.twa_range = twa_range
         self.tws_range = tws_range
@@ -29,10 +37,79 @@ class polar(object):
         self.unc = unc
         self.apf = apf
         self.failure = failure
+        if failure is None:
+            self.fail_table = np.zeros(16)
+        elif isinstance(failure, CompiledBBN):
+            self.fail_table = None
+        else:
+            self.fail_table = env_bbn_table(failure)
+        self.table, self.table_params = gen_perf_table(
+            tws_range, twa_range, perf, table_step, table_dtype)
 
-    @jit(cache=True)
     def return_perf(self, tws, twa):
         """Return sailing craft performance."""
-        p = interp2d(self.twa_range, self.tws_range, self.perf,
-                     kind='linear')
-        return p(twa, tws)*self.unc
+        return polar_lookup(self.table, *self.table_params,
+                            np.float64(tws), np.float64(twa))*self.unc
+
+    def return_perf_array(self, tws, twa):
+        """Return sailing craft performance for arrays of conditions."""
+        tws, twa = np.broadcast_arrays(np.asarray(tws, dtype=np.float64),
+                                       np.asarray(twa, dtype=np.float64))
+        speed = polar_lookup_array(self.table, *self.table_params,
+                                   tws.ravel(), twa.ravel())
+        return speed.reshape(tws.shape)*self.unc
+
+    def max_speed(self, tws_max=np.inf):
+        """Return the fastest the craft sails in winds of up to tws_max."""
+        b0, db = self.table_params[2:]
+        if np.isnan(tws_max):
+            tws_max = np.inf
+        n = int(np.clip(np.ceil((tws_max - b0)/db), 0,
+                        self.table.shape[1] - 1)) + 1
+        return float(self.table[:, :n].max())*self.unc
+
+
+def gen_perf_table(tws_range, twa_range, perf, step=1.0, dtype=np.float64):
+    """Sample the linearly interpolated polar onto a regular table.
+
+    Returns the table and the (origin, step) of each of its axes, which
+    together are the arguments polar_lookup expects.
+    """
+    from scipy.interpolate import RectBivariateSpline
+    tws_range = np.asarray(tws_range, dtype=np.float64)
+    twa_range = np.asarray(twa_range, dtype=np.float64)
+    spline = RectBivariateSpline(tws_range, twa_range, perf, kx=1, ky=1)
+    n_a = int(np.ceil((tws_range[-1] - tws_range[0])/step)) + 1
+    n_b = int(np.ceil((twa_range[-1] - twa_range[0])/step)) + 1
+    a = tws_range[0] + step*np.arange(n_a)
+    b = twa_range[0] + step*np.arange(n_b)
+    table = np.ascontiguousarray(spline(a, b), dtype=dtype)
+    return table, (tws_range[0], float(step), twa_range[0], float(step))
+
+
+@njit(nogil=True, cache=True)
+def polar_lookup(table, a0, da, b0, db, a, b):
+    """Bilinear lookup of a regular performance table.
+
+    Values outside of the table are clamped to its edges.
+    """
+    if np.isnan(a) or np.isnan(b):
+        return np.nan
+    n_a, n_b = table.shape
+    fa = min(max((a - a0)/da, 0.0), n_a - 1.0)
+    fb = min(max((b - b0)/db, 0.0), n_b - 1.0)
+    i = min(int(fa), n_a - 2)
+    j = min(int(fb), n_b - 2)
+    ta = fa - i
+    tb = fb - j
+    return ((1.0 - ta)*((1.0 - tb)*table[i, j] + tb*table[i, j+1]) +
+            ta*((1.0 - tb)*table[i+1, j] + tb*table[i+1, j+1]))
+
+
+@njit(nogil=True, cache=True)
+def polar_lookup_array(table, a0, da, b0, db, a, b):
+    """Bilinear lookup of a regular performance table over arrays."""
+    speed = np.empty(a.shape[0])
+    for k in range(a.shape[0]):
+        speed[k] = polar_lookup(table, a0, da, b0, db, a[k], b[k])
+    return speed
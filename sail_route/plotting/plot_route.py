@@ -0,0 +1,154 @@
+"""Plots of the routes and earliest arrival times of a solved grid.
+
+Importing this module sets the repository's matplotlib style and the
+Agg backend, so it is only imported when plotting.
+
+Thomas Dickson
+thomas.dickson@soton.ac.uk
+"""
+
+import textwrap
+import numpy as np
+from datetime import datetime
+import matplotlib # removing this causes a segmentation fault
+matplotlib.use('Agg')
+from mpl_toolkits.basemap import Basemap
+import matplotlib.pyplot as plt
+from sail_route.route.node_state import arrival_times
+from sail_route.sail_routing import timestamp_to_delta_time
+
+plt.rcParams['savefig.dpi'] = 400
+plt.rcParams['figure.autolayout'] = False
+plt.rcParams['figure.figsize'] = 10, 6
+plt.rcParams['axes.labelsize'] = 14
+plt.rcParams['axes.titlesize'] = 20
+plt.rcParams['font.size'] = 16
+plt.rcParams['lines.linewidth'] = 2.0
+plt.rcParams['lines.markersize'] = 8
+plt.rcParams['legend.fontsize'] = 12
+plt.rcParams['text.usetex'] = False
+plt.rcParams['font.family'] = "serif"
+plt.rcParams['font.serif'] = "cm"
+plt.rcParams['text.latex.preamble'] = """\\usepackage{subdepth},
+                                         \\usepackage{type1cm}"""
+
+
+def plot_mt_route(start, route, x, y, x_r, y_r, et, jt, fill, fname):
+    """Plot minimum time output from routing simulations.
+
+    et is the earliest times or the node state of the grid.
+    """
+    if et.dtype.names is not None:
+        et = arrival_times(et)
+    vt = datetime.fromtimestamp(jt) - start
+    # ul = jt + vt.total_seconds()/6
+    add_param = fill
+    res = 'i'
+    plt.figure(figsize=(6, 10))
+    map = Basemap(projection='merc',
+                  ellps='WGS84',
+                  lat_0=(y.min() + y.max())/2,
+                  lon_0=(x.min() + x.max())/2,
+                  llcrnrlon=x.min()-add_param,
+                  llcrnrlat=y.min()-add_param,
+                  urcrnrlon=x.max()+add_param,
+                  urcrnrlat=y.max()+add_param,
+                  resolution=res)  # f = fine resolution
+    map.drawcoastlines()
+    r_s_x, r_s_y = map(route.start.long, route.start.lat)
+    map.scatter(r_s_x, r_s_y, color='red', s=50, label='Start')
+    r_f_x, r_f_y = map(route.finish.long, route.finish.lat)
+    parallels = np.arange(-90.0, 90.0, 20.)
+    map.drawparallels(parallels, labels=[1, 0, 0, 0])
+    meridians = np.arange(180., 360., 20.)
+    # map.fillcontinents(color='black')
+    map.drawmeridians(meridians, labels=[0, 0, 0, 1])
+    map.scatter(r_f_x, r_f_y, color='blue', s=50, label='Finish')
+    if vt.total_seconds() < 10000000:
+        x_r, y_r = map(x_r, y_r)
+        map.plot(x_r, y_r, color='green', label='Minimum time path')
+        x, y = map(x, y)
+        ctf = map.contourf(x, y, et, cmap='bwr')
+        y_tick_labs = [timestamp_to_delta_time(start, x) for x in
+                       np.linspace(et[np.isfinite(et)].min(),
+                                   et[np.isfinite(et)].max(), 9)]
+        # y_tick_labs = [timestamp_to_delta_time(start, x) for x in
+        #                np.linspace(et.min(),
+        #                            et.max(), 9)]
+        cbar = plt.colorbar(ctf, orientation='horizontal')
+        cbar.ax.set_xticklabels(y_tick_labs, rotation=25)
+        tit = "\n".join(textwrap.wrap("Journey time: " + str(vt), 80))
+        plt.title(tit)
+    else:
+        plt.title("Voyage failed")
+        try:
+            map.scatter(x[et == np.inf], y[et == np.inf], color='red',
+                        s=1, label='No go')
+        except ValueError:
+            pass
+    # start1_lon = -16.0
+    # start1_lat = 51.0
+    # start2_lon = -8.0
+    # start2_lat = 45.0
+    # fin_lon = -60.0
+    # fin1_lat = 25.0
+    # fin2_lat = 10.0
+    #
+    # s1lon, s1lat = map(start1_lon, start1_lat)
+    # s2lon, s2lat = map(start2_lon, start2_lat)
+    # f1lon, f1lat = map(fin_lon, fin1_lat)
+    # f2lon, f2lat = map(fin_lon, fin2_lat)
+    # plt.plot([s1lon, s2lon], [s1lat, s2lat], label="Start line")
+    # plt.plot([f1lon, f2lon], [f1lat, f2lat], label="Finish line")
+    plt.legend(loc='lower right', fancybox=True, framealpha=0.5)
+    # plt.tight_layout()
+    plt.savefig(fname+"min_time"+".png")
+    plt.clf()
+
+
+def plot_isochrones(start, route, x, y, et, fill, fname):
+    """Plot isochrones for shortest path.
+
+    et is the earliest times or the node state of the grid.
+    """
+    if et.dtype.names is not None:
+        et = arrival_times(et)
+    plt.figure(figsize=(6, 10))
+    map = Basemap(projection='merc',
+                  ellps='WGS84',
+                  lat_0=(y.min() + y.max())/2,
+                  lon_0=(x.min() + x.max())/2,
+                  llcrnrlon=x.min()-fill,
+                  llcrnrlat=y.min()-fill,
+                  urcrnrlon=x.max()+fill,
+                  urcrnrlat=y.max()+fill,
+                  resolution='i')  # f = fine resolution
+    map.drawcoastlines()
+    start1_lon = -16.0
+    start1_lat = 51.0
+    start2_lon = -8.0
+    start2_lat = 45.0
+    fin_lon = -60.0
+    fin1_lat = 25.0
+    fin2_lat = 10.0
+
+    s1lon, s1lat = map(start1_lon, start1_lat)
+    s2lon, s2lat = map(start2_lon, start2_lat)
+    f1lon, f1lat = map(fin_lon, fin1_lat)
+    f2lon, f2lat = map(fin_lon, fin2_lat)
+    plt.plot([s1lon, s2lon], [s1lat, s2lat], label="Start line")
+    plt.plot([f1lon, f2lon], [f1lat, f2lat], label="Finish line")
+    x, y = map(x, y)
+    try:
+        ctf = map.contourf(x, y, et, cmap='bwr')
+        y_tick_labs = [timestamp_to_delta_time(start, x) for x in
+                       np.linspace(et[np.isfinite(et)].min(),
+                                   et[np.isfinite(et)].max(), 9)]
+        cbar = plt.colorbar(ctf, orientation='horizontal')
+        cbar.ax.set_xticklabels(y_tick_labs, rotation=25)
+    except ValueError:
+        pass
+    map.scatter(x[~np.isfinite(et)], y[~np.isfinite(et)], color='red',
+                s=1, label='No go')
+    map.fillcontinents(color='black')
+    plt.savefig(fname+"isochrones"+".png")
@@ -0,0 +1,121 @@
+"""Connectivity between the ranks of a routing grid.
+
+By default every node of a rank is connected to every node of the next.
+Limiting the lateral offset or the heading of each leg removes the
+edges which the craft could never sail quickly, so the work of a rank
+transition grows with the number of edges kept rather than n_width**2.
+
+The edges are held CSR style, keyed by destination node: the
+predecessors of node k of rank i+1 are
+indices[indptr[i*n_width + k]:indptr[i*n_width + k + 1]], in ascending
+order, so the kernel scans them in the same order as full connectivity.
+
+Thomas Dickson
+thomas.dickson@soton.ac.uk
+"""
+
+import numpy as np
+from sail_route.performance.cost_function import dir_to_relative
+from sail_route.route.geodesy import haversine, pairwise
+
+
+class Connectivity(object):
+    """Edges between consecutive ranks of a grid."""
+
+    def __init__(self, indptr, indices, n_width):
+        """Store the CSR arrays of the edges of a grid n_width wide."""
+        self.indptr = indptr
+        self.indices = indices
+        self.n_width = n_width
+
+    @property
+    def n_edges(self):
+        """Return the number of edges between ranks."""
+        return self.indices.shape[0]
+
+    def predecessors(self, i, k):
+        """Return the nodes of rank i connected to node k of rank i+1."""
+        c = i*self.n_width + k
+        return self.indices[self.indptr[c]:self.indptr[c+1]]
+
+    def destinations(self):
+        """Return the rank i and width k of the destination of each edge.
+
+        The destination is node k of rank i+1.
+        """
+        dest = np.repeat(np.arange(self.indptr.shape[0] - 1),
+                         np.diff(self.indptr))
+        return np.divmod(dest, self.n_width)
+
+    def subset(self, cols):
+        """Return the edges between the nodes of the given width indices.
+
+        The nodes are renumbered by their position in cols, which must
+        be increasing.
+        """
+        rank, k = self.destinations()
+        position = np.full(self.n_width, -1, dtype=np.int64)
+        position[cols] = np.arange(len(cols))
+        keep = (position[k] >= 0) & (position[self.indices] >= 0)
+        n_dest = (self.indptr.shape[0] - 1) // self.n_width*len(cols)
+        counts = np.bincount(rank[keep]*len(cols) + position[k[keep]],
+                             minlength=n_dest)
+        indptr = np.zeros(n_dest + 1, dtype=np.int64)
+        np.cumsum(counts, out=indptr[1:])
+        return Connectivity(indptr, position[self.indices[keep]].astype(
+            np.int32), len(cols))
+
+    def mask(self, i):
+        """Return whether node j of rank i connects to node k as [j, k]."""
+        c = i*self.n_width
+        lo, hi = self.indptr[c], self.indptr[c + self.n_width]
+        k = np.repeat(np.arange(self.n_width),
+                      np.diff(self.indptr[c:c + self.n_width + 1]))
+        mask = np.zeros((self.n_width, self.n_width), dtype=bool)
+        mask[self.indices[lo:hi], k] = True
+        return mask
+
+    def out_degree(self, land):
+        """Return the number of sea nodes each node connects to.
+
+        Returned for every rank but the last as an (n_ranks-1, n_width)
+        array.
+        """
+        rank, k = self.destinations()
+        sea = ~np.asarray(land, dtype=bool)[1:][rank, k]
+        degree = np.zeros((land.shape[0] - 1, self.n_width), dtype=np.int64)
+        np.add.at(degree, (rank[sea], self.indices[sea]), 1)
+        return degree
+
+
+def gen_edges(x, y, max_offset=None, max_heading=None):
+    """Return the connectivity of a grid.
+
+    max_offset limits the difference between the width indices of the
+    nodes of an edge. max_heading limits the angle in degrees between
+    the bearing of an edge and the bearing between the central nodes of
+    its ranks.
+    """
+    n_ranks, n_width = x.shape
+    width = np.arange(n_width)
+    counts = []
+    indices = []
+    for i in range(n_ranks - 1):
+        keep = np.ones((n_width, n_width), dtype=bool)
+        if max_offset is not None:
+            keep &= np.abs(width[:, None] - width[None, :]) <= max_offset
+        if max_heading is not None:
+            mid = n_width // 2
+            course = haversine(x[i, mid], y[i, mid],
+                               x[i+1, mid], y[i+1, mid])[1]
+            bearing = pairwise(x[i], y[i], x[i+1], y[i+1])[1].T
+            keep &= dir_to_relative(bearing, course) <= max_heading
+        counts.append(keep.sum(axis=1))
+        indices.append(np.nonzero(keep)[1].astype(np.int32))
+    indptr = np.zeros((n_ranks - 1)*n_width + 1, dtype=np.int64)
+    if counts:
+        np.cumsum(np.concatenate(counts), out=indptr[1:])
+        indices = np.concatenate(indices)
+    else:
+        indices = np.zeros(0, dtype=np.int32)
+    return Connectivity(indptr, indices, n_width)
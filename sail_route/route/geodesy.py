@@ -0,0 +1,176 @@
+"""Distance and initial bearing between points on the Earth.
+
+haversine is the scalar great circle kernel called from compiled code.
+distance_bearing evaluates the same formula over arrays, broadcasting
+its arguments as NumPy does, and pairwise costs every edge between
+(N,) and (M,) point sets. It optionally computes in float32, halving
+the memory traffic of large sets of legs, or on the WGS84 ellipsoid.
+
+Distances are in nautical miles and bearings in degrees clockwise from
+north in [0, 360).
+
+Thomas Dickson
+thomas.dickson@soton.ac.uk
+"""
+
+import numpy as np
+from functools import lru_cache
+from numba import njit, guvectorize
+
+R = 6372.8  # Earth radius in kilometers
+km_to_nm = 0.5399565
+
+
+@njit(fastmath=True, nogil=True, cache=True)
+def haversine(lon1, lat1, lon2, lat2):
+    """
+    Calculate the great circle distance between two points.
+
+    Return the value in nm.
+    """
+    dLat = np.radians(lat2 - lat1)
+    dLon = np.radians(lon2 - lon1)
+    lat1 = np.radians(lat1)
+    lat2 = np.radians(lat2)
+    a = np.sin(dLat/2)**2 + np.cos(lat1)*np.cos(lat2)*np.sin(dLon/2)**2
+    c = 2*np.arcsin(np.sqrt(a))
+    theta = np.arctan2(np.sin(dLon)*np.cos(lat2),
+                       np.cos(lat1)*np.sin(lat2) -
+                       np.sin(lat1)*np.cos(lat2)*np.cos(dLon))
+    theta = (np.rad2deg(theta) + 360) % 360
+    return R*c*km_to_nm, theta
+
+
+def _haversine_kernel(dtype):
+    """Return the haversine ufunc kernel computing in dtype.
+
+    The operations are those of haversine, so float64 results agree
+    with it to rounding, and the constants are frozen at dtype so
+    float32 inputs are computed in float32 rather than promoted.
+    """
+    radius = dtype(R)
+    nm = dtype(km_to_nm)
+    two = dtype(2.0)
+    full = dtype(360.0)
+
+    def kernel(lon1, lat1, lon2, lat2, dist, bearing):
+        dLat = np.radians(lat2 - lat1)
+        dLon = np.radians(lon2 - lon1)
+        phi1 = np.radians(lat1)
+        phi2 = np.radians(lat2)
+        a = np.sin(dLat/two)**2 + \
+            np.cos(phi1)*np.cos(phi2)*np.sin(dLon/two)**2
+        c = two*np.arcsin(np.sqrt(a))
+        theta = np.arctan2(np.sin(dLon)*np.cos(phi2),
+                           np.cos(phi1)*np.sin(phi2) -
+                           np.sin(phi1)*np.cos(phi2)*np.cos(dLon))
+        dist[0] = radius*c*nm
+        bearing[0] = (np.rad2deg(theta) + full) % full
+    return kernel
+
+
+@lru_cache(maxsize=None)
+def _haversine_ufunc(dtype):
+    """Return the haversine ufunc of dtype, compiling it on first use.
+
+    A ufunc with signatures is compiled when it is created, which would
+    otherwise be paid by every import.
+    """
+    code = {np.float64: 'f8', np.float32: 'f4'}[dtype]
+    return guvectorize(['void({0}, {0}, {0}, {0}, {0}[:], {0}[:])'.format(
+        code)], '(),(),(),()->(),()', nopython=True,
+        fastmath=True, cache=True)(_haversine_kernel(dtype))
+
+
+def ellipsoid_distance_bearing(lon1, lat1, lon2, lat2, ellps='WGS84'):
+    """Return the geodesic distance and bearing on an ellipsoid.
+
+    Geodesics are solved by pyproj with Karney's algorithm, which unlike
+    Vincenty's converges for nearly antipodal points.
+    """
+    import pyproj
+    lon1, lat1, lon2, lat2 = np.broadcast_arrays(
+        *[np.asarray(a, dtype=np.float64) for a in (lon1, lat1, lon2, lat2)])
+    azimuth, back, dist = pyproj.Geod(ellps=ellps).inv(lon1, lat1, lon2,
+                                                        lat2)
+    return (np.asarray(dist)/1000.0*km_to_nm,
+            np.asarray(azimuth) % 360.0)
+
+
+def distance_bearing(lon1, lat1, lon2, lat2, dtype=np.float64,
+                     method='sphere'):
+    """Return the distance and bearing between broadcast arrays of points.
+
+    dtype is np.float64 or np.float32, the precision the haversine is
+    computed and returned in. method is 'sphere' for the haversine or
+    'ellipsoid' for geodesics on WGS84, which are always computed in
+    float64 before being returned at dtype.
+    """
+    if method == 'ellipsoid':
+        dist, bearing = ellipsoid_distance_bearing(lon1, lat1, lon2, lat2)
+        return dist.astype(dtype), bearing.astype(dtype)
+    elif method != 'sphere':
+        raise ValueError("Unknown geodesy method: {0}".format(method))
+    if np.dtype(dtype) == np.float32:
+        kernel = _haversine_ufunc(np.float32)
+    elif np.dtype(dtype) == np.float64:
+        kernel = _haversine_ufunc(np.float64)
+    else:
+        raise ValueError("Unsupported dtype: {0}".format(dtype))
+    dtype = np.dtype(dtype)
+    return kernel(*[np.asarray(a, dtype=dtype)
+                    for a in (lon1, lat1, lon2, lat2)])
+
+
+def _pairwise_kernel(dtype):
+    """Return the compiled pairwise haversine computing in dtype.
+
+    The trigonometry of each point's latitude is computed once rather
+    than for every edge it is part of.
+    """
+    radius = dtype(R)
+    nm = dtype(km_to_nm)
+    two = dtype(2.0)
+    full = dtype(360.0)
+
+    def kernel(lon1, lat1, lon2, lat2):
+        n, m = lon1.shape[0], lon2.shape[0]
+        dist = np.empty((n, m), dtype=lon1.dtype)
+        bearing = np.empty((n, m), dtype=lon1.dtype)
+        phi2 = np.radians(lat2)
+        cos2 = np.cos(phi2)
+        sin2 = np.sin(phi2)
+        for j in range(n):
+            phi1 = np.radians(lat1[j])
+            cos1 = np.cos(phi1)
+            sin1 = np.sin(phi1)
+            for k in range(m):
+                dLat = np.radians(lat2[k] - lat1[j])
+                dLon = np.radians(lon2[k] - lon1[j])
+                a = np.sin(dLat/two)**2 + cos1*cos2[k]*np.sin(dLon/two)**2
+                c = two*np.arcsin(np.sqrt(a))
+                theta = np.arctan2(np.sin(dLon)*cos2[k],
+                                   cos1*sin2[k] - sin1*cos2[k]*np.cos(dLon))
+                dist[j, k] = radius*c*nm
+                bearing[j, k] = (np.rad2deg(theta) + full) % full
+        return dist, bearing
+    return kernel
+
+
+_pairwise64 = njit(fastmath=True, nogil=True,
+                   cache=True)(_pairwise_kernel(np.float64))
+_pairwise32 = njit(fastmath=True, nogil=True,
+                   cache=True)(_pairwise_kernel(np.float32))
+
+
+def pairwise(lon1, lat1, lon2, lat2, dtype=np.float64, method='sphere'):
+    """Return the (N, M) distance and bearing from N points to M points."""
+    if method == 'sphere' and np.dtype(dtype) in (np.float32, np.float64):
+        kernel = _pairwise32 if np.dtype(dtype) == np.float32 \
+            else _pairwise64
+        return kernel(*[np.ascontiguousarray(a, dtype=dtype)
+                        for a in (lon1, lat1, lon2, lat2)])
+    return distance_bearing(np.asarray(lon1)[:, None],
+                            np.asarray(lat1)[:, None],
+                            np.asarray(lon2)[None, :],
+                            np.asarray(lat2)[None, :], dtype, method)
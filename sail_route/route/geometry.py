@@ -0,0 +1,143 @@
+"""Distance and bearing of the legs of a routing grid.
+
+The geometry of every leg depends only on the grid, so it is computed
+once and shared by every scenario routed over that grid rather than
+recomputed for each edge of each run. Legs are held as a (2, n_legs)
+array of distance in nm and bearing in the order the kernel visits the
+edges between ranks: destination node by destination node, each
+listing its predecessors as in a Connectivity or, for full
+connectivity, every node of the previous rank. Each geometry holds the
+key of the route and grid it was computed for, and is checked against
+the grid it is routed over.
+
+Thomas Dickson
+thomas.dickson@soton.ac.uk
+"""
+
+import os
+import numpy as np
+from numba import njit
+from sail_route.cache import hash_key
+from sail_route.route.geodesy import haversine, distance_bearing
+from sail_route.route.kernel import full_edges
+
+
+class GridGeometry(object):
+    """Distance and bearing of each leg of a routing grid."""
+
+    def __init__(self, legs, start_legs, finish_legs, key=None):
+        """Store the geometry of the legs of a grid.
+
+        legs, (2, n_legs) distance and bearing of the edges between ranks
+        start_legs, (2, n_width) legs from the start to the first rank
+        finish_legs, (2, n_width) legs from the last rank to the finish
+        key, grid_key of the route and grid, or None if it is unknown
+        """
+        self.legs = legs
+        self.start_legs = start_legs
+        self.finish_legs = finish_legs
+        self.key = key
+
+    @property
+    def nbytes(self):
+        """Return the memory taken by the geometry in bytes."""
+        return (self.legs.nbytes + self.start_legs.nbytes +
+                self.finish_legs.nbytes)
+
+    def save(self, path):
+        """Save the geometry as .npy files in the directory path."""
+        os.makedirs(path, exist_ok=True)
+        for name in ('legs', 'start_legs', 'finish_legs'):
+            np.save(os.path.join(path, name + '.npy'), getattr(self, name))
+        if self.key is not None:
+            with open(os.path.join(path, 'key'), 'w') as f:
+                f.write(self.key)
+
+    def check(self, route, x, y):
+        """Raise ValueError unless the geometry is of route over x, y.
+
+        Geometries of unknown key are not checked.
+        """
+        if self.key is not None and self.key != grid_key(route, x, y):
+            raise ValueError("Geometry was computed for another route or "
+                             "grid")
+
+    def kernel_args(self):
+        """Return the arrays passed to the kernel."""
+        return self.legs, self.start_legs, self.finish_legs
+
+
+def load_geometry(path, mmap_mode='r'):
+    """Load a GridGeometry saved in the directory path.
+
+    By default the arrays are memory-mapped rather than read.
+    """
+    key = None
+    if os.path.exists(os.path.join(path, 'key')):
+        with open(os.path.join(path, 'key')) as f:
+            key = f.read()
+    return GridGeometry(*[np.load(os.path.join(path, name + '.npy'),
+                                  mmap_mode=mmap_mode)
+                          for name in ('legs', 'start_legs',
+                                       'finish_legs')], key=key)
+
+
+def grid_key(route, x, y):
+    """Return the key of the legs of a route over the grid x, y."""
+    return hash_key(np.asarray(x, dtype=np.float64),
+                    np.asarray(y, dtype=np.float64), route.start.long,
+                    route.start.lat, route.finish.long, route.finish.lat,
+                    route.max_offset, route.max_heading)
+
+
+def no_geometry(dtype=np.float64):
+    """Return the kernel arguments computing legs as they are sailed."""
+    return (np.zeros((2, 0), dtype=dtype), np.zeros((2, 0), dtype=dtype),
+            np.zeros((2, 0), dtype=dtype))
+
+
+@njit(nogil=True, cache=True)
+def _leg_geometry(x, y, indptr, indices, legs):
+    """Fill legs with the geometry of the edges between ranks."""
+    n_ranks, n_width = x.shape
+    dense = indptr.shape[0] == 0
+    for i in range(n_ranks-1):
+        for k in range(n_width):
+            if dense:
+                lo = (i*n_width + k)*n_width
+                hi = lo + n_width
+            else:
+                lo = indptr[i*n_width + k]
+                hi = indptr[i*n_width + k + 1]
+            for e in range(lo, hi):
+                j = e - lo if dense else indices[e]
+                dist, bearing = haversine(x[i, j], y[i, j],
+                                          x[i+1, k], y[i+1, k])
+                legs[0, e] = dist
+                legs[1, e] = bearing
+
+
+def gen_geometry(route, x, y, dtype=np.float64):
+    """Return the GridGeometry of a route over the grid x, y.
+
+    The legs follow the connectivity of the route and are stored at
+    dtype, float32 halving their memory at the cost of rounding.
+    """
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    n_ranks, n_width = x.shape
+    edges = route.edges(x, y)
+    if edges is None:
+        indptr, indices = full_edges()
+        n_legs = (n_ranks - 1)*n_width*n_width
+    else:
+        indptr, indices = edges.indptr, edges.indices
+        n_legs = edges.n_edges
+    legs = np.empty((2, n_legs))
+    _leg_geometry(x, y, indptr, indices, legs)
+    start = np.stack(distance_bearing(route.start.long, route.start.lat,
+                                      x[0], y[0]))
+    finish = np.stack(distance_bearing(x[-1], y[-1], route.finish.long,
+                                       route.finish.lat))
+    return GridGeometry(legs.astype(dtype), start.astype(dtype),
+                        finish.astype(dtype), grid_key(route, x, y))
@@ -14,53 +14,98 @@ lies on land or not.
 
 """
 import numpy as np
-from numba import jit, njit
-from mpl_toolkits.basemap import Basemap
-import pyproj
-from shapely.geometry import Point
+from functools import lru_cache
+from numba import njit
+from sail_route.route.land_mask import land_mask
+
+
+@lru_cache(maxsize=None)
+def _transformers():
+    """Return the cached transforms between long/lat and Mercator."""
+    import pyproj
+    to_merc = pyproj.Transformer.from_crs('epsg:4326', 'epsg:3857',
+                                          always_xy=True)
+    from_merc = pyproj.Transformer.from_crs('epsg:3857', 'epsg:4326',
+                                            always_xy=True)
+    return to_merc, from_merc, pyproj.Geod(ellps='clrk66')
+
+
+def meridian_distance(lat, a, es):
+    """Return the distance along the meridian from the equator to lat."""
+    phi = np.radians(lat)
+    return a*((1 - es/4 - 3*es**2/64 - 5*es**3/256)*phi -
+              (3*es/8 + 3*es**2/32 + 45*es**3/1024)*np.sin(2*phi) +
+              (15*es**2/256 + 45*es**3/1024)*np.sin(4*phi) -
+              (35*es**3/3072)*np.sin(6*phi))
+
+
+def meridian_latitude(m, a, es):
+    """Return the latitude a distance m along the meridian from the equator.
+
+    Inverse of meridian_distance.
+    """
+    mu = m/(a*(1 - es/4 - 3*es**2/64 - 5*es**3/256))
+    e1 = (1 - np.sqrt(1 - es))/(1 + np.sqrt(1 - es))
+    phi = (mu + (3*e1/2 - 27*e1**3/32)*np.sin(2*mu) +
+           (21*e1**2/16 - 55*e1**4/32)*np.sin(4*mu) +
+           (151*e1**3/96)*np.sin(6*mu) +
+           (1097*e1**4/512)*np.sin(8*mu))
+    return np.degrees(phi)
 
 
-@jit
 def line_points(x, y, n_nodes, dist):
-    """Calculate the locations of the points along a rank."""
-    p_ll = pyproj.Proj(init='epsg:4326')
-    p_mt = pyproj.Proj(init='epsg:3857')
-    g = pyproj.Geod(ellps='clrk66')
-    tran = pyproj.transform(p_ll, p_mt, x, y)
-    upper = Point((tran[0], tran[1]+dist*n_nodes/2))
-    lower = Point((tran[0], tran[1]-dist*n_nodes/2))
-    tran_upper = pyproj.transform(p_mt, p_ll, upper.x, upper.y)
-    tran_lower = pyproj.transform(p_mt, p_ll, lower.x, lower.y)
-    points = g.npts(tran_upper[0], tran_upper[1],
-                    tran_lower[0], tran_lower[1], n_nodes-2)
-    return np.vstack((np.array(tran_upper), np.array(points),
-                     np.array(tran_lower)))
+    """Calculate the locations of the points along ranks.
+
+    x and y are the longitudes and latitudes of the centre of each rank.
+    Returns an array of shape x.shape + (n_nodes, 2) of the long/lat of
+    each point, running from the upper to the lower end of the rank.
+    Each rank lies along a meridian, so the points between its ends are
+    spaced evenly along the meridian arc.
+    """
+    to_merc, from_merc, g = _transformers()
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    mx, my = to_merc.transform(x, y)
+    half = dist*n_nodes/2
+    upper_x, upper_y = from_merc.transform(mx, my + half)
+    lower_x, lower_y = from_merc.transform(mx, my - half)
+    m_upper = meridian_distance(upper_y, g.a, g.es)
+    m_lower = meridian_distance(lower_y, g.a, g.es)
+    frac = np.arange(1, n_nodes-1)/(n_nodes-1.0)
+    points = np.empty(np.shape(x) + (n_nodes, 2))
+    points[..., 0] = np.asarray(upper_x)[..., None]
+    points[..., 0, 1] = upper_y
+    points[..., 1:-1, 1] = meridian_latitude(
+        m_upper[..., None] + (m_lower - m_upper)[..., None]*frac,
+        g.a, g.es)
+    points[..., -1, 1] = lower_y
+    return points
 
 
 def gen_grid(start_long, finish_long, start_lat, finish_lat,
              n_ranks=10, n_nodes=10, dist=5000):
-    """Return grid between start and finish."""
-    g = pyproj.Geod(ellps='clrk66')
+    """Return grid between start and finish.
+
+    The grid is an array of shape (n_ranks, n_nodes, 2) of the long/lat
+    of each node.
+    """
+    g = _transformers()[2]
     azimuths = g.inv(start_long, start_lat, finish_long, finish_lat)
     rot = azimuths[0]-90.0
     height = dist * np.sin(rot) + dist*np.cos(rot)
-    great_circle = g.npts(start_long, start_lat, finish_long, finish_lat,
-                          n_ranks)
-    grid = [line_points(g[0], g[1], n_nodes, height) for g in great_circle]
-    return grid
+    great_circle = np.array(g.npts(start_long, start_lat, finish_long,
+                                   finish_lat, n_ranks))
+    return line_points(great_circle[:, 0], great_circle[:, 1], n_nodes,
+                       height)
 
 
 def check_land(grid):
     """Check co-ordinates."""
-    bm = Basemap()
-    points = []
-    for g in grid:
-        g_land = [bm.is_land(p[0], p[1]) for p in g]
-        points.append(g_land)
-    return points
+    grid = np.asarray(grid)
+    return land_mask(grid[..., 0], grid[..., 1])
 
 
-@njit(fastmath=True)
+@njit(fastmath=True, cache=True)
 def gen_indx(x_locs):
     """Return the indexes for each node to be iterated over.
 
@@ -72,18 +117,13 @@ def gen_indx(x_locs):
     return indx, pindx
 
 
-@jit(cache=True)
 def return_co_ords(start_long, finish_long, start_lat, finish_lat,
                    n_ranks=10, n_nodes=10, dist=5000):
     """Return grid co-ordinates between start and finish."""
     grid = gen_grid(start_long, finish_long, start_lat, finish_lat,
                     n_ranks, n_nodes, dist)
     land = check_land(grid)
-    land = np.reshape(land, (n_ranks, n_nodes))
-    g = np.reshape(grid, (1, -1))
-    x = np.reshape(g[0][::2], (n_ranks, n_nodes))
-    y = np.reshape(g[0][1::2], (n_ranks, n_nodes))
-    return x, y, np.array(land)
+    return grid[..., 0], grid[..., 1], land
 
 
 if __name__ == '__main__':
@@ -0,0 +1,310 @@
+"""Compiled minimum time solver.
+
+The routing graph is relaxed entirely in nopython mode. Times are held
+as float timestamps in seconds and the craft, weather and grid are
+passed as plain arrays, so no Python objects are touched between the
+start and finish of a route.
+
+Each rank transition is relaxed by destination node. Every destination
+scans its candidate predecessors in order and keeps the first of any
+equally early arrivals, so the serial and parallel kernels compiled from
+the same source return identical results for any number of threads.
+
+Thomas Dickson
+thomas.dickson@soton.ac.uk
+"""
+
+import numpy as np
+import numba
+from contextlib import contextmanager
+from numba import njit, prange
+from sail_route.performance.compiled_bbn import env_failure_model
+from sail_route.performance.cost_function import edge_time, leg_time, \
+    haversine
+from sail_route.weather.weather_field import sample_node
+
+counters = ('nodes_expanded', 'edges_relaxed', 'infinite_edges',
+            'polar_lookups', 'weather_lookups', 'land_skipped')
+NODES_EXPANDED, EDGES_RELAXED, INFINITE_EDGES, POLAR_LOOKUPS, \
+    WEATHER_LOOKUPS, LAND_SKIPPED = range(len(counters))
+
+
+@njit(nogil=True, cache=True)
+def _count_leg(counts, i, k, tws, twd, wd, wh, wp, hours):
+    """Count a leg costed into node k of row i of counts.
+
+    The polar is only looked up when none of the weather is missing.
+    """
+    counts[EDGES_RELAXED, i, k] += 1
+    if not (np.isnan(tws) or np.isnan(twd) or np.isnan(wd) or
+            np.isnan(wh) or np.isnan(wp)):
+        counts[POLAR_LOOKUPS, i, k] += 1
+    if hours == np.inf:
+        counts[INFINITE_EDGES, i, k] += 1
+
+
+def _min_time(start_long, start_lat, finish_long, finish_lat,
+              x, y, land, weather, times, t0, linear,
+              table, table_params, unc, fail_table, apf, bound, incumbent,
+              indptr, indices, legs, start_legs, finish_legs, counts):
+    """Calculate the earliest arrival time across co-ordinates.
+
+    weather is the (n_fields, n_times, n_ranks, n_width) array of a
+    WeatherField with its times, sampled at the nearest time or, if
+    linear, interpolated in time, t0 the departure timestamp and table,
+    table_params, unc, fail_table and apf describe the craft as for
+    edge_time. indptr and indices are the edges between ranks of a
+    Connectivity, every node connecting to all of the next rank when
+    indptr is empty. legs, start_legs and finish_legs are the arrays of
+    a GridGeometry, the legs being computed as they are sailed when legs
+    is empty. Nodes whose earliest time plus bound, a lower bound on
+    the seconds remaining to the finish, exceeds incumbent are not
+    expanded. Unless counts is empty, the work done is added to the
+    (n_counters, n_ranks + 1, n_width) counts, in the order of counters,
+    against the node each leg arrives at, the last row counting the
+    legs to the finish. Returns the journey time, the earliest time at
+    each node, the predecessor of each node, the final node of the route
+    and which nodes were pruned.
+    """
+    n_ranks, n_width = x.shape
+    n_fields = weather.shape[0]
+    earl_time = np.full((n_ranks, n_width), np.inf)
+    pindxs = np.full((n_ranks, n_width), -1, dtype=np.int64)
+    pruned = np.zeros((n_ranks, n_width), dtype=np.bool_)
+    dense = indptr.shape[0] == 0
+    known = legs.shape[1] > 0
+    counting = counts.shape[0] > 0
+    src = np.empty((n_fields, n_width))
+    for k in prange(n_width):
+        if land[0, k]:
+            if counting:
+                counts[LAND_SKIPPED, 0, k] += 1
+        else:
+            sample_node(weather, times, t0, 0, k, linear, src, k)
+            if known:
+                hours = leg_time(start_legs[0, k], start_legs[1, k],
+                                 src[0, k], src[1, k], src[2, k], src[3, k],
+                                 src[4, k], table, table_params, unc,
+                                 fail_table, apf)
+            else:
+                hours = edge_time(start_long, start_lat, x[0, k], y[0, k],
+                                  src[0, k], src[1, k], src[2, k], src[3, k],
+                                  src[4, k], table, table_params, unc,
+                                  fail_table, apf)
+            if counting:
+                counts[WEATHER_LOOKUPS, 0, k] += 1
+                _count_leg(counts, 0, k, src[0, k], src[1, k], src[2, k],
+                           src[3, k], src[4, k], hours)
+            if hours < np.inf:
+                earl_time[0, k] = t0 + hours*3600.0
+    active = np.zeros(n_width, dtype=np.bool_)
+    for i in range(n_ranks-1):
+        for j in prange(n_width):
+            active[j] = False
+            if earl_time[i, j] < np.inf:
+                if earl_time[i, j] + bound[i, j] > incumbent:
+                    pruned[i, j] = True
+                else:
+                    active[j] = True
+                    sample_node(weather, times, earl_time[i, j], i, j,
+                                linear, src, j)
+                    if counting:
+                        counts[NODES_EXPANDED, i, j] += 1
+                        counts[WEATHER_LOOKUPS, i, j] += 1
+        for k in prange(n_width):
+            if land[i+1, k]:
+                if counting:
+                    counts[LAND_SKIPPED, i+1, k] += 1
+            else:
+                best = np.inf
+                best_j = -1
+                if dense:
+                    lo = (i*n_width + k)*n_width
+                    hi = lo + n_width
+                else:
+                    lo = indptr[i*n_width + k]
+                    hi = indptr[i*n_width + k + 1]
+                for e in range(lo, hi):
+                    j = e - lo if dense else indices[e]
+                    if not active[j]:
+                        continue
+                    if known:
+                        hours = leg_time(legs[0, e], legs[1, e],
+                                         src[0, j], src[1, j], src[2, j],
+                                         src[3, j], src[4, j], table,
+                                         table_params, unc, fail_table,
+                                         apf)
+                    else:
+                        hours = edge_time(x[i, j], y[i, j],
+                                          x[i+1, k], y[i+1, k],
+                                          src[0, j], src[1, j], src[2, j],
+                                          src[3, j], src[4, j], table,
+                                          table_params, unc, fail_table,
+                                          apf)
+                    if counting:
+                        _count_leg(counts, i+1, k, src[0, j], src[1, j],
+                                   src[2, j], src[3, j], src[4, j], hours)
+                    if hours < np.inf:
+                        jt = earl_time[i, j] + hours*3600.0
+                        if jt < best:
+                            best = jt
+                            best_j = j
+                if best_j >= 0:
+                    earl_time[i+1, k] = best
+                    pindxs[i+1, k] = i*n_width + best_j
+    i = n_ranks - 1
+    finish = np.full(n_width, np.inf)
+    for j in prange(n_width):
+        t = earl_time[i, j]
+        if t < np.inf:
+            if t + bound[i, j] > incumbent:
+                pruned[i, j] = True
+                continue
+            sample_node(weather, times, t, i, j, linear, src, j)
+            if known:
+                hours = leg_time(finish_legs[0, j], finish_legs[1, j],
+                                 src[0, j], src[1, j], src[2, j], src[3, j],
+                                 src[4, j], table, table_params, unc,
+                                 fail_table, apf)
+            else:
+                hours = edge_time(x[i, j], y[i, j], finish_long, finish_lat,
+                                  src[0, j], src[1, j], src[2, j], src[3, j],
+                                  src[4, j], table, table_params, unc,
+                                  fail_table, apf)
+            if counting:
+                counts[NODES_EXPANDED, i, j] += 1
+                counts[WEATHER_LOOKUPS, i+1, j] += 1
+                _count_leg(counts, i+1, j, src[0, j], src[1, j], src[2, j],
+                           src[3, j], src[4, j], hours)
+            if hours < np.inf:
+                finish[j] = t + hours*3600.0
+    journey_time = 1e10
+    end_node = 0
+    for j in range(n_width):
+        if finish[j] < journey_time:
+            journey_time = finish[j]
+            end_node = i*n_width + j
+    return journey_time, earl_time, pindxs, end_node, pruned
+
+
+@njit(nogil=True, cache=True)
+def finish_kernel(finish_long, finish_lat, x, y, weather, times, linear,
+                  table, table_params, unc, fail_table, apf, finish_legs,
+                  last_time):
+    """Return the time each node of the final rank reaches the finish.
+
+    last_time holds the earliest times of the final rank and the finish
+    legs are sailed as the kernel sails them, nodes which are unreached
+    or cannot reach the finish taking infinite times.
+    """
+    i = x.shape[0] - 1
+    n_width = x.shape[1]
+    known = finish_legs.shape[1] > 0
+    src = np.empty((weather.shape[0], 1))
+    finish = np.full(n_width, np.inf)
+    for j in range(n_width):
+        t = last_time[j]
+        if not t < np.inf:
+            continue
+        sample_node(weather, times, t, i, j, linear, src, 0)
+        if known:
+            hours = leg_time(finish_legs[0, j], finish_legs[1, j],
+                             src[0, 0], src[1, 0], src[2, 0], src[3, 0],
+                             src[4, 0], table, table_params, unc,
+                             fail_table, apf)
+        else:
+            hours = edge_time(x[i, j], y[i, j], finish_long, finish_lat,
+                              src[0, 0], src[1, 0], src[2, 0], src[3, 0],
+                              src[4, 0], table, table_params, unc,
+                              fail_table, apf)
+        if hours < np.inf:
+            finish[j] = t + hours*3600.0
+    return finish
+
+
+@njit(nogil=True, cache=True)
+def goal_bound(x, y, finish_long, finish_lat, v_max):
+    """Return a lower bound on the seconds from each node to the finish.
+
+    No route is shorter than the great circle to the finish nor sailed
+    faster than v_max knots. The bound is shrunk by a relative 1e-9 so
+    rounding never lets it exceed a time the solver computes.
+    """
+    n_ranks, n_width = x.shape
+    bound = np.zeros((n_ranks, n_width))
+    if v_max > 0.0:
+        for i in range(n_ranks):
+            for j in range(n_width):
+                dist, bearing = haversine(x[i, j], y[i, j], finish_long,
+                                          finish_lat)
+                bound[i, j] = dist/v_max*3600.0*(1.0 - 1e-9)
+    return bound
+
+
+def full_edges():
+    """Return the indptr and indices connecting every node of a rank."""
+    return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int32)
+
+
+def no_counts():
+    """Return the empty counts which disable counting in the kernel."""
+    return np.zeros((0, 0, 0), dtype=np.int64)
+
+
+def new_counts(x):
+    """Return zeroed counts for the kernel over the grid x."""
+    return np.zeros((len(counters), x.shape[0] + 1, x.shape[1]),
+                    dtype=np.int64)
+
+
+def count_totals(counts, apf):
+    """Return the totals of kernel counts as a dict of counters.
+
+    The failure model is queried on every leg the polar is looked up for
+    when apf is below one.
+    """
+    totals = dict(zip(counters, (int(n) for n in counts.sum(axis=(1, 2)))))
+    totals['bbn_queries'] = totals['polar_lookups'] if apf < 1.0 else 0
+    return totals
+
+
+def craft_args(craft):
+    """Return the arrays and scalars describing a craft to the kernel.
+
+    The failure model is packed by pack_failure_model, from the
+    fail_table of a BBN or from a CompiledBBN, which can only be routed
+    when failure is checked if all of its evidence is discretised by
+    steps.
+    """
+    if craft.fail_table is not None:
+        fail_model = env_failure_model(craft.fail_table)
+    elif craft.apf < 1.0:
+        fail_model = craft.failure.kernel_model()
+    else:
+        fail_model = env_failure_model(np.zeros(16))
+    return (craft.table, craft.table_params, np.float64(craft.unc),
+            fail_model, np.float64(craft.apf))
+
+
+min_time_kernel = njit(nogil=True, cache=True)(_min_time)
+# Cache entries are keyed by the function and not its compile options, so
+# the parallel kernel is compiled in each process rather than sharing the
+# serial kernel's entries.
+min_time_kernel_parallel = njit(nogil=True, parallel=True)(_min_time)
+
+
+@contextmanager
+def kernel_threads(n_threads):
+    """Return a context running the parallel kernel on n_threads threads.
+
+    Requests for more threads than numba was started with are limited to
+    NUMBA_NUM_THREADS. The number of threads is yielded, and the previous
+    number is restored on leaving the context.
+    """
+    previous = numba.get_num_threads()
+    n_threads = max(1, min(int(n_threads), numba.config.NUMBA_NUM_THREADS))
+    numba.set_num_threads(n_threads)
+    try:
+        yield n_threads
+    finally:
+        numba.set_num_threads(previous)
@@ -0,0 +1,54 @@
+"""Land mask of grid locations.
+
+The coastline polygons of Basemap are merged into a single prepared
+geometry once per resolution, and every point of a grid is classified
+in one vectorised call. Masks are saved to the cache keyed by the grid
+co-ordinates, so repeated runs over the same grid read them from disk.
+
+Thomas Dickson
+thomas.dickson@soton.ac.uk
+"""
+
+import os
+import numpy as np
+from functools import lru_cache
+from sail_route.cache import cache_dir, hash_key
+
+
+@lru_cache(maxsize=None)
+def land_geometry(resolution='c'):
+    """Return the land, less lakes, at the given Basemap resolution."""
+    import shapely
+    from shapely.geometry import Polygon
+    from shapely.ops import unary_union
+    from mpl_toolkits.basemap import Basemap
+    bm = Basemap(resolution=resolution)
+    land = unary_union([Polygon(p.boundary) for p in bm.landpolygons])
+    lakes = [Polygon(p.boundary) for p in bm.lakepolygons]
+    if lakes:
+        land = land.difference(unary_union(lakes))
+    shapely.prepare(land)
+    return land
+
+
+def land_mask(x, y, resolution='c', use_cache=True):
+    """Return whether each of the co-ordinates lies on land.
+
+    Matches Basemap.is_land, for which points on a coastline are not on
+    land.
+    """
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    if use_cache:
+        path = os.path.join(cache_dir('land'),
+                            hash_key(x, y, resolution) + '.npy')
+        if os.path.exists(path):
+            return np.load(path)
+    import shapely
+    mask = shapely.contains_xy(land_geometry(resolution), x, y)
+    if use_cache:
+        tmp = path + '.{0}.tmp'.format(os.getpid())
+        with open(tmp, 'wb') as f:
+            np.save(f, mask)
+        os.replace(tmp, path)
+    return mask
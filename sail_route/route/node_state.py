@@ -0,0 +1,180 @@
+"""Structured state of the nodes of a solved routing grid.
+
+The earliest time, predecessor, cumulative failure probability and the
+conditions sailed in to reach every node are held in one NumPy
+structured array of node_dtype with the shape of the grid, rather than
+parallel float matrices with infinite times for unreached nodes.
+reroute records each node in a state as it is solved and takes a
+previous state as the solution to update, so a craft on passage keeps
+only the state between forecasts. The other engines return float
+matrices, which from_solution exports to a state after the solve at
+the cost of a further pass over the grid. Each record is:
+
+    time, int64 microseconds since the epoch of the earliest arrival
+    pred, int64 flat index of the predecessor, -1 for the first rank
+    fail, float32 probability of failure on any leg up to the node
+    reachable, bool whether the node was reached, the other fields
+    being left zero, and the time the largest int64, when it is False
+    tws, twd, wd, wh, wp, float32 weather at the predecessor when the
+    leg to the node was sailed, as the fields of a WeatherField
+
+The records are packed, so a state is usable from compiled code as a
+record array and is written to and memory-mapped from disk with np.save
+and np.load as is.
+
+Thomas Dickson
+thomas.dickson@soton.ac.uk
+"""
+
+import numpy as np
+from numba import njit
+from sail_route.performance.compiled_bbn import fail_lookup
+from sail_route.performance.cost_function import haversine, dir_to_relative
+from sail_route.route.kernel import craft_args
+from sail_route.weather.weather_field import sample_node
+
+node_dtype = np.dtype([('time', '<i8'), ('pred', '<i8'), ('fail', '<f4'),
+                       ('reachable', '?'), ('tws', '<f4'), ('twd', '<f4'),
+                       ('wd', '<f4'), ('wh', '<f4'), ('wp', '<f4')])
+unreachable_time = np.iinfo(np.int64).max
+
+
+def new_state(shape):
+    """Return the state of a grid of shape with no node reached."""
+    state = np.zeros(shape, dtype=node_dtype)
+    state['time'] = unreachable_time
+    state['pred'] = -1
+    return state
+
+
+@njit(nogil=True, cache=True)
+def timestamp_us(t):
+    """Return a float timestamp as int64 microseconds.
+
+    Times are rounded to microseconds as timestamp_to_us does.
+    """
+    whole = np.floor(t) if t >= 0.0 else np.ceil(t)
+    return np.int64(whole)*1000000 + np.int64(np.round((t - whole)*1e6))
+
+
+@njit(nogil=True, cache=True)
+def us_timestamp(us):
+    """Return int64 microseconds as a float timestamp."""
+    return np.float64(us // 1000000) + (us % 1000000)/1e6
+
+
+@njit(nogil=True, cache=True)
+def _leg_failure(bearing, tws, twd, wd, wh, fail_table):
+    """Return the failure probability of a leg as leg_time evaluates it."""
+    wave_dir = dir_to_relative(bearing, wd)
+    return fail_lookup(fail_table, tws, twd, wh, wave_dir)
+
+
+@njit(nogil=True, cache=True)
+def set_node(state, i, k, t, pred, prior, bearing, src, j, fail_table):
+    """Record the arrival at node k of rank i at time t from pred.
+
+    prior is the failure probability at the predecessor and the leg is
+    sailed on bearing in the weather of column j of src.
+    """
+    node = state[i, k]
+    node.reachable = True
+    node.time = timestamp_us(t)
+    node.pred = pred
+    node.tws = src[0, j]
+    node.twd = src[1, j]
+    node.wd = src[2, j]
+    node.wh = src[3, j]
+    node.wp = src[4, j]
+    fc = _leg_failure(bearing, src[0, j], src[1, j], src[2, j], src[3, j],
+                      fail_table)
+    node.fail = 1.0 - (1.0 - prior)*(1.0 - fc)
+
+
+@njit(nogil=True, cache=True)
+def _fill_state(state, start_long, start_lat, x, y, earl_time, pindxs,
+                weather, times, t0, linear, fail_table):
+    """Fill state from the earliest times and predecessors of a solve.
+
+    Times are rounded to microseconds as timestamp_to_us does and the
+    weather is sampled as the kernel samples it.
+    """
+    n_ranks, n_width = x.shape
+    src = np.empty((weather.shape[0], 1))
+    for i in range(n_ranks):
+        for k in range(n_width):
+            t = earl_time[i, k]
+            if not t < np.inf:
+                continue
+            if i == 0:
+                dist, bearing = haversine(start_long, start_lat,
+                                          x[0, k], y[0, k])
+                p, ri, rj, td = -1, 0, k, t0
+                prior = 0.0
+            else:
+                p = pindxs[i, k]
+                ri, rj = p // n_width, p % n_width
+                dist, bearing = haversine(x[ri, rj], y[ri, rj],
+                                          x[i, k], y[i, k])
+                td = earl_time[ri, rj]
+                prior = state[ri, rj].fail
+            sample_node(weather, times, td, ri, rj, linear, src, 0)
+            set_node(state, i, k, t, p, prior, bearing, src, 0, fail_table)
+
+
+def from_solution(route, time, craft, x, y, earl_time, pindxs, weather,
+                  interp='nearest'):
+    """Return the state of a grid solved from time by an engine.
+
+    The state is exported after the solve, from the arrays it returned,
+    resampling the weather and failure model along each incoming leg.
+
+    earl_time and pindxs are the float timestamps, infinite where a node
+    was not reached, and predecessors returned by the solver, and weather
+    the WeatherField it routed over sampled in time by interp. Failure
+    probabilities are looked up as the compiled kernel does, from the
+    failure model of craft_args.
+    """
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    state = new_state(x.shape)
+    fail_table = craft_args(craft)[3]
+    _fill_state(state, route.start.long, route.start.lat, x, y,
+                np.asarray(earl_time, dtype=np.float64),
+                np.asarray(pindxs, dtype=np.int64), weather.data,
+                weather.times, time.timestamp(), interp == 'linear',
+                fail_table)
+    return state
+
+
+def arrival_times(state):
+    """Return the float timestamps of a state, infinite if unreached."""
+    us = state['time']
+    times = (us // 10**6).astype(np.float64) + (us % 10**6)/1e6
+    times[~state['reachable']] = np.inf
+    return times
+
+
+def to_solution(state):
+    """Return the earliest times and predecessors of a state.
+
+    The inverse of from_solution, converting an exported state back to
+    the arrays taken by reroute with times rounded to the microsecond.
+    """
+    return arrival_times(state), np.array(state['pred'], dtype=np.int64)
+
+
+def save_state(path, state):
+    """Write a state to path in the .npy format."""
+    np.save(path, np.asarray(state, dtype=node_dtype))
+
+
+def load_state(path, mmap_mode='r'):
+    """Return the state written to path.
+
+    The file is memory-mapped with mmap_mode, or read if it is None.
+    """
+    state = np.load(path, mmap_mode=mmap_mode)
+    if state.dtype != node_dtype:
+        raise ValueError("{0} does not hold a node state".format(path))
+    return state
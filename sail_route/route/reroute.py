@@ -0,0 +1,345 @@
+"""Incremental re-routing as the forecast is updated.
+
+A craft on passage is rerouted from its current position whenever a
+new forecast arrives. Rather than relaxing the whole grid again, the
+previous earliest times and predecessors are updated rank by rank. A
+node keeps its previous earliest time while the node it was reached
+from is unchanged, as only predecessors which now depart with different
+weather or earlier than before can beat it. Other nodes are recomputed,
+starting from the edge from their previous predecessor. In both cases
+edges which could not beat the best arrival so far even sailing the
+great circle at the craft's maximum speed are not costed. The solution
+may be held as a node state, which is filled as each node is solved.
+
+Thomas Dickson
+thomas.dickson@soton.ac.uk
+"""
+
+import numpy as np
+from datetime import datetime
+from numba import njit
+from sail_route.performance.cost_function import edge_time, leg_time, \
+    haversine
+from sail_route.route.kernel import craft_args, full_edges
+from sail_route.route.geometry import no_geometry
+from sail_route.route.solve_route import path_nodes
+from sail_route.route.node_state import node_dtype, new_state, to_solution, \
+    set_node, timestamp_us, us_timestamp
+from sail_route.weather.weather_field import nearest_time, time_weight, \
+    sample_node
+
+
+@njit(nogil=True, cache=True)
+def _changed_at(times, t, linear, changed):
+    """Return whether the weather sampled at time t has changed."""
+    if not linear:
+        return changed[nearest_time(times, t)]
+    k, w = time_weight(times, t)
+    k1 = min(k + 1, times.shape[0] - 1)
+    return changed[k] or (w > 0.0 and changed[k1])
+
+
+@njit(nogil=True, cache=True)
+def _classify(t_old, t_new, times, linear, changed, rounded):
+    """Return whether a node's value changed and whether it is altered.
+
+    A node is altered when it departs with different weather or earlier
+    than it did, so that edges from it may arrive earlier than before.
+    Weather interpolated in time differs at any later time. If rounded
+    t_old is held to the microsecond, as in a node state, and t_new is
+    compared at that resolution.
+    """
+    if rounded and t_new < np.inf:
+        t_new = us_timestamp(timestamp_us(t_new))
+    if t_new == t_old:
+        if t_new < np.inf:
+            return False, _changed_at(times, t_new, linear, changed)
+        return False, False
+    if t_new == np.inf:
+        return True, False
+    if t_new < t_old or linear:
+        return True, True
+    k_new = nearest_time(times, t_new)
+    return True, changed[k_new] or k_new != nearest_time(times, t_old)
+
+
+@njit(nogil=True, cache=True)
+def _cost(x, y, i, j, k, e, src, legs, known, table, table_params, unc,
+          fail_table, apf):
+    """Return the hours to sail edge e from node j of rank i to node k."""
+    if known:
+        return leg_time(legs[0, e], legs[1, e], src[0, j], src[1, j],
+                        src[2, j], src[3, j], src[4, j], table, table_params,
+                        unc, fail_table, apf)
+    return edge_time(x[i, j], y[i, j], x[i+1, k], y[i+1, k], src[0, j],
+                     src[1, j], src[2, j], src[3, j], src[4, j], table,
+                     table_params, unc, fail_table, apf)
+
+
+@njit(nogil=True, cache=True)
+def _reroute(start_long, start_lat, finish_long, finish_lat,
+             x, y, land, weather, times, linear, changed, r0, c0, t_now,
+             old_time, old_pindxs, rounded, state, table, table_params, unc,
+             fail_table, apf, v_max, indptr, indices, legs, start_legs,
+             finish_legs):
+    """Update the earliest arrival times for a new root and weather.
+
+    The craft is at node c0 of rank r0 at t_now, or departs the start
+    at t_now if r0 is -1. The weather is sampled at the nearest time or,
+    if linear, interpolated in time. changed marks the weather times
+    which differ from those old_time and old_pindxs were computed with,
+    rounded is set if old_time is held to the microsecond and v_max
+    bounds the craft's speed in knots. Unless state is empty each node
+    is recorded in it as it is solved. The remaining arguments are as
+    for the kernel. Returns the journey time, earliest times,
+    predecessors, final node, which nodes were recomputed and the number
+    of edges costed.
+    """
+    n_ranks, n_width = x.shape
+    n_fields = weather.shape[0]
+    dense = indptr.shape[0] == 0
+    known = legs.shape[1] > 0
+    fill = state.shape[0] > 0
+    scale = 0.0
+    if v_max > 0.0:
+        scale = 3600.0*(1.0 - 1e-9)/v_max
+    earl_time = np.full((n_ranks, n_width), np.inf)
+    pindxs = np.full((n_ranks, n_width), -1, dtype=np.int64)
+    recomputed = np.zeros((n_ranks, n_width), dtype=np.bool_)
+    n_costed = 0
+    moved = np.zeros(n_width, dtype=np.bool_)
+    altered = np.zeros(n_width, dtype=np.bool_)
+    src = np.empty((n_fields, n_width))
+    if r0 < 0:
+        r0 = 0
+        for k in range(n_width):
+            recomputed[0, k] = True
+            if land[0, k]:
+                continue
+            sample_node(weather, times, t_now, 0, k, linear, src, k)
+            if known:
+                hours = leg_time(start_legs[0, k], start_legs[1, k],
+                                 src[0, k], src[1, k], src[2, k], src[3, k],
+                                 src[4, k], table, table_params, unc,
+                                 fail_table, apf)
+            else:
+                hours = edge_time(start_long, start_lat, x[0, k], y[0, k],
+                                  src[0, k], src[1, k], src[2, k], src[3, k],
+                                  src[4, k], table, table_params, unc,
+                                  fail_table, apf)
+            n_costed += 1
+            if hours < np.inf:
+                earl_time[0, k] = t_now + hours*3600.0
+                if fill:
+                    if known:
+                        bearing = start_legs[1, k]
+                    else:
+                        bearing = haversine(start_long, start_lat,
+                                            x[0, k], y[0, k])[1]
+                    set_node(state, 0, k, earl_time[0, k], -1, 0.0, bearing,
+                             src, k, fail_table)
+    else:
+        earl_time[r0, c0] = t_now
+        recomputed[r0] = True
+        if fill:
+            state[r0, c0].reachable = True
+            state[r0, c0].time = timestamp_us(t_now)
+    for j in range(n_width):
+        moved[j], altered[j] = _classify(old_time[r0, j], earl_time[r0, j],
+                                         times, linear, changed, rounded)
+    for i in range(r0, n_ranks-1):
+        for j in range(n_width):
+            if earl_time[i, j] < np.inf:
+                sample_node(weather, times, earl_time[i, j], i, j, linear,
+                            src, j)
+        for k in range(n_width):
+            if land[i+1, k]:
+                continue
+            if dense:
+                lo = (i*n_width + k)*n_width
+                hi = lo + n_width
+            else:
+                lo = indptr[i*n_width + k]
+                hi = indptr[i*n_width + k + 1]
+            p = old_pindxs[i+1, k]
+            seed = -1
+            seed_e = -1
+            if p >= 0:
+                seed = p % n_width
+                if dense:
+                    seed_e = lo + seed
+                else:
+                    seed_e = lo + np.searchsorted(indices[lo:hi], seed)
+            keep = seed >= 0 and not moved[seed] and not altered[seed]
+            best = np.inf
+            best_j = -1
+            best_e = -1
+            if keep:
+                best = old_time[i+1, k]
+                best_j = seed
+                best_e = seed_e
+            else:
+                recomputed[i+1, k] = True
+                if seed >= 0 and earl_time[i, seed] < np.inf:
+                    hours = _cost(x, y, i, seed, k, seed_e, src, legs,
+                                  known, table, table_params, unc,
+                                  fail_table, apf)
+                    n_costed += 1
+                    if hours < np.inf:
+                        best = earl_time[i, seed] + hours*3600.0
+                        best_j = seed
+                        best_e = seed_e
+            for e in range(lo, hi):
+                j = e - lo if dense else indices[e]
+                if earl_time[i, j] == np.inf or j == seed:
+                    continue
+                if keep and not altered[j]:
+                    continue
+                if known:
+                    dist = legs[0, e]
+                else:
+                    dist = haversine(x[i, j], y[i, j],
+                                     x[i+1, k], y[i+1, k])[0]
+                if earl_time[i, j] + dist*scale > best:
+                    continue
+                recomputed[i+1, k] = True
+                hours = _cost(x, y, i, j, k, e, src, legs, known, table,
+                              table_params, unc, fail_table, apf)
+                n_costed += 1
+                if hours < np.inf:
+                    jt = earl_time[i, j] + hours*3600.0
+                    if jt < best or (jt == best and j < best_j):
+                        best = jt
+                        best_j = j
+                        best_e = e
+            if best_j >= 0:
+                earl_time[i+1, k] = best
+                pindxs[i+1, k] = i*n_width + best_j
+                if fill:
+                    if known:
+                        bearing = legs[1, best_e]
+                    else:
+                        bearing = haversine(x[i, best_j], y[i, best_j],
+                                            x[i+1, k], y[i+1, k])[1]
+                    set_node(state, i+1, k, best, i*n_width + best_j,
+                             state[i, best_j].fail, bearing, src, best_j,
+                             fail_table)
+        for k in range(n_width):
+            moved[k], altered[k] = _classify(old_time[i+1, k],
+                                             earl_time[i+1, k], times,
+                                             linear, changed, rounded)
+    i = n_ranks - 1
+    journey_time = 1e10
+    end_node = 0
+    for j in range(n_width):
+        t = earl_time[i, j]
+        if t == np.inf:
+            continue
+        sample_node(weather, times, t, i, j, linear, src, j)
+        if known:
+            hours = leg_time(finish_legs[0, j], finish_legs[1, j],
+                             src[0, j], src[1, j], src[2, j], src[3, j],
+                             src[4, j], table, table_params, unc,
+                             fail_table, apf)
+        else:
+            hours = edge_time(x[i, j], y[i, j], finish_long, finish_lat,
+                              src[0, j], src[1, j], src[2, j], src[3, j],
+                              src[4, j], table, table_params, unc,
+                              fail_table, apf)
+        n_costed += 1
+        if hours < np.inf and t + hours*3600.0 < journey_time:
+            journey_time = t + hours*3600.0
+            end_node = i*n_width + j
+    return journey_time, earl_time, pindxs, end_node, recomputed, n_costed
+
+
+def nearest_node(x, y, position):
+    """Return the rank and width index of the node nearest a Location."""
+    d = (x - position.long)**2 + (y - position.lat)**2
+    return np.unravel_index(np.argmin(d), x.shape)
+
+
+def reroute(route, time, craft, x, y, land, weather, earl_time=None,
+            pindxs=None, window=None, position=None, geometry=None,
+            stats=None, times=None, interp='nearest', state=False):
+    """Update a routing solution for the craft's position and a forecast.
+
+    The craft is at the Location position at the datetime time, and is
+    placed at the nearest node of the grid x, y, or departs route.start
+    if position is None. earl_time and pindxs are the previous solution
+    returned by reroute, and weather the updated WeatherField, whose
+    weather only differs from that of the previous solution between the
+    datetimes of window. times are those of the WeatherField the previous
+    solution was computed with, which must match weather.times. Without
+    a previous solution every node is computed. interp is 'nearest' or
+    'linear' as for min_time_calculate, and must be that of the previous
+    solution; weather is only interpolated in time here. Returns the
+    journey time, the earliest times and predecessors, and the route
+    co-ordinates from the finish back to the craft as for
+    min_time_calculate. If stats is a dict the numbers of nodes
+    recomputed and edges costed are stored in it.
+    With state the node state of node_state is filled as the grid is
+    solved and returned in place of the earliest times and predecessors,
+    failure probabilities accruing from the craft's position. A previous
+    solution may also be passed as a state in place of earl_time, with
+    pindxs None.
+    """
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    land = np.asarray(land, dtype=np.bool_)
+    if interp not in ('nearest', 'linear'):
+        raise ValueError("Unknown weather interpolation: {0}".format(interp))
+    rounded = getattr(earl_time, 'dtype', None) == node_dtype
+    if earl_time is None:
+        earl_time = np.full(x.shape, np.inf)
+        pindxs = np.full(x.shape, -1, dtype=np.int64)
+    elif times is None or not np.array_equal(times, weather.times):
+        raise ValueError("The forecast times differ from those of the "
+                         "previous solution")
+    elif rounded:
+        earl_time, pindxs = to_solution(earl_time)
+    changed = np.zeros(weather.times.shape, dtype=np.bool_)
+    if window is not None:
+        w0, w1 = [w.timestamp() if isinstance(w, datetime) else w
+                  for w in window]
+        changed = (weather.times >= w0) & (weather.times <= w1)
+    if position is None:
+        r0, c0 = -1, 0
+    else:
+        r0, c0 = nearest_node(x, y, position)
+    edges = route.edges(x, y)
+    if edges is None:
+        csr = full_edges()
+    else:
+        csr = (edges.indptr, edges.indices)
+    if geometry is None:
+        legs = no_geometry()
+    else:
+        geometry.check(route, x, y)
+        legs = geometry.kernel_args()
+    if state:
+        state = new_state(x.shape)
+    else:
+        state = np.zeros((0, 0), dtype=node_dtype)
+    journey_time, earl_time, pindxs, end_node, recomputed, n_costed = \
+        _reroute(
+            route.start.long, route.start.lat,
+            route.finish.long, route.finish.lat, x, y, land, weather.data,
+            weather.times, interp == 'linear', changed, r0, c0,
+            time.timestamp(),
+            np.asarray(earl_time, dtype=np.float64),
+            np.asarray(pindxs, dtype=np.int64), rounded, state,
+            *craft_args(craft), craft.max_speed(np.nanmax(weather.data[0])),
+            *csr, *legs)
+    if stats is not None:
+        stats['nodes_recomputed'] = int(recomputed.sum())
+        stats['edges_costed'] = n_costed
+    i, j = np.unravel_index(path_nodes(pindxs, end_node), x.shape)
+    x_route = np.hstack(([route.finish.long], x[i, j][::-1]))
+    y_route = np.hstack(([route.finish.lat], y[i, j][::-1]))
+    if position is None:
+        x_route = np.hstack((x_route, [route.start.long]))
+        y_route = np.hstack((y_route, [route.start.lat]))
+    if state.size:
+        return journey_time, state, x_route, y_route
+    return journey_time, earl_time, pindxs, x_route, y_route
@@ -2,34 +2,103 @@
 
 Functions to assist with returning the shortest path for a given route.
 
+Nodes are identified by their flat index, rank*n_width + width, as
+generated by gen_indx, so the location of a node in the grid is found
+arithmetically rather than by searching the index matrix.
+
 Thomas Dickson
 14/05/2018
 thomas.dickson@soton.ac.uk
 """
 
 import numpy as np
-from numba import jit
+from sail_route.route.kernel import craft_args, finish_kernel
+from sail_route.route.geometry import no_geometry
+
+
+def path_nodes(pindx, end_node):
+    """Return the nodes on the path ending at end_node.
+
+    The predecessors are walked iteratively and the nodes are returned
+    from the first rank to the rank of end_node.
+    """
+    n_ranks, n_width = pindx.shape
+    nodes = np.empty(n_ranks, dtype=np.int64)
+    n = 0
+    node = end_node
+    while node != -1 and n < n_ranks:
+        nodes[n] = node
+        n += 1
+        node = pindx[node // n_width, node % n_width]
+    return nodes[:n][::-1]
 
 
-@jit(cache=True)
 def shortest_path(indx, pindx, sp):
-    """Create a list of the nodes visited on the shortest path."""
-    ix = np.argwhere(indx == sp[-1])
-    pix = pindx[ix[0][0], ix[0][1]]
-    sp.append(pix)
-    if pix == -1:
-        return np.array(sp)
-    else:
-        return shortest_path(indx, pindx, sp)
+    """Create a list of the nodes visited on the shortest path.
+
+    The path is traced back from the last node in sp and returned after
+    the nodes already in sp, terminated by -1.
+    """
+    nodes = path_nodes(pindx, sp[-1])
+    return np.concatenate((np.asarray(sp[:-1], dtype=np.int64),
+                           nodes[::-1], [-1]))
 
 
-@jit
 def get_locs(indx, sp, x_locs, y_locs):
     """Get the locations of the points on the shortest path."""
-    X = []
-    Y = []
-    for k in sp[:-1]:
-        i, j = np.where(indx == k)
-        X.append(x_locs[i, j].view())
-        Y.append(y_locs[i, j].view())
-    return np.array(X).flatten(), np.array(Y).flatten()
+    i, j = np.unravel_index(np.asarray(sp[:-1], dtype=np.int64), indx.shape)
+    return x_locs[i, j], y_locs[i, j]
+
+
+def extract_route(pindx, end_node, x_locs, y_locs, earl_time,
+                  weather=None):
+    """Return the locations, times and conditions along a path.
+
+    All are ordered from the first rank to the rank of end_node; times
+    holds the earliest time at each node, so np.diff(times) are the leg
+    times between nodes. If a WeatherField is given the conditions the
+    craft sails in when leaving each node are returned as an (n_fields,
+    n_nodes) array, otherwise conditions is None.
+    """
+    nodes = path_nodes(pindx, end_node)
+    i, j = np.unravel_index(nodes, x_locs.shape)
+    times = earl_time[i, j]
+    conditions = None
+    if weather is not None:
+        conditions = weather.sample(times, i, j)
+    return x_locs[i, j], y_locs[i, j], times, conditions
+
+
+def finish_times(route, craft, x, y, earl_time, weather,
+                 interp='nearest', geometry=None):
+    """Return the time each node of the final rank reaches the finish.
+
+    earl_time are the earliest times of a solution over the grid x, y,
+    such as those returned by reroute or to_solution, weather the
+    WeatherField it was solved over and interp and geometry as passed to
+    min_time_calculate. The least of the times is the journey time.
+    """
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    if geometry is None:
+        finish_legs = no_geometry()[2]
+    else:
+        geometry.check(route, x, y)
+        finish_legs = geometry.kernel_args()[2]
+    return finish_kernel(route.finish.long, route.finish.lat, x, y,
+                         weather.data, weather.times, interp == 'linear',
+                         *craft_args(craft), finish_legs,
+                         np.asarray(earl_time, dtype=np.float64)[-1])
+
+
+def best_paths(pindx, terminal_times, k=1):
+    """Return the nodes of the paths to the k earliest terminal nodes.
+
+    terminal_times holds the time each node of the final rank reaches
+    the finish, as returned by finish_times. Unreachable nodes are never
+    returned.
+    """
+    n_ranks, n_width = pindx.shape
+    order = np.argsort(terminal_times, kind='stable')
+    order = order[np.isfinite(np.asarray(terminal_times)[order])][:k]
+    return [path_nodes(pindx, (n_ranks - 1)*n_width + j) for j in order]
@@ -8,19 +8,22 @@ import sys
 import inspect
 import numpy as np
 import datetime
-import textwrap
 from datetime import datetime
 from datetime import timedelta
 import warnings
-
-import matplotlib # removing this causes a segmentation fault
-matplotlib.use('Agg')
-from mpl_toolkits.basemap import Basemap
-import matplotlib.pyplot as plt
-from sail_route.time_func import timefunc
+from sail_route.time_func import phase
+from sail_route.cache import hash_key
+from sail_route.weather.weather_field import gen_weather_field
 from sail_route.route.grid_locations import gen_indx
 from sail_route.route.solve_route import shortest_path, get_locs
-from sail_route.performance.cost_function import cost_function
+from sail_route.route.connectivity import gen_edges
+from sail_route.route.geometry import no_geometry
+from sail_route.route.node_state import from_solution
+from sail_route.route.kernel import min_time_kernel, \
+    min_time_kernel_parallel, kernel_threads, craft_args, goal_bound, \
+    full_edges, no_counts, new_counts, count_totals
+from sail_route.performance.cost_function import cost_function, \
+    cost_matrix
 warnings.filterwarnings("ignore")
 
 
@@ -34,25 +37,6 @@ def recompile_nb_code():
             member.recompile()
 
 
-recompile_nb_code()
-
-
-plt.rcParams['savefig.dpi'] = 400
-plt.rcParams['figure.autolayout'] = False
-plt.rcParams['figure.figsize'] = 10, 6
-plt.rcParams['axes.labelsize'] = 14
-plt.rcParams['axes.titlesize'] = 20
-plt.rcParams['font.size'] = 16
-plt.rcParams['lines.linewidth'] = 2.0
-plt.rcParams['lines.markersize'] = 8
-plt.rcParams['legend.fontsize'] = 12
-plt.rcParams['text.usetex'] = False
-plt.rcParams['font.family'] = "serif"
-plt.rcParams['font.serif'] = "cm"
-plt.rcParams['text.latex.preamble'] = """\\usepackage{subdepth},
-                                         \\usepackage{type1cm}"""
-
-
 class Location(object):
     """Location."""
 
@@ -65,20 +49,125 @@ class Location(object):
 class Route:
     """Route object."""
 
-    def __init__(self, start, finish, n_ranks, n_width, d_node, craft):
-        """Initialise route object."""
+    def __init__(self, start, finish, n_ranks, n_width, d_node, craft,
+                 max_offset=None, max_heading=None):
+        """Initialise route object.
+
+        max_offset and max_heading limit the edges between ranks as for
+        gen_edges; by default every node connects to all of the next
+        rank.
+        """
         self.start = start
         self.finish = finish
         self.n_ranks = n_ranks
         self.n_width = n_width
         self.d_node = d_node
         self.craft = craft
+        self.max_offset = max_offset
+        self.max_heading = max_heading
+        self._edges = None
+
+    def edges(self, x, y):
+        """Return the Connectivity of the grid, or None if it is full.
+
+        The edges of the last grid seen are kept for reuse across runs.
+        """
+        if self.max_offset is None and self.max_heading is None:
+            return None
+        key = hash_key(np.asarray(x, dtype=np.float64),
+                       np.asarray(y, dtype=np.float64),
+                       self.max_offset, self.max_heading)
+        if self._edges is None or self._edges[0] != key:
+            self._edges = (key, gen_edges(x, y, self.max_offset,
+                                          self.max_heading))
+        return self._edges[1]
 
 
-@timefunc
 def min_time_calculate(route, time, craft, x, y,
-                       land, tws, twd, wd, wh, wp, verb=True):
-    """Calculate the earliest arrival time across co-ordinates."""
+                       land, tws, twd, wd, wh, wp, verb=True,
+                       engine='numba', weather=None, n_threads=1,
+                       prune=False, stats=None, geometry=None,
+                       state=False, profile=None, interp='nearest'):
+    """Calculate the earliest arrival time across co-ordinates.
+
+    engine selects how the routing graph is relaxed; 'numba' runs the
+    compiled kernel, 'vector' costs each rank transition as one array
+    operation and 'scalar' visits every edge in turn and is kept as the
+    reference implementation.
+    weather is an optional WeatherField already sampled on the grid,
+    letting repeated runs skip sampling tws, twd, wd, wh and wp.
+    n_threads greater than one relaxes each rank transition across that
+    many threads with the 'numba' engine; results do not depend on it.
+    prune skips nodes of the 'numba' engine which cannot reach the finish
+    before the route found over a coarser grid, bounding their remaining
+    time by the great circle distance at the polar's maximum speed.
+    When leg times are FIFO, arriving later at a node never arriving
+    earlier at the next, the route found is unchanged, though earliest
+    times are only computed for nodes reached without passing through a
+    pruned node. Otherwise the journey time is never later than without
+    pruning but the route may differ. If stats is a dict the numbers of
+    nodes and edges skipped are stored in it.
+    geometry is an optional GridGeometry of the route over x, y, used by
+    the 'numba' engine instead of computing the legs as they are sailed.
+    With state the earliest times are exported after the solve to the
+    structured node state of node_state, which is returned in their
+    place at the cost of a further pass over the grid; reroute fills
+    the state as it solves instead.
+    profile is an optional time_func.Profile given the seconds spent
+    sampling the weather, solving and extracting the route and, for the
+    'numba' engine, counts of the nodes expanded, edges relaxed, weather,
+    polar and failure model lookups, infinite cost edges and land nodes
+    skipped.
+    interp is 'nearest', sailing each leg in the weather at the nearest
+    weather point and time, or 'linear', interpolating the weather
+    trilinearly in space and time so arrival times vary smoothly with
+    the grid. weather passed in is only interpolated in time. The
+    'scalar' engine only samples the nearest weather.
+    """
+    if interp not in ('nearest', 'linear'):
+        raise ValueError("Unknown weather interpolation: {0}".format(interp))
+    if engine == 'scalar' and interp != 'nearest':
+        raise ValueError("The 'scalar' engine only samples the nearest "
+                         "weather")
+    if weather is None and engine != 'scalar':
+        with phase(profile, 'weather'):
+            weather = gen_weather_field(x, y, tws, twd, wd, wh, wp, interp)
+    with phase(profile, 'solve'):
+        if engine == 'scalar':
+            journey_time, earl_time, pindxs, end_node = _min_time_scalar(
+                route, time, craft, x, y, land, tws, twd, wd, wh, wp)
+        elif engine == 'vector':
+            journey_time, earl_time, pindxs, end_node = _min_time_vector(
+                route, time, craft, x, y, land, weather, interp)
+        elif engine == 'numba':
+            journey_time, earl_time, pindxs, end_node = _min_time_numba(
+                route, time, craft, x, y, land, weather, n_threads, prune,
+                stats, geometry, profile, interp)
+        else:
+            raise ValueError("Unknown routing engine: {0}".format(engine))
+    with phase(profile, 'path'):
+        indxs = gen_indx(x)[0]
+        sp = shortest_path(indxs, pindxs, [end_node])
+        x_route, y_route = get_locs(indxs, sp, x, y)
+        x_route = np.hstack(([route.finish.long], x_route,
+                            [route.start.long]))
+        y_route = np.hstack(([route.finish.lat], y_route,
+                            [route.start.lat]))
+    if state:
+        with phase(profile, 'state'):
+            if weather is None:
+                weather = gen_weather_field(x, y, tws, twd, wd, wh, wp)
+            earl_time = from_solution(route, time, craft, x, y, earl_time,
+                                      pindxs, weather, interp)
+    if verb is True:
+        return journey_time, earl_time, x_route, y_route
+    else:
+        return journey_time, x_route, y_route
+
+
+def _min_time_scalar(route, time, craft, x, y, land, tws, twd, wd, wh, wp):
+    """Relax the routing graph one edge at a time."""
+    edges = route.edges(x, y)
     earl_time = np.full_like(x, np.inf)
     indxs, pindxs = gen_indx(x)
     end_node = 0
@@ -100,7 +189,7 @@ def min_time_calculate(route, time, craft, x, y,
                                     wind_speed, wind_dir,
                                     i_wd, i_wh, i_wp,
                                     craft)
-        if (travel_time == np.inf) | (land[0, i] is True):
+        if (travel_time == np.inf) or land[0, i]:
             pass
         else:
             total_time = time + travel_time
@@ -123,41 +212,42 @@ def min_time_calculate(route, time, craft, x, y,
                                 time=utime, method='nearest').data
                 lifetime = utime - time
                 for k in range(route.n_width):
-                        if land[i+1, k] is True:
-                            earl_time[i+1, k] == np.inf
-                        else:
-                            travel_time = cost_function(x[i, j],
-                                                        y[i, j],
-                                                        x[i+1, k],
-                                                        y[i+1, k],
-                                                        i_tws, i_twd,
-                                                        i_wd, i_wh, i_wp,
-                                                        craft,
-                                                        lifetime)
-                        if (travel_time == np.inf):
-                            pass
-                        else:
-                            jt = utime + travel_time
-                            if jt.timestamp() < earl_time[i+1, k]:
-                                earl_time[i+1, k] = jt.timestamp()
-                                pindxs[i+1, k] = indxs[i, j]
-            if np.isfinite(earl_time[i+1, :]) is not True:
-                pass
+                    if land[i+1, k]:
+                        continue
+                    if edges is not None and \
+                            j not in edges.predecessors(i, k):
+                        continue
+                    travel_time = cost_function(x[i, j],
+                                                y[i, j],
+                                                x[i+1, k],
+                                                y[i+1, k],
+                                                i_tws, i_twd,
+                                                i_wd, i_wh, i_wp,
+                                                craft,
+                                                lifetime)
+                    if (travel_time == np.inf):
+                        pass
+                    else:
+                        jt = utime + travel_time
+                        if jt.timestamp() < earl_time[i+1, k]:
+                            earl_time[i+1, k] = jt.timestamp()
+                            pindxs[i+1, k] = indxs[i, j]
     for i in range(route.n_width):
         if earl_time[-1, i] == np.inf:
             pass
         else:
-            time = datetime.fromtimestamp(earl_time[-1, i])
-            i_wd = wd.sel(lon_b=x[-1, j], lat_b=y[-1, j],
+            utime = datetime.fromtimestamp(earl_time[-1, i])
+            i_wd = wd.sel(lon_b=x[-1, i], lat_b=y[-1, i],
                           time=utime, method='nearest').data
-            i_wh = wh.sel(lon_b=x[-1, j], lat_b=y[-1, j],
+            i_wh = wh.sel(lon_b=x[-1, i], lat_b=y[-1, i],
                           time=utime, method='nearest').data
-            i_wp = wp.sel(lon_b=x[-1, j], lat_b=y[-1, j],
+            i_wp = wp.sel(lon_b=x[-1, i], lat_b=y[-1, i],
                           time=utime, method='nearest').data
-            i_tws = tws.sel(lon_b=x[-1, j], lat_b=y[-1, j],
+            i_tws = tws.sel(lon_b=x[-1, i], lat_b=y[-1, i],
                             time=utime, method='nearest').data
-            i_twd = twd.sel(lon_b=x[-1, j], lat_b=y[-1, j],
+            i_twd = twd.sel(lon_b=x[-1, i], lat_b=y[-1, i],
                             time=utime, method='nearest').data
+            lifetime = utime - time
             travel_time = cost_function(x[-1, i],
                                         y[-1, i],
                                         route.finish.long,
@@ -169,20 +259,162 @@ def min_time_calculate(route, time, craft, x, y,
             if travel_time == np.inf:
                 pass
             else:
-                et = datetime.fromtimestamp(earl_time[-1, i]) + travel_time
-                if datetime.fromtimestamp(journey_time) > et:
+                et = utime + travel_time
+                if journey_time > et.timestamp():
                     journey_time = et.timestamp()
                     end_node = indxs[-1, i]
-    sp = shortest_path(indxs, pindxs, [end_node])
-    x_route, y_route = get_locs(indxs, sp, x, y)
-    x_route = np.hstack(([route.finish.long], x_route,
-                        [route.start.long]))
-    y_route = np.hstack(([route.finish.lat], y_route,
-                        [route.start.lat]))
-    if verb is True:
-        return journey_time, earl_time, x_route, y_route
+    return journey_time, earl_time, pindxs, end_node
+
+
+def _min_time_numba(route, time, craft, x, y, land, weather, n_threads=1,
+                    prune=False, stats=None, geometry=None, profile=None,
+                    interp='nearest'):
+    """Relax the routing graph with the compiled kernel.
+
+    With prune the optimum over eight nodes spread across each rank is
+    taken as the incumbent and nodes which cannot beat it are not
+    expanded. Should the pruned solve finish after the incumbent, whose
+    route it may have pruned, the grid is solved again without pruning,
+    so with FIFO leg times the exhaustive optimum is returned. profile
+    counts the work of the solve returned, not that of the coarse solve
+    or of a pruned solve which was repeated, and counts the repeats as
+    'resolves'.
+    """
+    if n_threads > 1:
+        kernel = min_time_kernel_parallel
     else:
-        return journey_time, x_route, y_route
+        kernel = min_time_kernel
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    land = np.asarray(land, dtype=np.bool_)
+    args = (route.start.long, route.start.lat,
+            route.finish.long, route.finish.lat, x, y, land,
+            weather.data, weather.times, time.timestamp(),
+            interp == 'linear') + craft_args(craft)
+    counts = no_counts() if profile is None else new_counts(x)
+    edges = route.edges(x, y)
+    if edges is None:
+        csr = full_edges()
+        n_legs = (x.shape[0] - 1)*x.shape[1]**2
+    else:
+        csr = (edges.indptr, edges.indices)
+        n_legs = edges.n_edges
+    if geometry is None:
+        legs = no_geometry()
+    else:
+        geometry.check(route, x, y)
+        if geometry.legs.shape[1] != n_legs:
+            raise ValueError("Geometry has {0} legs but the route has {1} "
+                             "edges".format(geometry.legs.shape[1], n_legs))
+        legs = geometry.kernel_args()
+    if prune:
+        v_max = craft.max_speed(np.nanmax(weather.data[0]))
+        bound = goal_bound(x, y, route.finish.long, route.finish.lat, v_max)
+        cols = np.arange(0, x.shape[1], max(1, x.shape[1] // 8))
+        coarse = [np.ascontiguousarray(a[..., cols])
+                  for a in (x, y, land, weather.data, bound)]
+        if edges is None:
+            coarse_csr = csr
+        else:
+            coarse_edges = edges.subset(cols)
+            coarse_csr = (coarse_edges.indptr, coarse_edges.indices)
+        incumbent = min_time_kernel(*args[:4], *coarse[:4], *args[8:],
+                                    coarse[4], np.inf, *coarse_csr,
+                                    *no_geometry(), no_counts())[0]
+    else:
+        bound = np.zeros(x.shape)
+        incumbent = np.inf
+    with kernel_threads(n_threads):
+        journey_time, earl_time, pindxs, end_node, pruned = kernel(
+            *args, bound, incumbent, *csr, *legs, counts)
+        resolved = journey_time > incumbent
+        if resolved:
+            # Arriving later at a node can lead to an earlier finish as
+            # the weather changes, so the incumbent may beat the
+            # exhaustive optimum and have pruned its route.
+            counts[...] = 0
+            journey_time, earl_time, pindxs, end_node, pruned = kernel(
+                *args, bound, np.inf, *csr, *legs, counts)
+    if prune:
+        if edges is None:
+            degree = (~land[1:]).sum(axis=1)[:, None]
+        else:
+            degree = edges.out_degree(land)
+        pruning = {'incumbent': incumbent,
+                   'nodes_pruned': int(pruned.sum()),
+                   'edges_pruned': int((pruned[:-1]*degree).sum() +
+                                       pruned[-1].sum())}
+        if stats is not None:
+            stats.update(pruning)
+        if profile is not None:
+            profile.count('nodes_pruned', pruning['nodes_pruned'])
+            profile.count('edges_pruned', pruning['edges_pruned'])
+            profile.count('resolves', int(resolved))
+    if profile is not None:
+        profile.update(count_totals(counts, craft.apf))
+    return journey_time, earl_time, pindxs, end_node
+
+
+def _min_time_vector(route, time, craft, x, y, land, weather,
+                     interp='nearest'):
+    """Relax the routing graph one rank transition at a time.
+
+    The edges between two ranks are costed as a single (n_width x
+    n_width) array, arrival times are held as integer microseconds so
+    they round exactly as the datetime arithmetic of the scalar engine
+    and the earliest arrival at each node is found by a min-reduction.
+    """
+    edges = route.edges(x, y)
+    earl_time = np.full_like(x, np.inf)
+    indxs, pindxs = gen_indx(x)
+    nodes = np.arange(route.n_width)
+    end_node = 0
+    journey_time = 10**10
+    start_us = datetime_to_us(time)
+    w = weather.sample(start_us/1e6, 0, nodes, interp)
+    hours = cost_matrix(route.start.long, route.start.lat, x[0], y[0],
+                        *w, craft)
+    reach = np.isfinite(hours) & ~land[0].astype(bool)
+    earl_time[0, reach] = us_to_timestamp(
+        start_us + hours_to_us(hours[reach]))
+    for i in range(route.n_ranks-1):
+        j = np.flatnonzero(np.isfinite(earl_time[i]))
+        if j.size == 0:
+            continue
+        utime_us = timestamp_to_us(earl_time[i, j])
+        w = weather.sample(utime_us/1e6, i, j, interp)
+        hours = cost_matrix(x[i, j][:, None], y[i, j][:, None],
+                            x[i+1][None, :], y[i+1][None, :],
+                            *w[:, :, None], craft)
+        hours[:, land[i+1].astype(bool)] = np.inf
+        if edges is not None:
+            hours[~edges.mask(i)[j]] = np.inf
+        jt = np.full(hours.shape, np.inf)
+        valid = np.isfinite(hours)
+        jt[valid] = us_to_timestamp(
+            np.broadcast_to(utime_us[:, None], hours.shape)[valid] +
+            hours_to_us(hours[valid]))
+        best = np.argmin(jt, axis=0)
+        best_time = jt[best, np.arange(route.n_width)]
+        better = best_time < earl_time[i+1]
+        earl_time[i+1, better] = best_time[better]
+        pindxs[i+1, better] = indxs[i, j[best[better]]]
+    j = np.flatnonzero(np.isfinite(earl_time[-1]))
+    if j.size > 0:
+        utime_us = timestamp_to_us(earl_time[-1, j])
+        w = weather.sample(utime_us/1e6, route.n_ranks-1, j, interp)
+        hours = cost_matrix(x[-1, j], y[-1, j], route.finish.long,
+                            route.finish.lat, *w, craft)
+        valid = np.isfinite(hours)
+        if valid.any():
+            et = np.full(hours.shape, np.inf)
+            et[valid] = us_to_timestamp(utime_us[valid] +
+                                        hours_to_us(hours[valid]))
+            best = np.argmin(et)
+            if journey_time > et[best]:
+                journey_time = et[best]
+                end_node = indxs[-1, j[best]]
+    return journey_time, earl_time, pindxs, end_node
 
 
 def min_vals(x, y, et):
@@ -215,112 +447,42 @@ def timestamp_to_delta_time(start, x):
     return round_timedelta(delta, timedelta(minutes=1))
 
 
-def plot_mt_route(start, route, x, y, x_r, y_r, et, jt, fill, fname):
-    """Plot minimum time output from routing simulations."""
-    vt = datetime.fromtimestamp(jt) - start
-    # ul = jt + vt.total_seconds()/6
-    add_param = fill
-    res = 'i'
-    plt.figure(figsize=(6, 10))
-    map = Basemap(projection='merc',
-                  ellps='WGS84',
-                  lat_0=(y.min() + y.max())/2,
-                  lon_0=(x.min() + x.max())/2,
-                  llcrnrlon=x.min()-add_param,
-                  llcrnrlat=y.min()-add_param,
-                  urcrnrlon=x.max()+add_param,
-                  urcrnrlat=y.max()+add_param,
-                  resolution=res)  # f = fine resolution
-    map.drawcoastlines()
-    r_s_x, r_s_y = map(route.start.long, route.start.lat)
-    map.scatter(r_s_x, r_s_y, color='red', s=50, label='Start')
-    r_f_x, r_f_y = map(route.finish.long, route.finish.lat)
-    parallels = np.arange(-90.0, 90.0, 20.)
-    map.drawparallels(parallels, labels=[1, 0, 0, 0])
-    meridians = np.arange(180., 360., 20.)
-    # map.fillcontinents(color='black')
-    map.drawmeridians(meridians, labels=[0, 0, 0, 1])
-    map.scatter(r_f_x, r_f_y, color='blue', s=50, label='Finish')
-    if vt.total_seconds() < 10000000:
-        x_r, y_r = map(x_r, y_r)
-        map.plot(x_r, y_r, color='green', label='Minimum time path')
-        x, y = map(x, y)
-        ctf = map.contourf(x, y, et, cmap='bwr')
-        y_tick_labs = [timestamp_to_delta_time(start, x) for x in
-                       np.linspace(et[et < 1e307].min(),
-                                   et[et < 1e307].max(), 9)]
-        # y_tick_labs = [timestamp_to_delta_time(start, x) for x in
-        #                np.linspace(et.min(),
-        #                            et.max(), 9)]
-        cbar = plt.colorbar(ctf, orientation='horizontal')
-        cbar.ax.set_xticklabels(y_tick_labs, rotation=25)
-        tit = "\n".join(textwrap.wrap("Journey time: " + str(vt), 80))
-        plt.title(tit)
-    else:
-        plt.title("Voyage failed")
-        try:
-            map.scatter(x[et == np.inf], y[et == np.inf], color='red',
-                        s=1, label='No go')
-        except ValueError:
-            pass
-    # start1_lon = -16.0
-    # start1_lat = 51.0
-    # start2_lon = -8.0
-    # start2_lat = 45.0
-    # fin_lon = -60.0
-    # fin1_lat = 25.0
-    # fin2_lat = 10.0
-    #
-    # s1lon, s1lat = map(start1_lon, start1_lat)
-    # s2lon, s2lat = map(start2_lon, start2_lat)
-    # f1lon, f1lat = map(fin_lon, fin1_lat)
-    # f2lon, f2lat = map(fin_lon, fin2_lat)
-    # plt.plot([s1lon, s2lon], [s1lat, s2lat], label="Start line")
-    # plt.plot([f1lon, f2lon], [f1lat, f2lat], label="Finish line")
-    plt.legend(loc='lower right', fancybox=True, framealpha=0.5)
-    # plt.tight_layout()
-    plt.savefig(fname+"min_time"+".png")
-    plt.clf()
-
-
-def plot_isochrones(start, route, x, y, et, fill, fname):
-    """Plot isochrones for shortest path."""
-    plt.figure(figsize=(6, 10))
-    map = Basemap(projection='merc',
-                  ellps='WGS84',
-                  lat_0=(y.min() + y.max())/2,
-                  lon_0=(x.min() + x.max())/2,
-                  llcrnrlon=x.min()-fill,
-                  llcrnrlat=y.min()-fill,
-                  urcrnrlon=x.max()+fill,
-                  urcrnrlat=y.max()+fill,
-                  resolution='i')  # f = fine resolution
-    map.drawcoastlines()
-    start1_lon = -16.0
-    start1_lat = 51.0
-    start2_lon = -8.0
-    start2_lat = 45.0
-    fin_lon = -60.0
-    fin1_lat = 25.0
-    fin2_lat = 10.0
-
-    s1lon, s1lat = map(start1_lon, start1_lat)
-    s2lon, s2lat = map(start2_lon, start2_lat)
-    f1lon, f1lat = map(fin_lon, fin1_lat)
-    f2lon, f2lat = map(fin_lon, fin2_lat)
-    plt.plot([s1lon, s2lon], [s1lat, s2lat], label="Start line")
-    plt.plot([f1lon, f2lon], [f1lat, f2lat], label="Finish line")
-    x, y = map(x, y)
-    try:
-        ctf = map.contourf(x, y, et, cmap='bwr')
-        y_tick_labs = [timestamp_to_delta_time(start, x) for x in
-                       np.linspace(et[et < 10000000].min(),
-                                   et[et < 10000000].max(), 9)]
-        cbar = plt.colorbar(ctf, orientation='horizontal')
-        cbar.ax.set_xticklabels(y_tick_labs, rotation=25)
-    except ValueError:
-        pass
-    map.scatter(x[et > 9000000], y[et > 9000000], color='red',
-                s=1, label='No go')
-    map.fillcontinents(color='black')
-    plt.savefig(fname+"isochrones"+".png")
+def datetime_to_us(t):
+    """Return the timestamp of a naive datetime in integer microseconds."""
+    return int(t.timestamp())*10**6 + t.microsecond
+
+
+def timestamp_to_us(ts):
+    """Convert float timestamps to microseconds as datetime.fromtimestamp."""
+    frac, whole = np.modf(np.asarray(ts, dtype=np.float64))
+    return whole.astype(np.int64)*10**6 + \
+        np.round(frac*1e6).astype(np.int64)
+
+
+def us_to_timestamp(us):
+    """Convert microseconds to float timestamps as datetime.timestamp."""
+    us = np.asarray(us, dtype=np.int64)
+    return (us // 10**6).astype(np.float64) + (us % 10**6)/1e6
+
+
+def hours_to_us(hours):
+    """Convert hours to microseconds, rounding as timedelta(hours=...)."""
+    frac, whole = np.modf(np.asarray(hours, dtype=np.float64))
+    frac, part = np.modf(frac*3.6e9)
+    us = whole.astype(np.int64)*3600*10**6 + part.astype(np.int64)
+    up = np.floor(frac + 0.5)
+    tie = frac == 0.5
+    up[tie] = us[tie] % 2
+    return us + up.astype(np.int64)
+
+
+def __getattr__(name):
+    """Import the route plots from plotting.plot_route when first used.
+
+    Plotting needs matplotlib and Basemap, which routing does not.
+    """
+    if name in ('plot_mt_route', 'plot_isochrones'):
+        from sail_route.plotting import plot_route
+        return getattr(plot_route, name)
+    raise AttributeError("module {0!r} has no attribute {1!r}".format(
+        __name__, name))
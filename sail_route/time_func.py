@@ -1,7 +1,11 @@
 """Functions to assist the timing and profiling of functions."""
 
+import sys
+import json
 import time
 import cProfile
+import resource
+from contextlib import contextmanager, nullcontext
 
 
 def timefunc(f):
@@ -38,6 +42,71 @@ class timewith():
         pass
 
 
+class Profile():
+    """Named timers and counters of one run, exported as a single record.
+
+    Solvers accept a Profile, or None to skip instrumenting entirely,
+    and add the seconds spent in each phase and the counts of the work
+    done to it. meta is stored with the record to identify the run.
+    """
+
+    def __init__(self, name='', **meta):
+        self.name = name
+        self.meta = meta
+        self.timers = {}
+        self.counters = {}
+
+    @contextmanager
+    def timer(self, name):
+        """Return a context timing the phase name."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.timers[name] = self.timers.get(name, 0.0) + \
+                time.perf_counter() - start
+
+    def count(self, name, n=1):
+        """Add n to the counter name."""
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    def update(self, counts):
+        """Add a dict of counts to the counters."""
+        for name, n in counts.items():
+            self.count(name, n)
+
+    def record(self):
+        """Return the profile as a dict."""
+        return dict(self.meta, name=self.name, timers=dict(self.timers),
+                    counters=dict(self.counters))
+
+    def to_json(self):
+        """Return the profile as a line of JSON."""
+        return json.dumps(self.record(), default=str)
+
+    def write(self, f):
+        """Append the profile as a line of JSON to the open file f."""
+        f.write(self.to_json() + '\n')
+
+
+_no_phase = nullcontext()
+
+
+def phase(profile, name):
+    """Return a context timing the phase name of profile, if not None."""
+    if profile is None:
+        return _no_phase
+    return profile.timer(name)
+
+
+def peak_rss():
+    """Return the peak resident set size of the process in MB."""
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+        return rss/2.0**20
+    return rss/2.0**10
+
+
 def do_cprofile(func):
     def profiled_func(*args, **kwargs):
         profile = cProfile.Profile()
@@ -8,10 +8,9 @@ thomas.dickson@soton.ac.uk
 """
 
 import os
-import sys
 import numpy as np
 import xarray as xr
-import xesmf as xe
+from sail_route.cache import cache_dir, hash_key
 
 
 def look_in_netcdf(path):
@@ -20,64 +19,208 @@ def look_in_netcdf(path):
         print(ds.keys())
 
 
-def load_dataset(path_nc, var):
-    """Load netcdf file and return a specific variable."""
-    with xr.open_dataset(path_nc) as ds:
+def load_dataset(path_nc, var, window=None, bbox=None, chunks=None,
+                 pad=2):
+    """Load netcdf file and return a specific variable.
+
+    The variable is returned lazily, so only the selected part of the
+    file is ever read. window is a (start, end) pair of datetimes and
+    bbox a (lon_min, lat_min, lon_max, lat_max) box in degrees, each
+    widened by one time step and pad cells respectively so that nearest
+    time sampling and regridding at their edges are unchanged. The
+    cells nearest the edges of bbox are always selected, so a box
+    between two cells of the file is not empty. chunks is
+    passed to xr.open_dataset to read the file with dask.
+    """
+    with xr.open_dataset(path_nc, chunks=chunks) as ds:
         ds.coords['lat'] = ('latitude', ds['latitude'].values)
         ds.coords['lon'] = ('longitude', ds['longitude'].values)
         ds.swap_dims({'longitude': 'lon', 'latitude': 'lat'})
-        return ds[var]
+        da = ds[var]
+        if window is not None:
+            times = ds.indexes['time']
+            lo = max(times.searchsorted(np.datetime64(window[0]),
+                                        side='right') - 1, 0)
+            hi = times.searchsorted(np.datetime64(window[1])) + 1
+            da = da.isel(time=slice(lo, hi))
+        if bbox is not None:
+            lon = ds['longitude'].values
+            lat = ds['latitude'].values
+            lon_min, lat_min, lon_max, lat_max = bbox
+            in_lat = (lat >= lat_min) & (lat <= lat_max)
+            in_lat[nearest_indices(lat, [lat_min, lat_max])] = True
+            da = da.isel(longitude=lon_indices(lon, lon_min, lon_max, pad),
+                         latitude=np.flatnonzero(dilate(in_lat, pad)))
+        return da
+
+
+def lon_indices(lon, lon_min, lon_max, pad):
+    """Return the indices of the longitudes from lon_min to lon_max.
+
+    The box is widened by pad cells and may cross the end of a global
+    longitude axis, in which case the indices continue across it so the
+    selected longitudes stay contiguous.
+    """
+    in_lon = (lon - lon_min) % 360.0 <= (lon_max - lon_min) % 360.0
+    in_lon[nearest_indices(lon % 360.0, np.array([lon_min, lon_max]) %
+                           360.0)] = True
+    step = np.abs(np.diff(lon)).min() if lon.size > 1 else 360.0
+    wrap = (lon.max() - lon.min() + step) >= 360.0
+    mask = dilate(in_lon, pad, wrap)
+    order = np.arange(lon.size)
+    if wrap and not mask.all():
+        order = np.roll(order, -(np.flatnonzero(~mask)[-1] + 1))
+    return order[mask[order]]
+
+
+def nearest_indices(axis, values):
+    """Return the indices of the values of axis nearest each of values.
+
+    axis may be in ascending or descending order.
+    """
+    order = np.argsort(axis)
+    axis = axis[order]
+    values = np.asarray(values)
+    right = np.clip(np.searchsorted(axis, values), 1, axis.size - 1)
+    left = np.maximum(right - 1, 0)
+    nearer = values - axis[left] <= axis[right] - values
+    return order[np.where(nearer, left, right)]
+
+
+def dilate(mask, pad, wrap=False):
+    """Widen the True runs of a 1-D mask by pad cells either side.
+
+    With wrap the mask is periodic, as longitude is over the globe.
+    """
+    out = mask.copy()
+    for shift in range(1, pad + 1):
+        if wrap:
+            out |= np.roll(mask, shift) | np.roll(mask, -shift)
+        else:
+            out[shift:] |= mask[:-shift]
+            out[:-shift] |= mask[shift:]
+    return out
+
+
+def grid_bbox(longs, lats):
+    """Return the (lon_min, lat_min, lon_max, lat_max) box of a grid."""
+    return (np.min(longs), np.min(lats), np.max(longs), np.max(lats))
 
 
-def regrid_data(ds, longs, lats):
-    """Regrid dataset to new longs and lats."""
+def regrid_data(ds, longs, lats, filename=None):
+    """Regrid dataset to new longs and lats.
+
+    filename is where the regridding weights are stored and reused from.
+    """
+    import xesmf as xe
     ds_out = xr.Dataset({'lat': (['lat_b'], lats),
                          'lon': (['lon_b'], longs), })
-    regridder = xe.Regridder(ds, ds_out, 'patch', reuse_weights=True)
+    if filename is None:
+        regridder = xe.Regridder(ds, ds_out, 'patch', reuse_weights=True)
+    else:
+        regridder = xe.Regridder(ds, ds_out, 'patch', reuse_weights=True,
+                                 filename=filename)
     ds0 = regridder(ds)
     ds0.coords['lat_b'] = ('lat_b', ds0['lat'].values)
     ds0.coords['lon_b'] = ('lon_b', ds0['lon'].values)
     return ds0
 
 
-def process_wind(path_nc, longs, lats):
+def file_key(path):
+    """Return a key identifying the contents of a file.
+
+    Hashing a whole NetCDF file costs as much as reading it, so the key
+    is formed from its size, modification time and first and last MB.
+    """
+    stat = os.stat(path)
+    with open(path, 'rb') as f:
+        head = f.read(2**20)
+        f.seek(max(stat.st_size - 2**20, 0))
+        tail = f.read(2**20)
+    return hash_key(stat.st_size, stat.st_mtime_ns, head, tail)
+
+
+def save_dataarray(path, da):
+    """Save a DataArray as a .npy of its values and .npz of its coords."""
+    np.save(path + '.npy', np.asarray(da.values))
+    coords = {}
+    for name, c in da.coords.items():
+        coords['dims_' + name] = np.array(c.dims)
+        coords['coord_' + name] = c.values
+    np.savez(path + '.npz', name=np.array(da.name or ''),
+             dims=np.array(da.dims), **coords)
+
+
+def load_dataarray(path, mmap_mode='r'):
+    """Load a DataArray saved with save_dataarray."""
+    meta = np.load(path + '.npz')
+    coords = {}
+    for key in meta.files:
+        if key.startswith('coord_'):
+            name = key[len('coord_'):]
+            dims = tuple(str(d) for d in meta['dims_' + name])
+            coords[name] = (dims, meta[key])
+    name = str(meta['name']) or None
+    return xr.DataArray(np.load(path + '.npy', mmap_mode=mmap_mode),
+                        dims=tuple(str(d) for d in meta['dims']),
+                        coords=coords, name=name)
+
+
+def load_regridded(path_nc, var, longs, lats, window=None, chunks=None):
+    """Return a variable of a NetCDF file regridded to longs and lats.
+
+    Only the times within window and the area around the grid are read,
+    as for load_dataset. The regridded variable is cached on disk keyed
+    by the file contents, variable, window and grid, and the regridding
+    weights are shared by every variable of the file regridded to the
+    same grid.
+    """
+    key = file_key(path_nc)
+    path = os.path.join(cache_dir('weather'),
+                        hash_key(key, var, longs, lats, window))
+    if os.path.exists(path + '.npz'):
+        return load_dataarray(path)
+    weights = os.path.join(cache_dir('weather', 'weights'),
+                           hash_key(key, longs, lats, 'patch', 'bbox') +
+                           '.nc')
+    ds = load_dataset(path_nc, var, window, grid_bbox(longs, lats), chunks)
+    da = regrid_data(ds, longs, lats, weights)
+    save_dataarray(path, da)
+    return load_dataarray(path)
+
+
+def process_wind(path_nc, longs, lats, window=None, chunks=None):
     """
     Return wind speed and direction data.
 
-    Data is regridded to the location of each node.
+    Data is regridded to the location of each node. Only the times
+    within window are loaded, see load_dataset.
     """
-    ds_u10 = load_dataset(path_nc, 'u10')
-    regrid_ds_u10 = regrid_data(ds_u10, longs[:, 0], lats[0, :])
-    ds_v10 = load_dataset(path_nc, 'v10')
-    regrid_ds_v10 = regrid_data(ds_v10, longs[:, 0], lats[0, :])
+    args = (longs[:, 0], lats[0, :], window, chunks)
+    regrid_ds_u10 = load_regridded(path_nc, 'u10', *args)
+    regrid_ds_v10 = load_regridded(path_nc, 'v10', *args)
     ws = 1.943844 * (regrid_ds_u10**2 + regrid_ds_v10**2)**0.5
     wind_dir = np.rad2deg(np.arctan2(regrid_ds_u10, regrid_ds_v10)) + 180.0
     return ws, wind_dir
 
 
-def process_waves(path_nc, longs, lats):
-    """Return wave data."""
-    wh = load_dataset(path_nc, 'swh')
-    wd = load_dataset(path_nc, 'mwd')
-    wp = load_dataset(path_nc, 'mwp')
-    regrid_wh = regrid_data(wh, longs[:, 0], lats[0, :])
-    regrid_wd = regrid_data(wd, longs[:, 0], lats[0, :])
-    regrid_wp = regrid_data(wp, longs[:, 0], lats[0, :])
+def process_waves(path_nc, longs, lats, window=None, chunks=None):
+    """Return wave data within window."""
+    args = (longs[:, 0], lats[0, :], window, chunks)
+    regrid_wh = load_regridded(path_nc, 'swh', *args)
+    regrid_wd = load_regridded(path_nc, 'mwd', *args)
+    regrid_wp = load_regridded(path_nc, 'mwp', *args)
     return regrid_wh, regrid_wd, regrid_wp
 
 
-def process_era5_weather(path_nc, longs, lats):
-    """Return era5 weather data."""
-    wisp = load_dataset(path_nc, 'wind')
-    widi = load_dataset(path_nc, 'dwi')
-    wh = load_dataset(path_nc, 'shts')
-    wd = load_dataset(path_nc, 'mdts')
-    wp = load_dataset(path_nc, 'mpts')
-    rg_wisp = regrid_data(wisp, longs[:, 0], lats[0, :])
-    rg_widi = regrid_data(widi, longs[:, 0], lats[0, :])
-    rg_wh = regrid_data(wh, longs[:, 0], lats[0, :])
-    rg_wd = regrid_data(wd, longs[:, 0], lats[0, :])
-    rg_wp = regrid_data(wp, longs[:, 0], lats[0, :])
+def process_era5_weather(path_nc, longs, lats, window=None, chunks=None):
+    """Return era5 weather data within window."""
+    args = (longs[:, 0], lats[0, :], window, chunks)
+    rg_wisp = load_regridded(path_nc, 'wind', *args)
+    rg_widi = load_regridded(path_nc, 'dwi', *args)
+    rg_wh = load_regridded(path_nc, 'shts', *args)
+    rg_wd = load_regridded(path_nc, 'mdts', *args)
+    rg_wp = load_regridded(path_nc, 'mpts', *args)
     return rg_wisp, rg_widi, rg_wh, rg_wd, rg_wp
 
 
@@ -98,23 +241,9 @@ def change_area_values(array, value, lon1, lat1, lon2, lat2):
 
 
 if __name__ == '__main__':
-    sys.path.append(os.path.abspath("/home/td7g11/pyroute/sail_route/route/"))
-    from grid_locations import return_co_ords
-
-    def haversine(lon1, lat1, lon2, lat2):
-        """
-        Calculate the great circle distance between two points.
-
-        Return the value in km.
-        """
-        lon1, lat1, lon2, lat2 = np.radians(np.array([lon1, lat1, lon2, lat2]))
-        dlon = lon2 - lon1
-        dlat = lat2 - lat1
-        a = np.sin((dlat)/2)**2 + np.cos(lat1) * np.cos(lat2) * \
-            np.sin((dlon)/2)**2
-        dist = 6371 * 2 * np.arcsin(np.sqrt(a)) * 0.5399565
-        bearing = np.rad2deg(np.arctan2(dlat, dlon))
-        return dist, bearing
+    from sail_route.route.grid_locations import return_co_ords
+    from sail_route.route.geodesy import haversine
+
     # start = Location(-2.3700, 50.256)
     # finish = Location(-61.777, 17.038)
     start_long = -2.37
@@ -0,0 +1,125 @@
+"""Synthetic weather for testing and benchmarking.
+
+Wind and wave fields are generated analytically in the layout that
+regrid_data produces, DataArrays of dimensions time, lat_b and lon_b,
+so they can stand in for regridded ERA5 weather anywhere it is used.
+Three systems are available:
+
+    uniform, a steady wind of constant speed and direction
+    frontal, a cold front crossing from west to east, the wind veering
+    from south westerly ahead of it to north westerly behind and
+    strongest along it
+    rotating_low, a depression drifting east with cyclonic winds
+    spiralling into its centre
+
+Waves are fully developed seas of the local wind, their height and peak
+period following Pierson and Moskowitz and their direction the wind's.
+
+Thomas Dickson
+thomas.dickson@soton.ac.uk
+"""
+
+import numpy as np
+import xarray as xr
+
+kn_to_ms = 0.514444
+g = 9.81
+
+
+def grid_axes(x, y, resolution=0.5, pad=1.0):
+    """Return longitude and latitude axes covering the grid x, y."""
+    lon = np.arange(np.floor(np.min(x) - pad), np.max(x) + pad + resolution,
+                    resolution)
+    lat = np.arange(np.floor(np.min(y) - pad), np.max(y) + pad + resolution,
+                    resolution)
+    return lon, lat
+
+
+def time_axis(t0, n_times=120, step=3):
+    """Return n_times datetime64 times step hours apart from t0."""
+    return np.datetime64(t0, 'h') + np.arange(n_times)*np.timedelta64(step,
+                                                                     'h')
+
+
+def _mesh(lon, lat, times):
+    """Return hours since the first time, lon and lat broadcast together."""
+    hours = (np.asarray(times) - np.asarray(times)[0]) / \
+        np.timedelta64(1, 'h')
+    return hours[:, None, None], np.asarray(lat)[None, :, None], \
+        np.asarray(lon)[None, None, :]
+
+
+def uniform(lon, lat, times, tws=12.0, twd=270.0):
+    """Return the wind speed and direction of a steady wind."""
+    hours, la, lo = _mesh(lon, lat, times)
+    shape = (hours.shape[0], la.shape[1], lo.shape[2])
+    return np.full(shape, float(tws)), np.full(shape, float(twd) % 360.0)
+
+
+def frontal(lon, lat, times, lon0=-60.0, speed=1.0, tilt=0.5, width=3.0,
+            tws=10.0, gust=12.0):
+    """Return the wind speed and direction of a cold front.
+
+    The front lies at lon0 plus tilt degrees per degree of latitude north
+    of the equator and moves east at speed degrees of longitude an hour.
+    width in degrees is the scale over which the wind veers and tws and
+    gust the background wind and the increase along the front.
+    """
+    hours, la, lo = _mesh(lon, lat, times)
+    d = (lo - (lon0 + tilt*la + speed*hours))/width
+    wind_speed = tws + gust*np.exp(-d**2)
+    wind_dir = (270.0 + 45.0*np.tanh(-d)) % 360.0
+    return wind_speed, wind_dir
+
+
+def rotating_low(lon, lat, times, lon0=-50.0, lat0=50.0, speed=(0.5, 0.1),
+                 radius=5.0, v_max=35.0, tws=5.0, inflow=20.0):
+    """Return the wind speed and direction of a depression.
+
+    The centre starts at lon0, lat0 and drifts speed degrees of longitude
+    and latitude an hour. The wind rises linearly to v_max knots at
+    radius degrees from the centre and falls inversely beyond it, on top
+    of a background of tws, and blows anticlockwise, north of the
+    equator, crossing the isobars inwards by inflow degrees.
+    """
+    hours, la, lo = _mesh(lon, lat, times)
+    dx = (lo - (lon0 + speed[0]*hours))*np.cos(np.radians(la))
+    dy = la - (lat0 + speed[1]*hours)
+    r = np.hypot(dx, dy)
+    wind_speed = tws + v_max*np.where(r < radius, r/radius,
+                                      radius/np.maximum(r, radius))
+    bearing = np.degrees(np.arctan2(dx, dy))
+    spin = np.where(la >= 0.0, 1.0, -1.0)
+    toward = bearing - spin*(90.0 + inflow)
+    wind_dir = (toward + 180.0) % 360.0
+    return wind_speed, wind_dir
+
+
+systems = {'uniform': uniform, 'frontal': frontal,
+           'rotating_low': rotating_low}
+
+
+def wind_waves(tws, twd):
+    """Return the direction, height and period of fully developed seas."""
+    u = np.asarray(tws)*kn_to_ms
+    wh = 0.21*u**2/g
+    wp = 2*np.pi*u/(0.877*g)
+    return np.array(twd, copy=True), wh, wp
+
+
+def synthetic_weather(kind, lon, lat, times, **params):
+    """Return the tws, twd, wd, wh and wp DataArrays of a weather system.
+
+    kind is one of systems, passed params, and lon, lat and times the
+    axes of the fields, as from grid_axes and time_axis.
+    """
+    try:
+        system = systems[kind]
+    except KeyError:
+        raise ValueError("Unknown weather system: {0}".format(kind))
+    tws, twd = system(lon, lat, times, **params)
+    wd, wh, wp = wind_waves(tws, twd)
+    coords = {'time': np.asarray(times), 'lat_b': np.asarray(lat),
+              'lon_b': np.asarray(lon)}
+    return [xr.DataArray(a, dims=('time', 'lat_b', 'lon_b'), coords=coords)
+            for a in (tws, twd, wd, wh, wp)]
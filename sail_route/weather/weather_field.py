@@ -0,0 +1,237 @@
+"""Weather sampled at the nodes of a routing grid.
+
+Selecting the nearest weather to a node from an xarray DataArray goes
+through pandas indexing on every call. The fields used for routing are
+instead sampled at every node once and held in a single array which is
+queried by integer indexing.
+
+Weather is sampled at the nodes either from the nearest point of the
+weather grid or bilinearly between the four around it, and in time
+either at the nearest time or linearly between the two either side.
+Together the linear samplings interpolate the weather trilinearly.
+Angles are interpolated around the circle, along the shortest arc in
+time and as the direction of the weighted sum of unit vectors in space,
+so a wind veering through north is not swung through south.
+
+Thomas Dickson
+thomas.dickson@soton.ac.uk
+"""
+
+import numpy as np
+from datetime import datetime
+from numba import njit
+
+
+angular = (1, 2)
+
+
+class WeatherField(object):
+    """Weather conditions at each node of a routing grid."""
+
+    fields = ('tws', 'twd', 'wd', 'wh', 'wp')
+    angular = angular
+
+    def __init__(self, data, times):
+        """Initialise weather field.
+
+        data, array of shape (n_fields, n_times, n_ranks, n_width)
+        holding the weather at each node in the order of fields
+        times, sorted array of the n_times timestamps in seconds
+
+        float32 data, such as a memory-mapped weather store, is kept
+        as it is rather than copied to float64.
+        """
+        data = np.asanyarray(data)
+        dtype = np.float32 if data.dtype == np.float32 else np.float64
+        if data.dtype != dtype or not data.flags.c_contiguous:
+            data = np.ascontiguousarray(data, dtype=dtype)
+        self.data = data
+        self.times = np.ascontiguousarray(times, dtype=np.float64)
+        if self.data.shape[1] != self.times.shape[0]:
+            raise ValueError("Weather data and time axis lengths differ")
+        if np.any(np.diff(self.times) <= 0.0):
+            raise ValueError("Weather time axis must be strictly increasing")
+
+    @property
+    def shape(self):
+        """Return the (n_ranks, n_width) shape of the grid."""
+        return self.data.shape[2:]
+
+    def time_index(self, t):
+        """Return the index of the nearest time to each timestamp.
+
+        Ties are broken towards the later time, as xarray does.
+        """
+        t = np.asarray(t, dtype=np.float64)
+        right = np.clip(np.searchsorted(self.times, t), 1,
+                        self.times.shape[0] - 1)
+        left = right - 1
+        nearer_left = (t - self.times[left]) < (self.times[right] - t)
+        idx = np.where(nearer_left, left, right)
+        if self.times.shape[0] == 1:
+            idx = np.zeros_like(idx)
+        return idx
+
+    def sample(self, t, i, j, method='nearest'):
+        """Return the weather at timestamps t and nodes (i, j).
+
+        t, i and j broadcast against each other, so a whole rank is
+        sampled with an array of times and node indices. Returns an array
+        of shape (n_fields,) + broadcast shape. method is either
+        'nearest' in time or 'linear' in time, the latter interpolating
+        angular fields along the shortest arc.
+        """
+        t, i, j = np.broadcast_arrays(np.asarray(t, dtype=np.float64),
+                                      i, j)
+        if method == 'nearest':
+            return self.data[:, self.time_index(t), i, j]
+        elif method == 'linear':
+            out = interp_weather(self.data, self.times, np.ravel(t),
+                                 np.ravel(i).astype(np.int64),
+                                 np.ravel(j).astype(np.int64))
+            return out.reshape((out.shape[0],) + t.shape)
+        else:
+            raise ValueError("Unknown sampling method: {0}".format(method))
+
+
+@njit(nogil=True, cache=True)
+def nearest_time(times, t):
+    """Return the index of the nearest of the sorted times to t.
+
+    Compiled counterpart of WeatherField.time_index for a single time.
+    """
+    n = times.shape[0]
+    right = np.searchsorted(times, t)
+    if right == 0:
+        return 0
+    elif right >= n:
+        return n - 1
+    elif t - times[right-1] < times[right] - t:
+        return right - 1
+    else:
+        return right
+
+
+@njit(nogil=True, cache=True)
+def time_weight(times, t):
+    """Return the index of the sorted times before t and its weight.
+
+    t lies between times[k] and times[k + 1] at weight w from the
+    former, times outside the axis taking the weather of its ends.
+    """
+    n = times.shape[0]
+    if n == 1 or t <= times[0]:
+        return 0, 0.0
+    elif t >= times[n-1]:
+        return n - 2, 1.0
+    k = np.searchsorted(times, t, side='right') - 1
+    return k, (t - times[k])/(times[k+1] - times[k])
+
+
+@njit(nogil=True, cache=True)
+def sample_node(weather, times, t, i, j, linear, out, n):
+    """Fill column n of out with the weather at node (i, j) at time t.
+
+    The compiled counterpart of WeatherField.sample, the weather being
+    taken at the nearest time or, if linear, interpolated in time.
+    """
+    if not linear:
+        k = nearest_time(times, t)
+        for f in range(weather.shape[0]):
+            out[f, n] = weather[f, k, i, j]
+        return
+    k, w = time_weight(times, t)
+    k1 = min(k + 1, times.shape[0] - 1)
+    for f in range(weather.shape[0]):
+        lower = weather[f, k, i, j]
+        out[f, n] = lower + w*(weather[f, k1, i, j] - lower)
+    for f in angular:
+        lower = weather[f, k, i, j]
+        delta = (weather[f, k1, i, j] - lower + 180.0) % 360.0 - 180.0
+        out[f, n] = (lower + w*delta) % 360.0
+
+
+@njit(nogil=True, cache=True)
+def interp_weather(weather, times, t, i, j):
+    """Return the weather linearly interpolated to times t at nodes i, j.
+
+    t, i and j are arrays of equal length, so every leg leaving a rank
+    is sampled in one call, and the result has shape (n_fields, len(t)).
+    """
+    out = np.empty((weather.shape[0], t.shape[0]))
+    for n in range(t.shape[0]):
+        sample_node(weather, times, t[n], i[n], j[n], True, out, n)
+    return out
+
+
+def datetime64_to_timestamp(times):
+    """Convert naive datetime64 values to timestamps in seconds.
+
+    Naive times are treated as local time, as datetime.timestamp does,
+    so they compare directly against the routing earliest times.
+    """
+    times = np.asarray(times).astype('datetime64[us]').astype(datetime)
+    return np.array([t.timestamp() for t in np.ravel(times)])
+
+
+def axis_weights(axis, v):
+    """Return the indices either side of v on axis and their weight.
+
+    v lies at weight w from the first index towards the second. axis may
+    be ascending or descending and values beyond its ends take the value
+    at the nearer end.
+    """
+    axis = np.asarray(axis, dtype=np.float64)
+    order = np.argsort(axis)
+    pos = np.interp(v, axis[order], np.arange(axis.shape[0]))
+    lo = np.clip(np.floor(pos).astype(np.int64), 0,
+                 max(axis.shape[0] - 2, 0))
+    hi = np.minimum(lo + 1, axis.shape[0] - 1)
+    return order[lo], order[hi], np.clip(pos - lo, 0.0, 1.0)
+
+
+def _bilinear(values, lat0, lat1, wy, lon0, lon1, wx, circular):
+    """Return values of shape (time, lat, lon) bilinearly interpolated.
+
+    Circular values are interpolated as unit vectors, formed over the
+    weather grid before it is gathered at the nodes.
+    """
+    if circular:
+        z = _bilinear(np.exp(1j*np.radians(values)), lat0, lat1, wy, lon0,
+                      lon1, wx, False)
+        return np.degrees(np.angle(z)) % 360.0
+    return (1 - wy)*((1 - wx)*values[:, lat0, lon0] +
+                     wx*values[:, lat0, lon1]) + \
+        wy*((1 - wx)*values[:, lat1, lon0] + wx*values[:, lat1, lon1])
+
+
+def gen_weather_field(x, y, tws, twd, wd, wh, wp, method='nearest'):
+    """Sample regridded weather DataArrays at every node of the grid.
+
+    With method 'nearest' the node to weather index mapping is found
+    once with the same nearest neighbour selection as DataArray.sel.
+    With 'linear' each node is interpolated bilinearly between the four
+    weather points around it, the angular fields around the circle. All
+    fields must share their time axis.
+    """
+    if method not in ('nearest', 'linear'):
+        raise ValueError("Unknown sampling method: {0}".format(method))
+    arrays = (tws, twd, wd, wh, wp)
+    times = arrays[0].indexes['time']
+    for a in arrays[1:]:
+        if not a.indexes['time'].equals(times):
+            raise ValueError("Weather fields must share a time axis")
+    data = np.empty((len(arrays), len(times)) + x.shape)
+    for f, a in enumerate(arrays):
+        values = a.transpose('time', 'lat_b', 'lon_b').values
+        if method == 'nearest':
+            lon_idx = a.indexes['lon_b'].get_indexer(
+                np.ravel(x), method='nearest').reshape(x.shape)
+            lat_idx = a.indexes['lat_b'].get_indexer(
+                np.ravel(y), method='nearest').reshape(y.shape)
+            data[f] = values[:, lat_idx, lon_idx]
+        else:
+            data[f] = _bilinear(values, *axis_weights(a['lat_b'].values, y),
+                                *axis_weights(a['lon_b'].values, x),
+                                f in angular)
+    return WeatherField(data, datetime64_to_timestamp(times.values))
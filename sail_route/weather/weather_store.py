@@ -0,0 +1,95 @@
+"""Binary store of the weather sampled on a routing grid.
+
+Opening a NetCDF file and sampling it on the grid dominates the start
+up of short routing jobs. The WeatherField of a grid is instead written
+once to a flat file which is memory-mapped when opened, so every process
+routing over it shares the operating system's page cache and no weather
+is copied or decoded.
+
+The file holds, all little-endian:
+
+    header, 64 bytes: magic b'SAILWX01', n_fields, n_times, n_ranks and
+    n_width as uint32 and the byte offset of the data as uint64
+    times, float64 (n_times,) timestamps in seconds
+    x, y, float64 (n_ranks, n_width) longitude and latitude of each node
+    data, float32 (n_fields, n_times, n_ranks, n_width) from the first
+    page boundary after the grid, the fields in WeatherField.fields order
+
+Thomas Dickson
+thomas.dickson@soton.ac.uk
+"""
+
+import os
+import struct
+import numpy as np
+from sail_route.weather.weather_field import WeatherField, gen_weather_field
+
+magic = b'SAILWX01'
+header = struct.Struct('<8s4IQ')
+header_size = 64
+page_size = 4096
+
+
+def write_weather_store(path, weather, x, y):
+    """Write a WeatherField over the grid x, y to path."""
+    x = np.asarray(x, dtype='<f8')
+    y = np.asarray(y, dtype='<f8')
+    n_fields, n_times, n_ranks, n_width = weather.data.shape
+    if x.shape != (n_ranks, n_width) or y.shape != x.shape:
+        raise ValueError("Grid shape {0} does not match the weather "
+                         "{1}".format(x.shape, weather.shape))
+    grid_end = header_size + 8*(n_times + 2*x.size)
+    offset = -(-grid_end // page_size)*page_size
+    tmp = path + '.{0}.tmp'.format(os.getpid())
+    with open(tmp, 'wb') as f:
+        f.write(header.pack(magic, n_fields, n_times, n_ranks, n_width,
+                            offset).ljust(header_size, b'\0'))
+        f.write(np.asarray(weather.times, dtype='<f8').tobytes())
+        f.write(x.tobytes())
+        f.write(y.tobytes())
+        f.write(b'\0'*(offset - grid_end))
+        for field in weather.data:
+            f.write(np.asarray(field, dtype='<f4').tobytes())
+    os.replace(tmp, path)
+
+
+def read_header(path):
+    """Return the shape and data offset of a weather store."""
+    with open(path, 'rb') as f:
+        head = f.read(header.size)
+    if len(head) < header.size or head[:8] != magic:
+        raise ValueError("{0} is not a weather store".format(path))
+    values = header.unpack(head)
+    return values[1:5], values[5]
+
+
+def open_weather_store(path, x=None, y=None):
+    """Return the WeatherField of a weather store.
+
+    The weather is memory-mapped read only rather than read. If the grid
+    x, y is given it is checked against the grid of the store.
+    """
+    (n_fields, n_times, n_ranks, n_width), offset = read_header(path)
+    grid = np.memmap(path, dtype='<f8', mode='r', offset=header_size,
+                     shape=(n_times + 2*n_ranks*n_width,))
+    if x is not None and y is not None:
+        n = n_ranks*n_width
+        if (np.shape(x) != (n_ranks, n_width) or
+                not np.array_equal(grid[n_times:n_times + n], np.ravel(x))
+                or not np.array_equal(grid[n_times + n:], np.ravel(y))):
+            raise ValueError("{0} was written for a different "
+                             "grid".format(path))
+    data = np.memmap(path, dtype='<f4', mode='r', offset=offset,
+                     shape=(n_fields, n_times, n_ranks, n_width))
+    return WeatherField(data, np.array(grid[:n_times]))
+
+
+def era5_to_store(path_nc, path, x, y, window=None, chunks=None):
+    """Write the ERA5 weather of path_nc over the grid x, y to path.
+
+    The weather is loaded by process_era5_weather.
+    """
+    from sail_route.weather.load_weather import process_era5_weather
+    weather = gen_weather_field(x, y, *process_era5_weather(
+        path_nc, x, y, window, chunks))
+    write_weather_store(path, weather, x, y)
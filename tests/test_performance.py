@@ -5,9 +5,10 @@ Thomas Dickson
 thomas.dickson@soton.ac.uk
 """
 from context import *
+import os
 from sail_route.performance.cost_function import haversine, dir_to_relative
 from sail_route.performance.craft_performance import polar
-# import pytest
+import pytest
 import numpy as np
 import numpy.testing as npt
 
@@ -26,6 +27,33 @@ def test_haversine():
     npt.assert_allclose(bearing, 276.33, rtol=0.01)
 
 
+def test_distance_bearing():
+    """Test the broadcast geodesy kernels against the scalar haversine."""
+    from sail_route.route.geodesy import distance_bearing, pairwise
+    rng = np.random.RandomState(0)
+    lon1, lon2 = rng.uniform(-180.0, 180.0, (2, 40))
+    lat1, lat2 = rng.uniform(-80.0, 80.0, (2, 40))
+    expected = np.array([haversine(*p) for p in zip(lon1, lat1, lon2, lat2)])
+    dist, bearing = distance_bearing(lon1, lat1, lon2, lat2)
+    npt.assert_allclose(dist, expected[:, 0], rtol=1e-12)
+    npt.assert_allclose(bearing, expected[:, 1], rtol=1e-12)
+    dist, bearing = pairwise(lon1[:5], lat1[:5], lon2, lat2)
+    assert dist.shape == (5, 40)
+    npt.assert_allclose(dist[3, 7], haversine(lon1[3], lat1[3], lon2[7],
+                                              lat2[7])[0], rtol=1e-12)
+    dist, bearing = distance_bearing(lon1, lat1, lon2, lat2, np.float32)
+    assert dist.dtype == bearing.dtype == np.float32
+    npt.assert_allclose(dist, expected[:, 0], rtol=1e-5, atol=1e-2)
+    npt.assert_allclose(dir_to_relative(bearing, expected[:, 1]), 0.0,
+                        atol=1e-2)
+    dist, bearing = distance_bearing(-88.67, 36.12, -118.40, 33.94,
+                                     method='ellipsoid')
+    npt.assert_allclose(dist, 1462.22, rtol=0.01)
+    npt.assert_allclose(bearing, 276.33, rtol=0.01)
+    with pytest.raises(ValueError):
+        distance_bearing(lon1, lat1, lon2, lat2, method='flat')
+
+
 def test_dir_to_relative():
     """Test relative angle calculation function."""
     npt.assert_almost_equal(dir_to_relative(-20, 20), 40)
@@ -44,3 +72,127 @@ def test_performance_interpolation():
                     16.0, 20.0, 25.0, 30.0, 35.0])
     first_40 = polar(twa, tws, perf[:, 1:])
     npt.assert_almost_equal(first_40.return_perf(30.0, 4.0), 2.16)
+
+
+def test_performance_table():
+    """Test the polar lookup table against interp2d of the polar.
+
+    The expected speeds were evaluated with scipy.interpolate.interp2d,
+    which has since been removed from SciPy, and are clamped to the
+    polar outside it.
+    """
+    path = os.path.join(os.path.dirname(__file__), "test_data",
+                        "first_40_farr.csv")
+    perf = np.genfromtxt(path, delimiter=";", skip_header=1)[:, 1:]
+    twa = np.array([30.0, 36.0, 42.0, 50.0, 70.0, 90.0,
+                    120.0, 130.0, 150.0, 160.0, 180.0])
+    tws = np.array([4.0, 6.0, 8.0, 10.0, 12.0, 14.0,
+                    16.0, 20.0, 25.0, 30.0, 35.0])
+    a = np.array([0.0, 30.0, 33.0, 45.5, 62.0, 90.0, 101.0, 125.0, 145.0,
+                  171.0, 180.0, 190.0])
+    s = np.array([0.0, 4.0, 5.0, 7.5, 11.0, 14.0, 18.0, 22.5, 27.0, 32.0,
+                  35.0, 40.0])
+    expected = np.array([2.16, 2.16, 3.1025, 5.95296875, 7.795, 8.71,
+                         9.495, 10.75, 12.239, 12.582, 12.87, 12.87])
+    exact = polar(twa, tws, perf)
+    npt.assert_allclose(exact.return_perf_array(a, s), expected, atol=1e-9)
+    npt.assert_allclose([exact.return_perf(a_i, s_i) for a_i, s_i
+                         in zip(a, s)], expected, atol=1e-9)
+    rng = np.random.RandomState(0)
+    a = rng.uniform(0.0, 190.0, 500)
+    s = rng.uniform(0.0, 40.0, 500)
+    fine = exact.return_perf_array(a, s)
+    npt.assert_allclose([exact.return_perf(a_i, s_i) for a_i, s_i
+                         in zip(a, s)], fine, atol=1e-9)
+    coarse = polar(twa, tws, perf, table_step=0.5, table_dtype=np.float32)
+    assert coarse.table.dtype == np.float32
+    npt.assert_allclose(coarse.return_perf_array(a, s), fine, atol=1e-3)
+
+
+def test_failure_table():
+    """Test batched failure probabilities against querying the BBN."""
+    from sail_route.performance.bbn import gen_env_model, \
+        env_bbn_interrogate, env_bbn_interrogate_array
+    bp = gen_env_model()
+    rng = np.random.RandomState(1)
+    tws = rng.uniform(0.0, 40.0, 200)
+    twa = rng.uniform(-90.0, 180.0, 200)
+    h = rng.uniform(0.0, 6.0, 200)
+    theta = rng.uniform(0.0, 180.0, 200)
+    expected = [env_bbn_interrogate(bp, *c) for c in zip(tws, twa, h, theta)]
+    npt.assert_array_equal(env_bbn_interrogate_array(bp, tws, twa, h, theta),
+                           expected)
+    craft = polar(np.arange(2.0), np.arange(2.0), np.ones((2, 2)),
+                  apf=0.5, failure=bp)
+    assert len(np.unique(craft.fail_table)) > 4
+
+
+def test_compiled_bbn(tmpdir, monkeypatch):
+    """Test compiled networks against querying them with pgmpy."""
+    from pgmpy.models import BayesianModel
+    from pgmpy.factors.discrete import TabularCPD
+    from pgmpy.inference import BeliefPropagation
+    from sail_route.performance.bbn import gen_env_model, env_bbn_table
+    from sail_route.performance.compiled_bbn import CompiledBBN, \
+        env_bbn_compile, env_evidence
+    monkeypatch.setenv('SAIL_ROUTE_CACHE', str(tmpdir))
+    bp = gen_env_model()
+    compiled = env_bbn_compile(bp)
+    npt.assert_allclose(compiled.table.ravel(), env_bbn_table(bp),
+                        rtol=0, atol=1e-15)
+    assert compiled.nbytes == 16*8
+    assert len(tmpdir.join('bbn').listdir()) == 1
+    npt.assert_array_equal(env_bbn_compile(bp).table, compiled.table)
+    model = BayesianModel([('TWS', 'Wind'), ('WH', 'Wind'),
+                           ('Wind', 'Craft failure')])
+    model.add_cpds(
+        TabularCPD('TWS', 3, values=[[0.5], [0.3], [0.2]]),
+        TabularCPD('WH', 2, values=[[0.7], [0.3]]),
+        TabularCPD('Wind', 2, values=[[1.0, 0.9, 0.8, 0.6, 0.5, 0.1],
+                                      [0.0, 0.1, 0.2, 0.4, 0.5, 0.9]],
+                   evidence=['TWS', 'WH'], evidence_card=[3, 2]),
+        TabularCPD('Craft failure', 2, values=[[0.99, 0.3], [0.01, 0.7]],
+                   evidence=['Wind'], evidence_card=[2]))
+    bp3 = BeliefPropagation(model)
+    compiled = CompiledBBN(model, 'Craft failure',
+                           [('TWS', 'tws',
+                             lambda s: int(s > 15) + int(s > 30)),
+                            env_evidence[2]])
+    tws = np.array([5.0, 20.0, 35.0, 5.0, 20.0, 35.0])
+    wh = np.array([1.0, 1.0, 1.0, 4.0, 4.0, 4.0])
+    expected = [bp3.query(variables=['Craft failure'],
+                          evidence={'TWS': int(s > 15) + int(s > 30),
+                                    'WH': int(h > 3)})
+                ['Craft failure'].values[-1] for s, h in zip(tws, wh)]
+    npt.assert_allclose(compiled.evaluate(tws, 0.0, wh, 0.0), expected,
+                        rtol=0, atol=1e-15)
+    craft = polar(np.arange(2.0), np.arange(2.0), np.ones((2, 2)),
+                  apf=0.5, failure=compiled)
+    assert craft.fail_table is None
+    from sail_route.performance.compiled_bbn import fail_lookup, \
+        env_failure_model
+    from sail_route.route.kernel import craft_args
+    with pytest.raises(ValueError):
+        craft_args(craft)
+    rng = np.random.RandomState(0)
+    tws = rng.choice([5.0, 15.0, 20.0, 30.0, 35.0, 25.0], 200)
+    wh = rng.choice([1.0, 3.0, 4.0], 200)
+    twa = rng.choice([-10.0, 0.0, 10.0], 200)
+    wd = rng.choice([10.0, 60.0, 90.0], 200)
+    stepped = CompiledBBN(model, 'Craft failure',
+                          [('TWS', 'tws', ([15.0, 30.0], [0, 1, 2])),
+                           env_evidence[2]])
+    npt.assert_array_equal(stepped.table, compiled.table)
+    model3 = stepped.kernel_model()
+    craft = polar(np.arange(2.0), np.arange(2.0), np.ones((2, 2)),
+                  apf=0.5, failure=stepped)
+    npt.assert_array_equal(craft_args(craft)[3], model3)
+    npt.assert_array_equal(
+        [fail_lookup(model3, *c) for c in zip(tws, twa, wh, wd)],
+        stepped.evaluate(tws, twa, wh, wd))
+    from sail_route.performance.bbn import env_bbn_failure
+    table = env_bbn_table(bp)
+    env_model = env_failure_model(table)
+    npt.assert_array_equal(
+        [fail_lookup(env_model, *c) for c in zip(tws, twa, wh, wd)],
+        env_bbn_failure(table, tws, twa, wh, wd))
@@ -8,7 +8,744 @@ thomas.dickson@soton.ac.uk
 """
 
 from context import *
+import os
+from datetime import datetime
 from sail_route.route.grid_locations import return_co_ords
+from sail_route.performance.craft_performance import polar
+from sail_route.sail_routing import Location, Route, min_time_calculate
 import pytest
 import numpy as np
-import numpy.testing as np
+import numpy.testing as npt
+import xarray as xr
+
+test_data = os.path.join(os.path.dirname(__file__), "test_data")
+
+
+def first_40(apf=1.0, failure=None):
+    """Return the First 40 polar used across the routing tests."""
+    perf = np.genfromtxt(os.path.join(test_data, "first_40_farr.csv"),
+                         delimiter=";", skip_header=1)
+    twa = np.array([30.0, 36.0, 42.0, 50.0, 70.0, 90.0,
+                    120.0, 130.0, 150.0, 160.0, 180.0])
+    tws = np.array([4.0, 6.0, 8.0, 10.0, 12.0, 14.0,
+                    16.0, 20.0, 25.0, 30.0, 35.0])
+    return polar(twa, tws, perf[:, 1:], 1.0, apf, failure)
+
+
+def synthetic_scenario(n=8, seed=1):
+    """Return a small routing problem over random weather."""
+    rng = np.random.RandomState(seed)
+    x = np.linspace(-10.0, -20.0, n)[:, None] + \
+        rng.uniform(-0.1, 0.1, (n, n))
+    y = np.linspace(45.0, 40.0, n)[:, None] + \
+        np.linspace(-2.0, 2.0, n)[None, :]
+    land = np.zeros((n, n), dtype=bool)
+    land[n//2, :n//3] = True
+    times = np.datetime64('2016-01-01T00') + \
+        np.arange(20)*np.timedelta64(3, 'h')
+    coords = {'time': times, 'lat_b': np.sort(y[0, :]),
+              'lon_b': np.sort(x[:, 0])}
+    shape = (times.size, n, n)
+
+    def field(low, high):
+        return xr.DataArray(rng.uniform(low, high, shape),
+                            dims=('time', 'lat_b', 'lon_b'), coords=coords)
+    weather = [field(5.0, 30.0), field(0.0, 360.0), field(0.0, 360.0),
+               field(0.0, 2.0), field(3.0, 10.0)]
+    craft = first_40()
+    route = Route(Location(-9.5, 43.0), Location(-20.5, 42.5), n, n,
+                  1000.0, craft)
+    return route, datetime(2016, 1, 1, 6), craft, x, y, land, weather
+
+
+def test_vector_engine_matches_scalar():
+    """Test the vectorised rank relaxation against the scalar reference."""
+    route, t, craft, x, y, land, weather = synthetic_scenario()
+    jt_s, et_s, x_s, y_s = min_time_calculate(route, t, craft, x, y, land,
+                                              *weather, engine='scalar')
+    jt_v, et_v, x_v, y_v = min_time_calculate(route, t, craft, x, y, land,
+                                              *weather, engine='vector')
+    assert np.isfinite(jt_s)
+    npt.assert_allclose(jt_v, jt_s, rtol=0, atol=1e-6)
+    npt.assert_array_equal(np.isfinite(et_v), np.isfinite(et_s))
+    finite = np.isfinite(et_s)
+    npt.assert_allclose(et_v[finite], et_s[finite], rtol=0, atol=1e-6)
+    npt.assert_array_equal(x_v, x_s)
+    npt.assert_array_equal(y_v, y_s)
+    assert not np.isfinite(et_v[land]).any()
+
+
+def test_weather_field_sampling():
+    """Test weather field sampling against DataArray.sel."""
+    from sail_route.weather.weather_field import gen_weather_field
+    route, t, craft, x, y, land, weather = synthetic_scenario()
+    field = gen_weather_field(x, y, *weather)
+    assert field.data.shape == (5, 20, 8, 8)
+    rng = np.random.RandomState(2)
+    ts = field.times[0] + rng.uniform(-1e4, 7e4, 50)
+    ts[:5] = field.times[3] + 1.5*3600.0
+    i = rng.randint(0, 8, 50)
+    j = rng.randint(0, 8, 50)
+    sampled = field.sample(ts, i, j)
+    for k in range(50):
+        when = datetime.fromtimestamp(ts[k])
+        expected = [f.sel(lon_b=x[i[k], j[k]], lat_b=y[i[k], j[k]],
+                          time=when, method='nearest').data
+                    for f in weather]
+        npt.assert_array_equal(sampled[:, k], expected)
+    mid = field.sample(0.5*(field.times[2] + field.times[3]), 1, 1,
+                       method='linear')
+    lower = field.data[:, 2, 1, 1]
+    upper = field.data[:, 3, 1, 1]
+    npt.assert_allclose(mid[0], 0.5*(lower[0] + upper[0]))
+    arc = (upper[1] - lower[1] + 180.0) % 360.0 - 180.0
+    npt.assert_allclose(mid[1], (lower[1] + 0.5*arc) % 360.0)
+
+
+def test_linear_interpolation():
+    """Test trilinear weather sampling and routing through it."""
+    from sail_route.route.node_state import to_solution
+    from sail_route.weather.weather_field import gen_weather_field, \
+        WeatherField, interp_weather
+    times = np.datetime64('2016-01-01T00') + \
+        np.arange(2)*np.timedelta64(3, 'h')
+    coords = {'time': times, 'lat_b': [40.0, 41.0], 'lon_b': [-11.0, -10.0]}
+    corners = np.array([[[350.0, 10.0], [350.0, 10.0]],
+                        [[170.0, 190.0], [170.0, 190.0]]])
+    da = xr.DataArray(corners, dims=('time', 'lat_b', 'lon_b'),
+                      coords=coords)
+    x = np.array([[-10.5, -11.0], [-12.0, -10.75]])
+    y = np.array([[40.5, 41.0], [40.5, 39.0]])
+    field = gen_weather_field(x, y, da, da, da, da, da, method='linear')
+    npt.assert_allclose(field.data[0, :, 0, 0], [180.0, 180.0])
+    npt.assert_allclose(field.data[1, :, 0, 0] % 360.0, [0.0, 180.0],
+                        atol=1e-9)
+    npt.assert_allclose(field.data[0, :, 0, 1], [350.0, 170.0])
+    npt.assert_allclose(field.data[0, :, 1, 0], [350.0, 170.0])
+    npt.assert_allclose(field.data[0, :, 1, 1], [265.0, 175.0])
+    npt.assert_allclose(field.data[1, :, 1, 1], [355.0, 175.0], atol=0.1)
+    with pytest.raises(ValueError):
+        gen_weather_field(x, y, da, da, da, da, da, method='cubic')
+    field = WeatherField(np.array([[[[350.0]], [[20.0]]]]*5),
+                         [0.0, 3600.0])
+    npt.assert_allclose(field.sample([-1.0, 900.0, 1800.0, 7200.0], 0, 0,
+                                     'linear')[1], [350.0, 357.5, 5.0, 20.0])
+    npt.assert_allclose(field.sample(900.0, 0, 0, 'linear')[0], 267.5)
+    npt.assert_array_equal(
+        interp_weather(field.data, field.times, np.array([900.0]),
+                       np.zeros(1, dtype=np.int64),
+                       np.zeros(1, dtype=np.int64))[:, 0],
+        field.sample(900.0, 0, 0, 'linear'))
+
+    route, t, craft, x, y, land, weather = synthetic_scenario()
+    with pytest.raises(ValueError):
+        min_time_calculate(route, t, craft, x, y, land, *weather,
+                           engine='scalar', interp='linear')
+    jt_v, et_v, x_v, y_v = min_time_calculate(route, t, craft, x, y, land,
+                                              *weather, engine='vector',
+                                              interp='linear')
+    jt_n, state, x_n, y_n = min_time_calculate(route, t, craft, x, y, land,
+                                               *weather, state=True,
+                                               interp='linear')
+    et_n, pindxs = to_solution(state)
+    jt_0 = min_time_calculate(route, t, craft, x, y, land, *weather)[0]
+    assert np.isfinite(jt_n) and jt_n != jt_0
+    npt.assert_allclose(jt_n, jt_v, rtol=0, atol=1e-3)
+    finite = np.isfinite(et_v)
+    npt.assert_array_equal(np.isfinite(et_n), finite)
+    npt.assert_allclose(et_n[finite], et_v[finite], rtol=0, atol=1e-3)
+    npt.assert_array_equal(x_n, x_v)
+    npt.assert_array_equal(y_n, y_v)
+    field = gen_weather_field(x, y, *weather, method='linear')
+    first = field.sample(t.timestamp(), 0, np.arange(x.shape[1]), 'linear')
+    reached = state[0]['reachable']
+    npt.assert_allclose(state[0]['tws'][reached], first[0][reached],
+                        rtol=1e-6)
+
+
+@pytest.mark.parametrize("apf, compiled", [(1.0, False), (0.95, False),
+                                           (0.95, True)])
+def test_numba_engine_matches_vector(apf, compiled):
+    """Test the compiled kernel against the vectorised engine."""
+    from sail_route.performance.bbn import gen_env_model
+    from sail_route.performance.compiled_bbn import env_bbn_compile
+    route, t, craft, x, y, land, weather = synthetic_scenario()
+    failure = gen_env_model()
+    if compiled:
+        failure = env_bbn_compile(failure, use_cache=False)
+    craft = first_40(apf, failure)
+    jt_v, et_v, x_v, y_v = min_time_calculate(route, t, craft, x, y, land,
+                                              *weather, engine='vector')
+    jt_n, et_n, x_n, y_n = min_time_calculate(route, t, craft, x, y, land,
+                                              *weather, engine='numba')
+    npt.assert_allclose(jt_n, jt_v, rtol=0, atol=1e-3)
+    npt.assert_array_equal(np.isfinite(et_n), np.isfinite(et_v))
+    finite = np.isfinite(et_v)
+    npt.assert_allclose(et_n[finite], et_v[finite], rtol=0, atol=1e-3)
+    npt.assert_array_equal(x_n, x_v)
+    npt.assert_array_equal(y_n, y_v)
+
+
+def test_profile_counters(tmpdir):
+    """Test the instrumentation of the compiled kernel and ensembles."""
+    import json
+    from sail_route.ensemble import run_ensemble
+    from sail_route.performance.bbn import gen_env_model
+    from sail_route.time_func import Profile
+    from sail_route.weather.weather_field import gen_weather_field, \
+        WeatherField
+    route, t, craft, x, y, land, weather = synthetic_scenario()
+    craft = first_40(0.95, gen_env_model())
+    field = gen_weather_field(x, y, *weather)
+    expected = min_time_calculate(route, t, craft, x, y, land, *weather,
+                                  weather=field)
+    profiles = [Profile('test', run=n) for n in (1, 2)]
+    for n_threads, profile in zip((1, 2), profiles):
+        result = min_time_calculate(route, t, craft, x, y, land, *weather,
+                                    weather=field, n_threads=n_threads,
+                                    profile=profile)
+        assert result[0] == expected[0]
+        npt.assert_array_equal(result[1], expected[1])
+    counters = profiles[0].counters
+    assert counters == profiles[1].counters
+    assert set(profiles[0].timers) == {'solve', 'path'}
+    et = expected[1]
+    reached = np.isfinite(et)
+    assert counters['land_skipped'] == land.sum()
+    assert counters['nodes_expanded'] == reached.sum()
+    assert counters['edges_relaxed'] == (~land[0]).sum() + \
+        (reached[:-1].sum(axis=1)*(~land[1:]).sum(axis=1)).sum() + \
+        reached[-1].sum()
+    assert counters['weather_lookups'] == (~land[0]).sum() + reached.sum()
+    assert counters['bbn_queries'] == counters['polar_lookups'] <= \
+        counters['edges_relaxed']
+    assert counters['infinite_edges'] <= counters['edges_relaxed']
+    data = field.data.copy()
+    data[3, :, 2] = np.nan
+    missing = Profile()
+    min_time_calculate(route, t, craft, x, y, land, *weather,
+                       weather=WeatherField(data, field.times),
+                       profile=missing)
+    unpriced = missing.counters['edges_relaxed'] - \
+        missing.counters['polar_lookups']
+    assert unpriced == reached[2].sum()*(~land[3]).sum()
+    assert missing.counters['infinite_edges'] >= unpriced
+    record = json.loads(profiles[0].to_json())
+    assert record['name'] == 'test' and record['run'] == 1
+    assert record['counters'] == counters
+    fname = str(tmpdir.join("profile.jsonl"))
+    run_ensemble(route, (x, y, land), field, [craft], [t, t], n_workers=1,
+                 profile_fname=fname)
+    with open(fname) as f:
+        records = [json.loads(line) for line in f]
+    assert [r['departure'] for r in records] == [0, 1]
+    assert all(r['counters'] == counters for r in records)
+
+
+def test_compiled_bbn_routing(tmpdir, monkeypatch):
+    """Test routing with a compiled failure model against the BBN."""
+    from sail_route.performance.bbn import gen_env_model
+    from sail_route.performance.compiled_bbn import env_bbn_compile
+    monkeypatch.setenv('SAIL_ROUTE_CACHE', str(tmpdir))
+    route, t, craft, x, y, land, weather = synthetic_scenario()
+    bp = gen_env_model()
+    expected = min_time_calculate(route, t, first_40(0.85, bp), x, y, land,
+                                  *weather, engine='vector')
+    craft = first_40(0.85, env_bbn_compile(bp))
+    result = min_time_calculate(route, t, craft, x, y, land, *weather,
+                                engine='vector')
+    assert result[0] == expected[0]
+    for r, e in zip(result[1:], expected[1:]):
+        npt.assert_array_equal(r, e)
+    result = min_time_calculate(route, t, craft, x, y, land, *weather)
+    npt.assert_allclose(result[0], expected[0], rtol=0, atol=1e-3)
+    npt.assert_array_equal(result[2], expected[2])
+    npt.assert_array_equal(result[3], expected[3])
+
+
+def test_parallel_kernel_is_deterministic():
+    """Test the parallel kernel returns the serial result exactly."""
+    import numba
+    route, t, craft, x, y, land, weather = synthetic_scenario(n=12)
+    serial = min_time_calculate(route, t, craft, x, y, land, *weather)
+    threads = numba.get_num_threads()
+    for n_threads in [2, 4]:
+        parallel = min_time_calculate(route, t, craft, x, y, land,
+                                      *weather, n_threads=n_threads)
+        assert numba.get_num_threads() == threads
+        assert parallel[0] == serial[0]
+        for p, s in zip(parallel[1:], serial[1:]):
+            npt.assert_array_equal(p, s)
+
+
+@pytest.mark.parametrize("seed", [0, 1, 2])
+def test_pruning_keeps_optimum(seed):
+    """Test goal-directed pruning returns the exhaustive route."""
+    route, t, craft, x, y, land, weather = synthetic_scenario(12, seed)
+    jt, et, x_r, y_r = min_time_calculate(route, t, craft, x, y, land,
+                                          *weather)
+    stats = {}
+    jt_p, et_p, x_p, y_p = min_time_calculate(route, t, craft, x, y, land,
+                                              *weather, prune=True,
+                                              stats=stats)
+    assert jt_p == jt
+    npt.assert_array_equal(x_p, x_r)
+    npt.assert_array_equal(y_p, y_r)
+    assert stats['nodes_pruned'] > 0
+    assert stats['edges_pruned'] >= stats['nodes_pruned']
+    assert stats['incumbent'] >= jt
+    reached = np.isfinite(et_p)
+    assert (et_p[reached] >= et[reached]).all()
+
+
+def test_pruning_resolve_profile(monkeypatch):
+    """Test a repeated pruned solve is counted once in the profile."""
+    from sail_route import sail_routing
+    from sail_route.time_func import Profile
+    route, t, craft, x, y, land, weather = synthetic_scenario(12)
+    expected = Profile()
+    jt = min_time_calculate(route, t, craft, x, y, land, *weather,
+                            profile=expected)[0]
+    monkeypatch.setattr(sail_routing, 'goal_bound',
+                        lambda x, *args: np.full(x.shape, 1e12))
+    profile = Profile()
+    assert min_time_calculate(route, t, craft, x, y, land, *weather,
+                              prune=True, profile=profile)[0] == jt
+    assert profile.counters.pop('resolves') == 1
+    assert profile.counters.pop('nodes_pruned') == 0
+    assert profile.counters.pop('edges_pruned') == 0
+    assert profile.counters == expected.counters
+
+
+def test_sparse_connectivity():
+    """Test limited connectivity across engines and against full."""
+    from sail_route.route.connectivity import gen_edges
+    route, t, craft, x, y, land, weather = synthetic_scenario(12)
+    full = min_time_calculate(route, t, craft, x, y, land, *weather)
+    route.max_offset = 11
+    npt.assert_array_equal(min_time_calculate(route, t, craft, x, y, land,
+                                              *weather)[1], full[1])
+    route.max_offset = 2
+    edges = route.edges(x, y)
+    assert edges is route.edges(x.copy(), y.copy())
+    assert edges.n_edges == 11*(12*5 - 6)
+    npt.assert_array_equal(edges.predecessors(3, 0), [0, 1, 2])
+    npt.assert_array_equal(edges.mask(3), np.abs(np.subtract.outer(
+        np.arange(12), np.arange(12))) <= 2)
+    sparse = [min_time_calculate(route, t, craft, x, y, land, *weather,
+                                 engine=e) for e in ['vector', 'numba']]
+    npt.assert_allclose(sparse[1][0], sparse[0][0], rtol=0, atol=1e-3)
+    npt.assert_array_equal(sparse[1][2], sparse[0][2])
+    assert sparse[1][0] >= full[0]
+    width = [np.flatnonzero(y[i] == y_i)[0]
+             for i, y_i in enumerate(sparse[1][3][-2:0:-1])]
+    assert np.abs(np.diff(width)).max() <= 2
+    pruned = min_time_calculate(route, t, craft, x, y, land, *weather,
+                                prune=True)
+    assert pruned[0] == sparse[1][0]
+    heading = gen_edges(x, y, max_heading=30.0)
+    assert 0 < heading.n_edges < 11*12*12
+    sub = edges.subset(np.arange(0, 12, 3))
+    npt.assert_array_equal(sub.mask(5), edges.mask(5)[::3, ::3])
+
+
+def test_grid_geometry(tmpdir):
+    """Test routing over precomputed leg geometry."""
+    from sail_route.route.geometry import gen_geometry, load_geometry
+    route, t, craft, x, y, land, weather = synthetic_scenario(12)
+    for max_offset in [None, 3]:
+        route.max_offset = max_offset
+        expected = min_time_calculate(route, t, craft, x, y, land, *weather)
+        geometry = gen_geometry(route, x, y)
+        path = str(tmpdir.join(str(max_offset)))
+        geometry.save(path)
+        mapped = load_geometry(path)
+        assert isinstance(mapped.legs, np.memmap)
+        for g in [geometry, mapped]:
+            result = min_time_calculate(route, t, craft, x, y, land,
+                                        *weather, geometry=g)
+            npt.assert_allclose(result[0], expected[0], rtol=0, atol=1e-6)
+            npt.assert_array_equal(result[2], expected[2])
+        single = gen_geometry(route, x, y, dtype=np.float32)
+        assert single.nbytes == geometry.nbytes // 2
+        result = min_time_calculate(route, t, craft, x, y, land, *weather,
+                                    geometry=single)
+        npt.assert_allclose(result[0], expected[0], rtol=1e-5)
+        assert mapped.key == geometry.key
+    with pytest.raises(ValueError):
+        route.max_offset = 2
+        min_time_calculate(route, t, craft, x, y, land, *weather,
+                           geometry=geometry)
+    from sail_route.ensemble import run_ensemble
+    from sail_route.weather.weather_field import gen_weather_field
+    route.max_offset = 3
+    moved = Route(route.start, Location(-20.0, 42.0), 12, 12, 1000.0,
+                  craft, max_offset=3)
+    with pytest.raises(ValueError):
+        min_time_calculate(moved, t, craft, x, y, land, *weather,
+                           geometry=geometry)
+    with pytest.raises(ValueError):
+        run_ensemble(moved, (x, y, land), gen_weather_field(x, y, *weather),
+                     [craft], [t], n_workers=1, geometry=geometry)
+
+
+def test_reroute_matches_full_solve():
+    """Test incremental re-routing against solving from scratch."""
+    from sail_route.route.reroute import reroute
+    from sail_route.weather.weather_field import gen_weather_field, \
+        WeatherField
+    route, t, craft, x, y, land, weather = synthetic_scenario(12)
+    route.max_offset = 3
+    field = gen_weather_field(x, y, *weather)
+    expected = min_time_calculate(route, t, craft, x, y, land, *weather)
+    jt, et, pindxs, x_r, y_r = reroute(route, t, craft, x, y, land, field)
+    assert jt == expected[0]
+    npt.assert_array_equal(et, expected[1])
+    npt.assert_array_equal(x_r, expected[2])
+    npt.assert_array_equal(y_r, expected[3])
+    rng = np.random.RandomState(4)
+    data = field.data.copy()
+    data[0, 12:] *= rng.uniform(0.5, 1.5, data[0, 12:].shape)
+    updated = WeatherField(data, field.times)
+    window = (field.times[12], field.times[-1])
+    node = Location(x_r[-5], y_r[-5])
+    now = datetime.fromtimestamp(et[3][y[3] == node.lat][0])
+    for position, when in [(None, t), (node, now)]:
+        full = reroute(route, when, craft, x, y, land, updated,
+                       position=position)
+        stats = {}
+        result = reroute(route, when, craft, x, y, land, updated, et, pindxs,
+                         window, position, stats=stats, times=field.times)
+        assert result[0] == full[0]
+        npt.assert_array_equal(result[1], full[1])
+        npt.assert_array_equal(result[3], full[3])
+        npt.assert_array_equal(result[4], full[4])
+        assert 0 < stats['nodes_recomputed'] < x.size
+    assert full[3][-1] == node.long and full[4][-1] == node.lat
+    with pytest.raises(ValueError):
+        reroute(route, t, craft, x, y, land, updated, et, pindxs, window,
+                times=field.times + 3600.0)
+    with pytest.raises(ValueError):
+        reroute(route, t, craft, x, y, land, updated, et, pindxs, window)
+
+
+def test_reroute_linear():
+    """Test re-routing with weather interpolated in time."""
+    from sail_route.route.reroute import reroute
+    from sail_route.weather.weather_field import gen_weather_field, \
+        WeatherField
+    route, t, craft, x, y, land, weather = synthetic_scenario(12)
+    route.max_offset = 3
+    field = gen_weather_field(x, y, *weather)
+    expected = min_time_calculate(route, t, craft, x, y, land, None, None,
+                                  None, None, None, weather=field,
+                                  interp='linear')
+    jt, et, pindxs, x_r, y_r = reroute(route, t, craft, x, y, land, field,
+                                       interp='linear')
+    npt.assert_allclose(jt, expected[0], rtol=0, atol=1e-6)
+    npt.assert_array_equal(x_r, expected[2])
+    data = field.data.copy()
+    data[0, 12:] *= 0.8
+    updated = WeatherField(data, field.times)
+    full = reroute(route, t, craft, x, y, land, updated, interp='linear')
+    result = reroute(route, t, craft, x, y, land, updated, et, pindxs,
+                     (field.times[12], field.times[-1]), times=field.times,
+                     interp='linear')
+    assert result[0] == full[0]
+    npt.assert_array_equal(result[1], full[1])
+    with pytest.raises(ValueError):
+        reroute(route, t, craft, x, y, land, field, interp='cubic')
+
+
+def test_node_state(tmpdir):
+    """Test the structured node state against the solver's arrays."""
+    from sail_route.performance.bbn import gen_env_model
+    from sail_route.route.reroute import reroute
+    from sail_route.route.node_state import to_solution, save_state, \
+        load_state, node_dtype, from_solution
+    from sail_route.weather.weather_field import gen_weather_field, \
+        WeatherField
+    route, t, craft, x, y, land, weather = synthetic_scenario()
+    craft = first_40(0.95, gen_env_model())
+    jt, state, x_r, y_r = min_time_calculate(route, t, craft, x, y, land,
+                                             *weather, state=True)
+    expected = reroute(route, t, craft, x, y, land,
+                       gen_weather_field(x, y, *weather))
+    assert state.dtype == node_dtype and state.shape == x.shape
+    et, pindxs = to_solution(state)
+    npt.assert_array_equal(state['reachable'], np.isfinite(expected[1]))
+    npt.assert_allclose(et[state['reachable']],
+                        expected[1][state['reachable']], rtol=0, atol=1e-6)
+    npt.assert_array_equal(pindxs[state['reachable']],
+                           expected[2][state['reachable']])
+    assert np.all(~np.isfinite(et[~state['reachable']]))
+    reached = state[1:][state[1:]['reachable']]
+    fail = state['fail'].ravel()
+    assert np.all((fail[reached['pred']] <= reached['fail']) &
+                  (reached['fail'] < 1.0))
+    field = gen_weather_field(x, y, *weather)
+    jt_s, solved, x_s, y_s = reroute(route, t, craft, x, y, land, field,
+                                     state=True)
+    assert jt_s == expected[0]
+    npt.assert_array_equal(x_s, expected[3])
+    exported = from_solution(route, t, craft, x, y, expected[1],
+                             expected[2], field)
+    for name in ['time', 'pred', 'reachable', 'tws', 'twd', 'wd', 'wh',
+                 'wp']:
+        npt.assert_array_equal(solved[name], exported[name])
+    npt.assert_allclose(solved['fail'], exported['fail'], atol=1e-6)
+    data = field.data.copy()
+    data[0, 12:] *= 0.8
+    updated = WeatherField(data, field.times)
+    window = (field.times[12], field.times[-1])
+    full = reroute(route, t, craft, x, y, land, updated, state=True)
+    stats = {}
+    result = reroute(route, t, craft, x, y, land, updated, solved,
+                     window=window, stats=stats, times=field.times,
+                     state=True)
+    assert stats['nodes_recomputed'] < x.size
+    npt.assert_allclose(result[0], full[0], rtol=0, atol=1e-5)
+    npt.assert_array_equal(result[1]['pred'], full[1]['pred'])
+    assert np.abs(result[1]['time'] - full[1]['time']).max() <= 1
+    fname = str(tmpdir.join("state.npy"))
+    save_state(fname, state)
+    loaded = load_state(fname)
+    assert isinstance(loaded, np.memmap)
+    npt.assert_array_equal(loaded, state)
+    np.save(fname, et)
+    with pytest.raises(ValueError):
+        load_state(fname)
+
+
+def test_ensemble_matches_single_runs(tmpdir):
+    """Test the process pool ensemble against individual simulations."""
+    from sail_route.ensemble import run_ensemble, iter_ensemble
+    from sail_route.route.geometry import gen_geometry
+    from sail_route.weather.weather_field import gen_weather_field
+    route, t, craft, x, y, land, weather = synthetic_scenario()
+    field = gen_weather_field(x, y, *weather)
+    crafts = [first_40(), polar(craft.tws_range, craft.twa_range,
+                                craft.perf, 0.9)]
+    times = [datetime(2016, 1, 1, 0), datetime(2016, 1, 1, 12)]
+    fname = str(tmpdir.join("ensemble.txt"))
+    table = run_ensemble(route, (x, y, land), field, crafts, times,
+                         n_workers=2, fname=fname,
+                         geometry=gen_geometry(route, x, y))
+    expected = [min_time_calculate(route, d, c, x, y, land, *weather)[0]
+                for d in times for c in crafts]
+    npt.assert_array_equal(table[:, 3], expected)
+    npt.assert_array_equal(table[:, 1], [1.0, 0.9, 1.0, 0.9])
+    npt.assert_allclose(np.loadtxt(fname), table, atol=1e-3)
+    for r in iter_ensemble(route, (x, y, land), field, crafts[:1], times,
+                           n_workers=2, return_times=True):
+        et = min_time_calculate(route, r['time'], crafts[0], x, y, land,
+                                *weather)[1]
+        npt.assert_array_equal(r['earl_time'], et)
+    assert 'earl_time' not in next(iter_ensemble(
+        route, (x, y, land), field, crafts[:1], times[:1], n_workers=1))
+
+
+def test_weather_store(tmpdir):
+    """Test routing over weather memory-mapped from a weather store."""
+    from sail_route.ensemble import run_ensemble
+    from sail_route.weather.weather_field import gen_weather_field, \
+        WeatherField
+    from sail_route.weather.weather_store import write_weather_store, \
+        open_weather_store, read_header
+    route, t, craft, x, y, land, weather = synthetic_scenario()
+    field = gen_weather_field(x, y, *weather)
+    path = str(tmpdir.join("weather.bin"))
+    write_weather_store(path, field, x, y)
+    shape, offset = read_header(path)
+    assert shape == field.data.shape and offset % 4096 == 0
+    store = open_weather_store(path, x, y)
+    assert isinstance(store.data, np.memmap)
+    assert store.data.dtype == np.float32
+    npt.assert_array_equal(store.times, field.times)
+    single = WeatherField(field.data.astype(np.float32), field.times)
+    npt.assert_array_equal(store.data, single.data)
+    expected = min_time_calculate(route, t, craft, x, y, land, *weather,
+                                  weather=single)
+    result = min_time_calculate(route, t, craft, x, y, land, *weather,
+                                weather=store)
+    assert result[0] == expected[0]
+    npt.assert_array_equal(result[2], expected[2])
+    reference = min_time_calculate(route, t, craft, x, y, land, *weather)
+    npt.assert_allclose(result[0], reference[0], rtol=1e-6)
+    times = [datetime(2016, 1, 1, 0), datetime(2016, 1, 1, 12)]
+    tables = [run_ensemble(route, (x, y, land), store, [craft], times,
+                           n_workers=n) for n in [1, 2]]
+    npt.assert_array_equal(tables[0], tables[1])
+    with pytest.raises(ValueError):
+        open_weather_store(path, x + 1.0, y)
+    with pytest.raises(ValueError):
+        open_weather_store(os.path.join(test_data, "first_40_farr.csv"))
+
+
+def test_path_extraction():
+    """Test iterative path extraction on a grid deeper than recursion."""
+    from sail_route.route.grid_locations import gen_indx
+    from sail_route.route.solve_route import shortest_path, get_locs, \
+        extract_route, best_paths
+    n_ranks, n_width = 5000, 7
+    rng = np.random.RandomState(3)
+    indx, pindx = gen_indx(np.zeros((n_ranks, n_width)))
+    pindx[1:] = indx[:-1][np.arange(n_ranks-1)[:, None],
+                          rng.randint(0, n_width, (n_ranks-1, n_width))]
+    x = rng.uniform(size=(n_ranks, n_width))
+    y = rng.uniform(size=(n_ranks, n_width))
+    et = np.cumsum(np.ones((n_ranks, n_width)), axis=0)
+    end_node = indx[-1, 4]
+    sp = shortest_path(indx, pindx, [end_node])
+    assert sp.shape[0] == n_ranks + 1
+    assert sp[0] == end_node and sp[-1] == -1
+    for a, b in zip(sp[:-2], sp[1:-1]):
+        assert pindx[a // n_width, a % n_width] == b
+    x_r, y_r = get_locs(indx, sp, x, y)
+    xs, ys, times, conditions = extract_route(pindx, end_node, x, y, et)
+    npt.assert_array_equal(xs, x_r[::-1])
+    npt.assert_array_equal(ys, y_r[::-1])
+    npt.assert_array_equal(times, np.arange(1, n_ranks + 1))
+    assert conditions is None
+    terminal = np.array([5.0, np.inf, 1.0, 3.0, 2.0, np.inf, 4.0])
+    paths = best_paths(pindx, terminal, k=3)
+    assert [p[-1] % n_width for p in paths] == [2, 4, 3]
+    assert len(best_paths(pindx, terminal, k=10)) == 5
+
+
+def test_best_paths_to_finish():
+    """Test ranking the final rank by its arrival at the finish."""
+    from sail_route.route.reroute import reroute
+    from sail_route.route.geometry import gen_geometry
+    from sail_route.route.solve_route import finish_times, best_paths
+    from sail_route.weather.weather_field import gen_weather_field
+    route, t, craft, x, y, land, weather = synthetic_scenario(12)
+    field = gen_weather_field(x, y, *weather)
+    expected = min_time_calculate(route, t, craft, x, y, land, *weather)
+    jt, et, pindxs, x_r, y_r = reroute(route, t, craft, x, y, land, field)
+    finish = finish_times(route, craft, x, y, et, field)
+    assert finish.min() == expected[0]
+    geometry = gen_geometry(route, x, y)
+    npt.assert_allclose(finish_times(route, craft, x, y, et, field,
+                                     geometry=geometry), finish,
+                        rtol=0, atol=1e-6)
+    paths = best_paths(pindxs, finish, k=3)
+    i, j = np.unravel_index(paths[0], x.shape)
+    npt.assert_array_equal(x[i, j][::-1], expected[2][1:-1])
+    npt.assert_array_equal(y[i, j][::-1], expected[3][1:-1])
+    ends = [p[-1] % x.shape[1] for p in paths]
+    assert list(np.sort(finish)[:3]) == list(finish[ends])
+
+
+def test_land_mask(tmpdir, monkeypatch):
+    """Test the vectorised land mask against Basemap and its cache."""
+    Basemap = pytest.importorskip('mpl_toolkits.basemap').Basemap
+    from sail_route.route.land_mask import land_mask
+    monkeypatch.setenv('SAIL_ROUTE_CACHE', str(tmpdir))
+    x, y = np.meshgrid(np.linspace(-30.0, 10.0, 23),
+                       np.linspace(0.0, 60.0, 17))
+    bm = Basemap()
+    expected = np.array([[bm.is_land(a, b) for a, b in zip(r_x, r_y)]
+                         for r_x, r_y in zip(x, y)])
+    mask = land_mask(x, y)
+    npt.assert_array_equal(mask, expected)
+    assert len(tmpdir.join('land').listdir()) == 1
+    npt.assert_array_equal(land_mask(x, y), expected)
+    npt.assert_array_equal(land_mask(x, y, use_cache=False), expected)
+
+
+def test_gen_grid():
+    """Test the vectorised grid against geodesics along each rank."""
+    import pyproj
+    from sail_route.route.grid_locations import gen_grid
+    grid = gen_grid(-2.37, -61.777, 50.256, 17.038, 12, 9, 250000.0)
+    assert grid.shape == (12, 9, 2)
+    g = pyproj.Geod(ellps='clrk66')
+    for rank in grid:
+        npt.assert_array_equal(rank[:, 0], rank[0, 0])
+        inner = np.array(g.npts(rank[0, 0], rank[0, 1], rank[-1, 0],
+                                rank[-1, 1], 7))
+        npt.assert_allclose(rank[1:-1], inner, atol=1e-7)
+
+
+def test_core_import_is_light():
+    """Test routing imports without the plotting and GIS packages."""
+    import subprocess
+    import sys
+    probe = ("import sys; before = set(sys.modules); "
+             "import {0}; "
+             "print(' '.join({{m.split('.')[0] for m in "
+             "set(sys.modules) - before}}))")
+    root = os.path.join(os.path.dirname(__file__), '..')
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(
+        [root] + [p for p in [os.environ.get('PYTHONPATH')] if p]))
+
+    def loaded(modules):
+        return subprocess.run([sys.executable, '-c', probe.format(modules)],
+                              env=env, capture_output=True, check=True,
+                              text=True).stdout.split()
+    core = loaded('sail_route.sail_routing, sail_route.ensemble')
+    for package in ['matplotlib', 'mpl_toolkits', 'iris', 'cartopy',
+                    'shapely', 'pyproj', 'pgmpy', 'xarray']:
+        assert package not in core
+    assert 'xesmf' not in loaded('sail_route.weather.load_weather')
+    from sail_route import sail_routing
+    with pytest.raises(AttributeError):
+        sail_routing.plot_nothing
+    pytest.importorskip('mpl_toolkits.basemap')
+    from sail_route.plotting import plot_route
+    assert sail_routing.plot_mt_route is plot_route.plot_mt_route
+
+
+def test_jit_cache_stamp(tmpdir, monkeypatch):
+    """Test the compile cache is stale until its stamp is written."""
+    import numba
+    from sail_route import jit_cache
+    monkeypatch.setenv('NUMBA_CACHE_DIR', str(tmpdir))
+    assert jit_cache.stamp_path().startswith(str(tmpdir))
+    assert jit_cache.is_stale()
+    jit_cache.write_stamp()
+    assert not jit_cache.is_stale()
+    with open(jit_cache.stamp_path(), 'w') as f:
+        f.write('0')
+    assert jit_cache.is_stale()
+    kernels = jit_cache.dispatchers()
+    assert 'sail_route.route.kernel.min_time_kernel' in kernels
+    assert 'sail_route.route.kernel.min_time_kernel_parallel' not in kernels
+    assert jit_cache.startup('lazy') is None
+    with pytest.raises(ValueError):
+        jit_cache.startup('eager')
+    numba_dir = numba.config.CACHE_DIR
+    assert jit_cache.use_cache_dir() == str(tmpdir)
+    assert numba.config.CACHE_DIR == numba_dir
+    monkeypatch.delenv('NUMBA_CACHE_DIR')
+    tmpdir.join('file').write('')
+    monkeypatch.setenv('SAIL_ROUTE_CACHE', str(tmpdir.join('file', 'x')))
+    assert jit_cache.use_cache_dir() is None
+    assert jit_cache.startup('build') is None
+    assert numba.config.CACHE_DIR == numba_dir
+
+
+def test_import_leaves_numba_cache(tmpdir):
+    """Test importing leaves numba's cache unless a job opts in."""
+    import subprocess
+    import sys
+    probe = ("import os, numba; before = numba.config.CACHE_DIR; "
+             "import sail_route.sail_routing; from sail_route import "
+             "jit_cache; print(numba.config.CACHE_DIR == before, "
+             "'NUMBA_CACHE_DIR' in os.environ); jit_cache.use_cache_dir(); "
+             "print(jit_cache.dispatchers()['sail_route.route.kernel."
+             "min_time_kernel']._cache._cache_path)")
+    root = os.path.join(os.path.dirname(__file__), '..')
+    env = {k: v for k, v in os.environ.items() if k != 'NUMBA_CACHE_DIR'}
+    env['PYTHONPATH'] = os.pathsep.join(
+        [root] + [p for p in [os.environ.get('PYTHONPATH')] if p])
+    tmpdir.join('file').write('')
+    for cache, shared in [(tmpdir.join('file', 'x'), False),
+                          (tmpdir.join('cache'), True)]:
+        env['SAIL_ROUTE_CACHE'] = str(cache)
+        out = subprocess.run([sys.executable, '-c', probe], env=env,
+                             capture_output=True, check=True,
+                             text=True).stdout.split('\n')
+        assert out[0] == 'True False'
+        assert out[1].startswith(str(cache)) == shared
@@ -0,0 +1,112 @@
+"""
+Functions testing the loading and caching of weather data.
+
+Thomas Dickson
+thomas.dickson@soton.ac.uk
+"""
+
+from context import *
+from sail_route.weather.load_weather import save_dataarray, load_dataarray
+import pytest
+import numpy as np
+import numpy.testing as npt
+import xarray as xr
+
+
+def test_dataarray_cache_roundtrip(tmpdir):
+    """Test a regridded DataArray survives saving to the cache."""
+    times = np.datetime64('2016-01-01T00') + \
+        np.arange(4)*np.timedelta64(3, 'h')
+    lons = np.linspace(-20.0, -10.0, 5)
+    lats = np.linspace(40.0, 45.0, 3)
+    da = xr.DataArray(np.random.RandomState(1).uniform(size=(4, 3, 5)),
+                      dims=('time', 'lat_b', 'lon_b'), name='swh',
+                      coords={'time': times, 'lat': ('lat_b', lats),
+                              'lon': ('lon_b', lons)})
+    path = str(tmpdir.join('swh'))
+    save_dataarray(path, da)
+    loaded = load_dataarray(path)
+    xr.testing.assert_identical(loaded, da)
+    npt.assert_array_equal(loaded.sel(time=times[2]).data, da.data[2])
+
+
+def test_windowed_load(tmpdir):
+    """Test loading a time window and box of a NetCDF file lazily."""
+    from datetime import datetime
+    from sail_route.weather.load_weather import load_dataset, dilate
+    times = np.datetime64('2016-01-01T00') + \
+        np.arange(40)*np.timedelta64(3, 'h')
+    lat = np.arange(90.0, -91.0, -10.0)
+    lon = np.arange(0.0, 360.0, 10.0)
+    ds = xr.Dataset({'wind': (('time', 'latitude', 'longitude'),
+                              np.random.RandomState(2).uniform(
+                                  size=(40, lat.size, lon.size)))},
+                    coords={'time': times, 'latitude': lat,
+                            'longitude': lon})
+    path = str(tmpdir.join('era5.nc'))
+    ds.to_netcdf(path)
+    full = load_dataset(path, 'wind')
+    window = (datetime(2016, 1, 2, 1), datetime(2016, 1, 3, 1))
+    da = load_dataset(path, 'wind', window, (-25.0, 15.0, 15.0, 45.0))
+    npt.assert_array_equal(da.indexes['time'], times[8:18])
+    npt.assert_array_equal(da['longitude'], [310.0, 320.0, 330.0, 340.0,
+                                             350.0, 0.0, 10.0, 20.0, 30.0])
+    npt.assert_array_equal(da['latitude'], np.arange(60.0, -11.0, -10.0))
+    xr.testing.assert_identical(da, full.sel(time=da['time'],
+                                             latitude=da['latitude'],
+                                             longitude=da['longitude']))
+    for t in times[8:18]:
+        xr.testing.assert_identical(da.sel(time=t, method='nearest'),
+                                    full.sel(time=t, method='nearest',
+                                             latitude=da['latitude'],
+                                             longitude=da['longitude']))
+    narrow = load_dataset(path, 'wind', window, (12.0, 22.0, 14.0, 24.0))
+    npt.assert_array_equal(narrow['longitude'], [350.0, 0.0, 10.0, 20.0,
+                                                 30.0])
+    npt.assert_array_equal(narrow['latitude'], [40.0, 30.0, 20.0, 10.0, 0.0])
+    single = load_dataset(path, 'wind', bbox=(12.0, 22.0, 14.0, 24.0), pad=0)
+    assert single.shape == (40, 1, 1)
+    assert single['longitude'] == 10.0 and single['latitude'] == 20.0
+    mask = np.zeros(8, dtype=bool)
+    mask[[0, 5]] = True
+    npt.assert_array_equal(dilate(mask, 1), [1, 1, 0, 0, 1, 1, 1, 0])
+    npt.assert_array_equal(dilate(mask, 1, wrap=True),
+                           [1, 1, 0, 0, 1, 1, 1, 1])
+
+
+def test_synthetic_weather():
+    """Test the synthetic weather systems in the regridded layout."""
+    from datetime import datetime
+    from sail_route.weather.synthetic import synthetic_weather, grid_axes, \
+        time_axis, systems
+    from sail_route.weather.weather_field import gen_weather_field
+    x = np.linspace(-10.0, -20.0, 6)[:, None] + np.zeros((6, 4))
+    y = np.linspace(45.0, 40.0, 6)[:, None] + np.linspace(-1.0, 1.0, 4)
+    lon, lat = grid_axes(x, y)
+    times = time_axis(datetime(2016, 1, 1), 8)
+    for kind in systems:
+        arrays = synthetic_weather(kind, lon, lat, times)
+        assert len(arrays) == 5
+        for a in arrays:
+            assert a.dims == ('time', 'lat_b', 'lon_b')
+            assert a.shape == (8, lat.size, lon.size)
+            assert np.all(np.isfinite(a.values))
+        tws, twd, wd, wh, wp = [a.values for a in arrays]
+        assert np.all(tws >= 0.0) and np.all((twd >= 0.0) & (twd < 360.0))
+        npt.assert_array_equal(wd, twd)
+        assert np.all(np.diff(wh.ravel()[np.argsort(tws.ravel())]) >= 0.0)
+        field = gen_weather_field(x, y, *arrays)
+        assert field.data.shape == (5, 8, 6, 4)
+    tws, twd = synthetic_weather('uniform', lon, lat, times, tws=8.0,
+                                 twd=-90.0)[:2]
+    assert np.all(tws.values == 8.0) and np.all(twd.values == 270.0)
+    twd = synthetic_weather('frontal', lon, lat, times, lon0=-15.0,
+                            tilt=0.0, speed=0.0, width=1.0)[1].values
+    npt.assert_allclose(twd[0, 0, [0, -1]], [315.0, 225.0], atol=1.0)
+    tws, twd = [a.values for a in synthetic_weather(
+        'rotating_low', lon, lat, times, lon0=-15.0, lat0=42.5,
+        speed=(0.0, 0.0), inflow=0.0)[:2]]
+    east = (lat == 42.5, lon == -11.0)
+    npt.assert_allclose(twd[0][east], 180.0)
+    with pytest.raises(ValueError):
+        synthetic_weather('hurricane', lon, lat, times)